@@ -1,15 +1,24 @@
-from flask import Flask, jsonify, request
+from flask import Flask, jsonify, request, Response, stream_with_context
 import imaplib
 import email
 from email.header import decode_header
 from datetime import datetime
 import os
-from openai import OpenAI
 from flask_cors import CORS
 from dotenv import load_dotenv
 from pymongo import MongoClient
 from bson import ObjectId
 import requests
+import heapq
+import json
+import base64
+from attachment_store import attachment_size, iter_attachment_range, read_attachment
+from summary_cache import cache_stats
+from chat_cache import chat_cache
+from mailbox_stats import RECENT_FIELDS, get_stats, category_distribution, start_reconciler
+from db_indexes import ensure_indexes, check_query_plans
+from urllib.parse import quote
+from contextlib import closing
 
 app = Flask(__name__)
 CORS(app, resources={
@@ -39,16 +48,6 @@ AZURE_ENDPOINT = os.getenv('AZURE_ENDPOINT')
 AZURE_DEPLOYMENT_NAME = os.getenv('AZURE_DEPLOYMENT_NAME')
 AZURE_API_VERSION = os.getenv('AZURE_API_VERSION')
 
-# OpenAI client setup
-client = OpenAI(
-    base_url="https://openrouter.ai/api/v1",
-    api_key=os.getenv('OPENROUTER_API_KEY'),
-    default_headers={  # Required headers for OpenRouter
-        "HTTP-Referer": "http://localhost:3000",
-        "X-Title": "Email Summary Service"
-    }
-)
-
 # MongoDB setup
 MONGO_URI = "mongodb://localhost:27017"
 mongo_client = MongoClient(MONGO_URI)
@@ -68,83 +67,123 @@ def get_emails():
         ).sort('email_id', -1).limit(2))
         
         return jsonify({
-            "summaries": [email['summary'] for email in emails]
+            "summaries": [email.get('summary', '') for email in emails]
         })
     except Exception as e:
         print(f"Error: {e}")
         return jsonify({"error": str(e)}), 500
 
+# Fields the stored-emails list can return, with the value used when a
+# document is missing one
+STORED_EMAIL_DEFAULTS = {
+    'subject': 'No Subject',
+    'sender': 'Unknown Sender',
+    'date': '',
+    'body': '',
+    'summary': '',
+    'category': 'primary',
+    'isRead': False,
+    'isStarred': False,
+    'labels': [],
+    'has_attachments': False,
+    'pdf_attachments': [],
+    'processed_at': ''
+}
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+# Every query below is backed by an index from the db_indexes registry,
+# including the (processed_at, _id) keyset sort
+ensure_indexes()
+
+def encode_cursor(doc):
+    """Build an opaque `<processed_at>,<_id>` cursor from the last document of a page"""
+    processed_at = doc.get('processed_at')
+    if isinstance(processed_at, datetime):
+        processed_at = processed_at.isoformat()
+    return f"{processed_at or ''},{doc['_id']}"
+
+def parse_cursor(value):
+    """Parse a cursor produced by encode_cursor into (processed_at, ObjectId)"""
+    processed_at, _, object_id = value.rpartition(',')
+    return (datetime.fromisoformat(processed_at) if processed_at else None), ObjectId(object_id)
+
+def keyset_filter(cursor):
+    """Mongo filter selecting documents that sort after the cursor in (processed_at, _id) descending order"""
+    processed_at, object_id = cursor
+    clauses = [{'processed_at': processed_at, '_id': {'$lt': object_id}}]
+    if processed_at is not None:
+        # Documents without processed_at sort last, after every dated one
+        clauses.insert(0, {'processed_at': {'$lt': processed_at}})
+        clauses.append({'processed_at': None})
+    return {'$or': clauses}
+
+def parse_page_size(value):
+    """Clamp the `limit` query parameter to [1, MAX_PAGE_SIZE]"""
+    if value is None:
+        return DEFAULT_PAGE_SIZE
+    return max(1, min(int(value), MAX_PAGE_SIZE))
+
+def format_stored_email(email, fields):
+    """Format a stored email document for the frontend, restricted to `fields`"""
+    formatted_email = {'id': str(email['_id'])}
+    for field in fields:
+        value = email.get(field, STORED_EMAIL_DEFAULTS[field])
+        # Ensure processed_at is string
+        if isinstance(value, datetime):
+            value = value.isoformat()
+        formatted_email[field] = value
+    return formatted_email
+
 @app.route('/api/stored-emails')
 def get_stored_emails():
     try:
-        stored_emails = list(emails_collection.find(
-            {},
-            {
-                'subject': 1,
-                'sender': 1,
-                'date': 1,
-                'body': 1,
-                'summary': 1,
-                'processed_at': 1,
-                'has_attachments': 1,
-                'pdf_attachments': 1,
-                'category': 1,
-                'isRead': 1,
-                'isStarred': 1,
-                'labels': 1,
-                '_id': 1
-            }
-        ).sort('processed_at', -1))
-        
-        # Add debug logging
-        print(f"Found {len(stored_emails)} emails")
-        
+        # ?fields=subject,sender,summary lets list views skip the body
+        fields = list(STORED_EMAIL_DEFAULTS)
+        if request.args.get('fields'):
+            fields = [field.strip() for field in request.args['fields'].split(',') if field.strip()]
+            unknown = [field for field in fields if field not in STORED_EMAIL_DEFAULTS]
+            if unknown:
+                return jsonify({"error": f"Unknown fields: {', '.join(unknown)}", "emails": []}), 400
+
+        try:
+            limit = parse_page_size(request.args.get('limit'))
+            query = keyset_filter(parse_cursor(request.args['after'])) if request.args.get('after') else {}
+        except Exception as e:
+            return jsonify({"error": f"Invalid pagination parameters: {e}", "emails": []}), 400
+
+        # processed_at is always projected since the next cursor is built from it
+        projection = {field: 1 for field in fields}
+        projection['processed_at'] = 1
+
+        # Fetch one extra document to know whether another page exists
+        stored_emails = list(emails_collection.find(query, projection).sort([
+            ('processed_at', -1),
+            ('_id', -1)
+        ]).limit(limit + 1))
+        has_more = len(stored_emails) > limit
+        stored_emails = stored_emails[:limit]
+
         # Format emails for frontend
         formatted_emails = []
         for email in stored_emails:
             try:
-                # Convert MongoDB ObjectId to string
-                email_id = str(email['_id'])
-                
-                # Ensure processed_at is string
-                processed_at = email.get('processed_at', '')
-                if isinstance(processed_at, datetime):
-                    processed_at = processed_at.isoformat()
-                
-                formatted_email = {
-                    'id': email_id,
-                    'subject': email.get('subject', 'No Subject'),
-                    'sender': email.get('sender', 'Unknown Sender'),
-                    'date': email.get('date', ''),
-                    'body': email.get('body', ''),
-                    'summary': email.get('summary', ''),
-                    'category': email.get('category', 'primary'),
-                    'isRead': email.get('isRead', False),
-                    'isStarred': email.get('isStarred', False),
-                    'labels': email.get('labels', []),
-                    'has_attachments': email.get('has_attachments', False),
-                    'pdf_attachments': email.get('pdf_attachments', []),
-                    'processed_at': processed_at
-                }
-                formatted_emails.append(formatted_email)
-                
+                formatted_emails.append(format_stored_email(email, fields))
             except Exception as e:
                 print(f"Error formatting email {email.get('_id')}: {e}")
                 continue
-        
-        # Add more debug logging
-        print(f"Successfully formatted {len(formatted_emails)} emails")
-        
-        response = {
-            "total": len(formatted_emails),
-            "emails": formatted_emails
-        }
-        
-        # Final debug log
-        print(f"Sending response with {len(formatted_emails)} emails")
-        
-        return jsonify(response)
-        
+
+        print(f"Sending page with {len(formatted_emails)} emails")
+
+        return jsonify({
+            # The whole collection from its metadata (no scan); count is this page
+            "total": emails_collection.estimated_document_count(),
+            "count": len(formatted_emails),
+            "emails": formatted_emails,
+            "has_more": has_more,
+            "next_cursor": encode_cursor(stored_emails[-1]) if has_more else None
+        })
+
     except Exception as e:
         print(f"Error in get_stored_emails: {e}")
         return jsonify({"error": str(e), "emails": []}), 500
@@ -159,12 +198,69 @@ def get_attachment(attachment_id):
             
         return jsonify({
             "filename": attachment["filename"],
-            "content": attachment["content"]  # Base64 encoded PDF
+            "content": base64.b64encode(read_attachment(attachment)).decode()  # Base64 encoded PDF
         })
     except Exception as e:
         print(f"Error: {e}")
         return jsonify({"error": str(e)}), 500
 
+def content_disposition(filename):
+    """inline Content-Disposition value, with an RFC 5987 filename for non-ASCII names"""
+    try:
+        filename.encode('ascii')
+        return 'inline; filename="%s"' % filename.replace('"', '')
+    except UnicodeEncodeError:
+        return "inline; filename*=UTF-8''%s" % quote(filename)
+
+@app.route('/api/attachment/<attachment_id>/raw')
+def download_attachment(attachment_id):
+    """Stream an attachment as application/pdf with Range and ETag support"""
+    try:
+        attachment = attachments_collection.find_one({"_id": ObjectId(attachment_id)})
+        if not attachment:
+            return jsonify({"error": "Attachment not found"}), 404
+
+        size = attachment_size(attachment)
+        # Blob-backed attachments are content addressed; legacy inline ones
+        # are never modified in place
+        etag = attachment.get("sha256") or f"{attachment_id}-{size}"
+
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+            response.set_etag(etag)
+            return response
+
+        start, stop, status = 0, size, 200
+        if_range = request.headers.get('If-Range')
+        if request.range and request.range.units == 'bytes' and (not if_range or if_range.strip('"') == etag):
+            if len(request.range.ranges) == 1:
+                byte_range = request.range.range_for_length(size)
+                if byte_range is None:
+                    response = Response(status=416)
+                    response.headers['Content-Range'] = f"bytes */{size}"
+                    return response
+                start, stop = byte_range
+                status = 206
+
+        response = Response(
+            stream_with_context(iter_attachment_range(attachment, start, stop)),
+            status=status,
+            mimetype='application/pdf',
+            direct_passthrough=True
+        )
+        response.content_length = stop - start
+        response.accept_ranges = 'bytes'
+        if status == 206:
+            response.content_range = f"bytes {start}-{stop - 1}/{size}"
+        response.set_etag(etag)
+        response.headers['Content-Disposition'] = content_disposition(attachment["filename"])
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        return response
+    except Exception as e:
+        print(f"Error streaming attachment: {e}")
+        return jsonify({"error": str(e)}), 500
+
 @app.route('/api/attachments')
 def get_attachments():
     try:
@@ -256,254 +352,164 @@ def get_schedules():
             "schedules": []
         }), 500
 
+def format_categorized_email(email):
+    """Format a regular email document for the categorized list"""
+    # Format date if it exists, otherwise use processed_at
+    try:
+        if isinstance(email.get('date'), str):
+            date = email['date']
+        else:
+            date = email.get('processed_at', datetime.now()).isoformat()
+    except:
+        date = datetime.now().isoformat()
+
+    # Ensure sender is properly formatted
+    sender = email.get('sender', 'Unknown Sender')
+    if not sender or sender.strip() == '':
+        sender = 'Unknown Sender'
+
+    return {
+        'id': str(email['_id']),
+        'subject': email.get('subject', 'No Subject'),
+        'sender': sender,
+        'date': date,
+        'body': email.get('body', ''),
+        'summary': email.get('summary', ''),
+        'category': email.get('category', 'primary'),
+        'isRead': email.get('isRead', False),
+        'isStarred': email.get('isStarred', False),
+        'labels': email.get('labels', []),
+        'has_attachments': email.get('has_attachments', False),
+        'pdf_attachments': email.get('pdf_attachments', []),
+        'processed_at': (email.get('processed_at') or datetime.now()).isoformat()
+    }
+
+def format_categorized_spam(spam):
+    """Format a spam email document for the categorized list"""
+    return {
+        'id': str(spam['_id']),
+        'subject': spam.get('subject', 'No Subject'),
+        'sender': spam.get('sender', 'Unknown Sender'),
+        'date': spam.get('date', ''),
+        'body': spam.get('body', ''),
+        'summary': 'Spam email',  # Default summary for spam
+        'category': 'spam',  # Always mark as spam
+        'isRead': spam.get('isRead', False),
+        'isStarred': spam.get('isStarred', False),
+        'labels': ['spam'],  # Add spam label
+        'has_attachments': spam.get('has_attachments', False),
+        'pdf_attachments': spam.get('pdf_attachments', []),
+        'processed_at': (spam.get('processed_at') or datetime.now()).isoformat(),
+        'detected_at': (spam.get('detected_at') or datetime.now()).isoformat()
+    }
+
+def merge_key(doc):
+    """Sort key shared by both collections; documents without processed_at sort last"""
+    return (doc.get('processed_at') or datetime.min, doc['_id'])
+
+def iter_categorized_emails(query):
+    """Lazily merge the inbox and spam cursors, both already sorted by (processed_at, _id) descending"""
+    sort = [('processed_at', -1), ('_id', -1)]
+
+    def tagged(cursor, formatter):
+        for doc in cursor:
+            yield doc, formatter
+
+    merged = heapq.merge(
+        tagged(emails_collection.find(query).sort(sort), format_categorized_email),
+        tagged(spam_emails_collection.find(query).sort(sort), format_categorized_spam),
+        key=lambda item: merge_key(item[0]),
+        reverse=True
+    )
+    for doc, formatter in merged:
+        try:
+            yield doc, formatter(doc)
+        except Exception as e:
+            print(f"Error processing email {doc.get('_id')}: {e}")
+            continue
+
 @app.route('/api/categorized-emails')
 def get_categorized_emails():
     try:
-        print("\nFetching all emails including spam...")
-        
-        # Get regular emails
-        regular_emails = list(emails_collection.find({}).sort([
-            ('date', -1),
-            ('processed_at', -1)
-        ]))
-        
-        # Get spam emails
-        spam_emails = list(spam_emails_collection.find({}).sort([
-            ('date', -1),
-            ('processed_at', -1)
-        ]))
-        
-        categorized_emails = []
-        
-        # Process regular emails
-        for email in regular_emails:
-            try:
-                email_id = str(email['_id'])
-                
-                # Format date if it exists, otherwise use processed_at
-                try:
-                    if isinstance(email.get('date'), str):
-                        date = email['date']
-                    else:
-                        date = email.get('processed_at', datetime.now()).isoformat()
-                except:
-                    date = datetime.now().isoformat()
-                
-                # Ensure sender is properly formatted
-                sender = email.get('sender', 'Unknown Sender')
-                if not sender or sender.strip() == '':
-                    sender = 'Unknown Sender'
-                
-                email_doc = {
-                    'id': email_id,
-                    'subject': email.get('subject', 'No Subject'),
-                    'sender': sender,
-                    'date': date,
-                    'body': email.get('body', ''),
-                    'summary': email.get('summary', ''),
-                    'category': email.get('category', 'primary'),
-                    'isRead': email.get('isRead', False),
-                    'isStarred': email.get('isStarred', False),
-                    'labels': email.get('labels', []),
-                    'has_attachments': email.get('has_attachments', False),
-                    'pdf_attachments': email.get('pdf_attachments', []),
-                    'processed_at': email.get('processed_at', datetime.now()).isoformat()
-                }
-                
-                categorized_emails.append(email_doc)
-                
-            except Exception as e:
-                print(f"Error processing regular email {email.get('_id')}: {e}")
-                continue
-        
-        # Process spam emails
-        for spam in spam_emails:
+        try:
+            query = keyset_filter(parse_cursor(request.args['after'])) if request.args.get('after') else {}
+            limit = parse_page_size(request.args['limit']) if request.args.get('limit') else None
+        except Exception as e:
+            return jsonify({"error": f"Invalid pagination parameters: {e}"}), 400
+
+        if limit is not None:
+            page = []
+            last_doc = None
+            has_more = False
+            for doc, formatted in iter_categorized_emails(query):
+                if len(page) == limit:
+                    has_more = True
+                    break
+                page.append(formatted)
+                last_doc = doc
+
+            return jsonify({
+                'emails': page,
+                'has_more': has_more,
+                'next_cursor': encode_cursor(last_doc) if has_more else None
+            })
+
+        # Without a limit, stream the whole merged list as it is read
+        def generate():
+            yield '{"emails": ['
+            count = 0
             try:
-                spam_id = str(spam['_id'])
-                
-                spam_doc = {
-                    'id': spam_id,
-                    'subject': spam.get('subject', 'No Subject'),
-                    'sender': spam.get('sender', 'Unknown Sender'),
-                    'date': spam.get('date', ''),
-                    'body': spam.get('body', ''),
-                    'summary': 'Spam email',  # Default summary for spam
-                    'category': 'spam',  # Always mark as spam
-                    'isRead': spam.get('isRead', False),
-                    'isStarred': spam.get('isStarred', False),
-                    'labels': ['spam'],  # Add spam label
-                    'has_attachments': spam.get('has_attachments', False),
-                    'pdf_attachments': spam.get('pdf_attachments', []),
-                    'processed_at': spam.get('processed_at', datetime.now()).isoformat(),
-                    'detected_at': spam.get('detected_at', datetime.now()).isoformat()
-                }
-                
-                categorized_emails.append(spam_doc)
-                
+                for _, formatted in iter_categorized_emails(query):
+                    yield (',' if count else '') + json.dumps(formatted)
+                    count += 1
             except Exception as e:
-                print(f"Error processing spam email {spam.get('_id')}: {e}")
-                continue
+                # The status line is already sent, so the error closes the
+                # document instead and the body stays valid JSON
+                print(f"Error streaming categorized emails after {count}: {e}")
+                yield '], "error": ' + json.dumps(str(e)) + '}'
+                return
+            yield ']}'
+            print(f"Streamed {count} categorized emails")
+
+        return Response(stream_with_context(generate()), mimetype='application/json')
 
-        print(f"Successfully fetched {len(categorized_emails)} total emails")
-        print(f"Regular emails: {len(regular_emails)}")
-        print(f"Spam emails: {len(spam_emails)}")
-        
-        return jsonify({
-            'emails': sorted(
-                categorized_emails,
-                key=lambda x: datetime.fromisoformat(str(x['processed_at']).replace('Z', '+00:00')),
-                reverse=True
-            )
-        })
-        
     except Exception as e:
         print(f"Error in get_categorized_emails: {e}")
         return jsonify({"error": str(e)}), 500
 
-def categorize_email(email):
-    """Enhanced email categorization with spam detection"""
-    content = f"{email['subject']} {email['body']}".lower()
-    sender = email['sender'].lower()
-    
-    # Spam Detection
-    spam_indicators = [
-        # Common spam phrases
-        'win', 'winner', 'congratulation', 'prize', 'lottery',
-        'million dollar', 'inheritance', 'bank transfer',
-        'nigerian prince', 'investment opportunity',
-        'earn money fast', 'work from home', 'make money online',
-        'casino', 'betting', 'gambling',
-        'viagra', 'pharmacy', 'medication',
-        'weight loss', 'diet pill',
-        'luxury replica', 'rolex',
-        
-        # Suspicious urgency
-        'urgent', 'act now', 'limited time', 'exclusive deal',
-        'once in a lifetime', 'don\'t miss out',
-        
-        # Financial scams
-        'bank account verify', 'account suspended',
-        'credit card verify', 'billing information',
-        'payment pending', 'invoice attached',
-        
-        # Suspicious domains (check sender)
-        '.xyz', '.top', '.loan', '.work', '.click',
-        
-        # Cryptocurrency scams
-        'bitcoin', 'cryptocurrency', 'crypto investment',
-        'blockchain opportunity', 'mining profit',
-        
-        # Adult content indicators
-        'adult', 'dating', 'singles in your area',
-        
-        # Suspicious formatting
-        '100% free', '100% satisfied',
-        'best price', 'cheap', 'discount',
-        'fast cash', 'free access', 'free consultation',
-        'free gift', 'free hosting', 'free info',
-        'free investment', 'free membership',
-        'free money', 'free preview', 'free quote',
-        'free website'
-    ]
-
-    # Check for spam indicators
-    spam_count = sum(1 for indicator in spam_indicators if indicator in content)
-    if spam_count >= 2 or any(indicator in sender for indicator in ['.xyz', '.top', '.loan', '.work', '.click']):
-        return 'spam'
-    
-    # Rest of your existing categorization logic
-    if any(term in content for term in [
-        'password reset', 'otp', 'verification code'
-        # ... rest of your conditions
-    ]):
-        return 'temporary'
-    
-    # ... rest of your existing categories ...
-    
-    return 'primary'  # Default category
-
-def summarize_email(subject, body):
-    try:
-        # Truncate body if it's too long (roughly 1000 words)
-        truncated_body = ' '.join(body.split()[:1000]) if body else ''
-        
-        completion = client.chat.completions.create(
-            model="google/gemini-flash-1.5-8b",
-            messages=[{
-                "role": "user",
-                "content": f"""Summarize this email in one sentence:
-                    
-                    Subject: {subject}
-                    Body: {truncated_body}"""
-            }],
-            max_tokens=100  # Limit response length
-        )
-        
-        if not completion or not hasattr(completion, 'choices') or not completion.choices:
-            return "Unable to generate summary"
-            
-        message_content = completion.choices[0].message.content
-        if not message_content:
-            return "No summary generated"
-            
-        return message_content
-        
-    except Exception as e:
-        print(f"Error summarizing email: {str(e)}")
-        print(f"Subject: {subject}")
-        print(f"Body preview: {body[:100] if body else 'No body'}")
-        return "Error in summarization"
-
 @app.route('/api/dashboard-stats')
 def get_dashboard_stats():
     try:
-        # Only get non-spam emails
-        inbox_query = {
-            "$and": [
-                {"folder": "inbox"},  # Only include inbox emails
-                {"category": {"$ne": "spam"}},  # Exclude spam category
-                {"folder": {"$ne": "spam"}}  # Double check to exclude spam folder
-            ]
-        }
-
-        # Get total emails (excluding spam)
-        total_emails = emails_collection.count_documents(inbox_query)
-
-        # Get category counts (excluding spam)
-        category_counts = list(emails_collection.aggregate([
-            {
-                "$match": inbox_query
-            },
-            {
-                "$group": {
-                    "_id": "$category",
-                    "count": {"$sum": 1}
-                }
-            }
-        ]))
-
-        # Get recent emails (excluding spam)
-        recent_emails = list(emails_collection.find(
-            inbox_query,
-            {
-                "subject": 1,
-                "sender": 1,
-                "date": 1,
-                "category": 1,
-                "_id": 0
-            }
-        ).sort("date", -1).limit(5))
-
-        return jsonify({
-            "total_emails": total_emails,
-            "category_distribution": {item["_id"]: item["count"] for item in category_counts},
-            "recent_emails": recent_emails
-        })
+        # Inbox emails without spam, kept up to date by mailbox_stats
+        stats = get_stats()
+        etag = f"stats-{stats.get('version', 0)}"
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+        else:
+            response = jsonify({
+                "total_emails": stats["total_emails"],
+                "category_distribution": category_distribution(stats),
+                "recent_emails": [
+                    {field: email.get(field) for field in RECENT_FIELDS} for email in stats["recent_emails"]
+                ]
+            })
+        response.set_etag(etag)
+        # Revalidated on every load, which costs a 304 while nothing changed
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
 
     except Exception as e:
         print(f"Error getting dashboard stats: {e}")
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/summary-cache/stats')
+def get_summary_cache_stats():
+    try:
+        return jsonify(cache_stats())
+    except Exception as e:
+        print(f"Error getting summary cache stats: {e}")
+        return jsonify({"error": str(e)}), 500
+
 @app.route('/api/emails/<email_id>')
 def get_single_email(email_id):
     try:
@@ -535,11 +541,19 @@ def chat():
         if not query:
             return jsonify({"error": "No query provided"}), 400
             
+        # Repeat questions are answered from memory until the mailbox changes
+        cached = chat_cache.get(query)
+        if cached is not None:
+            return jsonify({"response": cached})
+        generation = chat_cache.generation
+        
         # Import the search_emails function
-        from email_search_service import search_emails
+        from email_search_service import search_emails, ERROR_RESPONSES
         
         # Get response from email search service
         response = search_emails(query)
+        if response not in ERROR_RESPONSES:
+            chat_cache.put(query, response, generation)
         
         return jsonify({
             "response": response
@@ -552,8 +566,67 @@ def chat():
             "details": str(e)
         }), 500
 
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+@app.route('/api/chat/stream', methods=['GET', 'POST'])
+def chat_stream():
+    """/api/chat as Server-Sent Events: context, then answer tokens, then done"""
+    if request.method == 'POST':
+        query = (request.get_json(silent=True) or {}).get('query')
+    else:
+        # EventSource can only send GET requests
+        query = request.args.get('query')
+    if not query:
+        return jsonify({"error": "No query provided"}), 400
+
+    def generate():
+        cached = chat_cache.get(query)
+        if cached is not None:
+            yield sse_event("done", {"response": cached})
+            return
+        generation = chat_cache.generation
+
+        from email_search_service import stream_search, ERROR_RESPONSES
+        try:
+            # Closing the events (the client went away) closes the model stream
+            with closing(stream_search(query)) as events:
+                for event, data in events:
+                    if event == "context":
+                        yield sse_event("context", {"emails": data})
+                    elif event == "token":
+                        yield sse_event("token", {"text": data})
+                    else:
+                        if data not in ERROR_RESPONSES:
+                            chat_cache.put(query, data, generation)
+                        yield sse_event("done", {"response": data})
+        except Exception as e:
+            print(f"Error in chat stream: {e}")
+            yield sse_event("error", {"error": "Internal server error", "details": str(e)})
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        # Keep proxies from buffering the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.route('/api/chat-cache/stats')
+def get_chat_cache_stats():
+    try:
+        return jsonify(chat_cache.stats())
+    except Exception as e:
+        print(f"Error getting chat cache stats: {e}")
+        return jsonify({"error": str(e)}), 500
+
 if __name__ == '__main__':
     print("Starting Flask server...")
+    try:
+        for name, stages in check_query_plans():
+            print(f"Warning: {name} scans the whole collection ({' -> '.join(stages)})")
+    except Exception as e:
+        print(f"Error checking query plans: {e}")
+    start_reconciler()
     try:
         print("Server will be available at http://localhost:5001")
         app.run(host='0.0.0.0', port=5001, debug=True)
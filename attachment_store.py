@@ -0,0 +1,157 @@
+import base64
+import hashlib
+from datetime import datetime
+import gridfs
+from pymongo import MongoClient, ReturnDocument, UpdateMany
+from pymongo.errors import DuplicateKeyError
+from db_indexes import ensure_indexes
+
+# MongoDB setup
+MONGO_URI = "mongodb://localhost:27017"
+client = MongoClient(MONGO_URI)
+db = client.email_dashboard
+attachments_collection = db.pdf_attachments
+email_collections = [db.emails, db.spam_emails]
+
+# Raw PDF bytes live in a GridFS bucket keyed by their SHA-256 digest, so the
+# same file received twice is stored once and pdf_attachments documents stay
+# small no matter how large the PDF is
+BLOB_BUCKET = "attachment_blobs"
+blob_bucket = gridfs.GridFSBucket(db, bucket_name=BLOB_BUCKET)
+blob_files_collection = db[f"{BLOB_BUCKET}.files"]
+
+# One pdf_attachments document per distinct content (unique sha256 index,
+# see db_indexes); emails share it and are tracked in email_refs / ref_count.
+# Deduplication depends on that index, so store_attachment() ensures it.
+STORE_ATTEMPTS = 3
+
+# Decoded bytes per streamed chunk; a multiple of 3 so every chunk maps to
+# whole base64 quanta for attachments still stored inline
+CHUNK_SIZE = 48 * 1024
+
+def put_blob(data):
+    """Store raw bytes under their SHA-256 digest and return the digest"""
+    digest = hashlib.sha256(data).hexdigest()
+    if blob_files_collection.find_one({"_id": digest}, {"_id": 1}):
+        return digest
+    try:
+        blob_bucket.upload_from_stream_with_id(digest, digest, data)
+    except (DuplicateKeyError, gridfs.errors.FileExists):
+        # Another writer stored the same content first
+        pass
+    return digest
+
+def email_ref(email_id, imap_folder=None, uidvalidity=None):
+    """Reference recorded for an email in email_refs; UIDs are only unique per folder and UIDVALIDITY"""
+    if imap_folder:
+        return f"{imap_folder}/{uidvalidity}/{email_id}"
+    return str(email_id)
+
+def store_attachment(data, filename, email_ref, **extra):
+    """Store a PDF attachment referenced by `email_ref` and return the id of its pdf_attachments document
+
+    Content already stored for another email is not written again; the
+    existing document just gains a reference.
+    """
+    ensure_indexes(["pdf_attachments"])
+    reference = {"$push": {"email_refs": email_ref}, "$inc": {"ref_count": 1}}
+    for _ in range(STORE_ATTEMPTS):
+        digest = put_blob(data)
+        try:
+            attachments_collection.update_one(
+                {"sha256": digest, "email_refs": {"$ne": email_ref}},
+                {
+                    "$setOnInsert": {
+                        "filename": filename,
+                        "size": len(data),
+                        "email_id": email_ref,
+                        "upload_date": datetime.now(),
+                        **extra
+                    },
+                    **reference
+                },
+                upsert=True
+            )
+        except DuplicateKeyError:
+            # Either this email already references the content (a re-fetch)
+            # or another email stored it first and still needs this reference
+            attachments_collection.update_one({"sha256": digest, "email_refs": {"$ne": email_ref}}, reference)
+        attachment = attachments_collection.find_one({"sha256": digest, "email_refs": email_ref}, {"_id": 1})
+        if attachment:
+            return attachment["_id"]
+        # Released and deleted in between; store it again
+    raise RuntimeError(f"Attachment {digest} was deleted during each of {STORE_ATTEMPTS} attempts to store it")
+
+def release_attachment(attachment_id, email_ref):
+    """Drop an email's reference to an attachment, deleting it once nothing references it"""
+    attachment = attachments_collection.find_one_and_update(
+        {"_id": attachment_id, "email_refs": email_ref},
+        {"$pull": {"email_refs": email_ref}, "$inc": {"ref_count": -1}},
+        projection={"sha256": 1, "ref_count": 1},
+        return_document=ReturnDocument.AFTER
+    )
+    if attachment is None:
+        attachment = attachments_collection.find_one({"_id": attachment_id, "email_refs": None}, {"sha256": 1})
+        if attachment is None:
+            return False
+        # Legacy documents without reference tracking belong to a single email
+        attachment["ref_count"] = 0
+    if attachment.get("ref_count", 0) > 0:
+        return False
+
+    attachments_collection.delete_one({"_id": attachment_id, "ref_count": {"$not": {"$gt": 0}}})
+    if attachment.get("sha256") and not attachments_collection.find_one({"sha256": attachment["sha256"]}, {"_id": 1}):
+        blob_bucket.delete(attachment["sha256"])
+    return True
+
+def repoint_operation(duplicate_ids, keep_id):
+    """UpdateMany moving emails' pdf_attachments entries from duplicate documents onto keep_id"""
+    duplicate_id_strings = [str(duplicate_id) for duplicate_id in duplicate_ids]
+    return UpdateMany(
+        {"pdf_attachments.id": {"$in": duplicate_id_strings}},
+        {"$set": {"pdf_attachments.$[attachment].id": str(keep_id)}},
+        array_filters=[{"attachment.id": {"$in": duplicate_id_strings}}]
+    )
+
+def base64_decoded_size(content):
+    """Size in bytes of the data encoded by an unwrapped base64 string"""
+    return len(content) // 4 * 3 - content[-2:].count('=')
+
+def iter_base64_range(content, start, stop, chunk_size=CHUNK_SIZE):
+    """Yield decoded bytes [start, stop) of a base64 string, decoding one chunk at a time"""
+    block_start = start - start % 3
+    while block_start < stop:
+        block_end = min(block_start + chunk_size, stop)
+        encoded = content[block_start // 3 * 4:-(-block_end // 3) * 4]
+        data = base64.b64decode(encoded)
+        yield data[max(start - block_start, 0):block_end - block_start]
+        block_start += chunk_size
+
+def iter_blob_range(digest, start, stop, chunk_size=CHUNK_SIZE):
+    """Yield bytes [start, stop) of a stored blob without reading the rest"""
+    with blob_bucket.open_download_stream(digest) as stream:
+        stream.seek(start)
+        remaining = stop - start
+        while remaining > 0:
+            data = stream.read(min(chunk_size, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+            yield data
+
+def attachment_size(attachment):
+    """Size in bytes of an attachment document's content, whichever way it is stored"""
+    if attachment.get("sha256"):
+        return attachment["size"]
+    return base64_decoded_size(attachment["content"])
+
+def iter_attachment_range(attachment, start, stop):
+    """Yield bytes [start, stop) of an attachment document's content"""
+    if attachment.get("sha256"):
+        return iter_blob_range(attachment["sha256"], start, stop)
+    # Legacy documents that have not been migrated yet
+    return iter_base64_range(attachment["content"], start, stop)
+
+def read_attachment(attachment):
+    """Return the full content of an attachment document as bytes"""
+    return b"".join(iter_attachment_range(attachment, 0, attachment_size(attachment)))
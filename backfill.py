@@ -0,0 +1,294 @@
+import imaplib
+import multiprocessing
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from datetime import datetime
+from pymongo import MongoClient
+from pymongo.errors import BulkWriteError
+from attachment_store import store_attachment, email_ref
+from imap_sync import select_folder, search_uids, existing_uids
+from imap_fetch import fetch_messages, decode_fetched
+from imap_idle import open_connection
+
+# MongoDB setup
+MONGO_URI = "mongodb://localhost:27017"
+client = MongoClient(MONGO_URI)
+db = client.email_dashboard
+backfill_jobs_collection = db.backfill_jobs
+
+# Parallel backfill: the UIDs matching a date window are split into ranges
+# that a bounded pool of IMAP connections (one per thread) fetch
+# concurrently. The threads keep headers and text parts as fetched; all MIME
+# decoding and parsing runs on a process pool, and each range is written
+# with one unordered insert_many. Each job keeps a durable record in
+# backfill_jobs: its window, per-folder progress with the highest UID below
+# which every range is stored, error counts, throughput and ETA. Resuming a
+# job continues above those UIDs instead of starting over.
+
+# Gmail allows 15 simultaneous IMAP connections per account, shared with
+# every other client and service
+DEFAULT_CONNECTIONS = 4
+RANGE_SIZE = 500
+DUPLICATE_KEY_ERROR = 11000
+
+def split_ranges(uids, range_size=RANGE_SIZE):
+    """Split UIDs into sorted chunks of at most range_size"""
+    uids = sorted(uids)
+    return [uids[i:i + range_size] for i in range(0, len(uids), range_size)]
+
+def date_criteria(since, before=None):
+    """IMAP SEARCH criteria for the window since <= date < before"""
+    criteria = f'SINCE "{since.strftime("%d-%b-%Y")}"'
+    if before:
+        criteria += f' BEFORE "{before.strftime("%d-%b-%Y")}"'
+    return f'({criteria})'
+
+def load_job(job):
+    """Return the stored record of a backfill job, or None"""
+    return backfill_jobs_collection.find_one({"_id": job})
+
+def save_job(record):
+    record["updated_at"] = datetime.now()
+    backfill_jobs_collection.replace_one({"_id": record["_id"]}, record, upsert=True)
+
+def format_duration(seconds):
+    if seconds is None:
+        return "unknown"
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h{minutes:02d}m" if hours else f"{minutes}m{seconds:02d}s"
+
+def _parse_input(message):
+    # Attachments stay in this process; the parse workers only need text
+    return {key: message.get(key) for key in ("uid", "size", "raw_headers", "raw_body", "raw")}
+
+def _decode_and_build(build_documents, messages, folder, uidvalidity, want_pdfs):
+    """Parse-pool step: decode raw fetched messages and build their documents
+
+    Returns the documents and, per message, the PDFs found by parsing
+    messages that had to be fetched whole.
+    """
+    pdfs = [decode_fetched(message, want_pdfs) for message in messages]
+    return build_documents(messages, folder, uidvalidity), pdfs
+
+def insert_documents(collection, documents):
+    """insert_many(ordered=False), returning the UIDs that failed (duplicates count as stored)"""
+    if not documents:
+        return set()
+    try:
+        collection.insert_many(documents, ordered=False)
+        return set()
+    except BulkWriteError as e:
+        return {
+            documents[error["index"]]["uid"]
+            for error in e.details.get("writeErrors", [])
+            if error.get("code") != DUPLICATE_KEY_ERROR
+        }
+
+def run_backfill(job, folders, collection, build_documents, since=None, before=None,
+                 server=None, user=None, password=None,
+                 connections=DEFAULT_CONNECTIONS, workers=None, range_size=RANGE_SIZE,
+                 want_pdfs=True, attachment_fields=None, resume=False, source=None):
+    """Backfill `folders` into `collection` for emails dated in [since, before)
+
+    `build_documents(messages, folder, uidvalidity)` runs in a worker process
+    and returns one document (or None if it can't be parsed) per message;
+    PDF attachments are then stored here and linked on each document.
+    UIDs already stored by `source` (see imap_sync.existing_uids) are
+    skipped. With `resume`, the job's recorded window and progress are picked up
+    where they stopped; otherwise the job starts over.
+    """
+    attachment_fields = attachment_fields or {}
+
+    record = load_job(job) if resume else None
+    if record:
+        since, before = record["since"], record.get("before")
+        print(f"Resuming backfill {job} started {record['started_at']:%Y-%m-%d %H:%M} ({record['status']})")
+    else:
+        if since is None:
+            raise ValueError(f"No backfill job {job} to resume and no start date given")
+        record = {"_id": job, "since": since, "before": before, "started_at": datetime.now(), "folders": []}
+    record.update({"status": "running", "errors": 0, "last_error": None})
+    progress_by_folder = {progress["folder"]: progress for progress in record["folders"]}
+
+    # Plan on a single connection: one SEARCH per folder
+    plans = []
+    mail = open_connection(server, user, password)
+    try:
+        for folder in folders:
+            status = select_folder(mail, folder)
+            uidvalidity = status["uidvalidity"]
+            uids = search_uids(mail, date_criteria(since, before))
+
+            progress = progress_by_folder.get(folder)
+            if progress and progress["uidvalidity"] != uidvalidity:
+                print(f"UIDVALIDITY changed for {folder}, starting it over")
+                progress = None
+            if not progress:
+                progress = {"folder": folder, "uidvalidity": uidvalidity, "last_uid": 0, "stored": 0}
+            progress.update({"total": len(uids), "errors": 0})
+
+            pending = [uid for uid in uids if uid > progress["last_uid"]]
+            progress["done"] = len(uids) - len(pending)
+            print(f"{folder}: {len(uids)} emails in window, {progress['done']} already done")
+            plans.append({
+                "progress": progress,
+                "ranges": split_ranges(pending, range_size),
+                "results": {},
+                "next": 0
+            })
+    finally:
+        mail.logout()
+
+    record["folders"] = [plan["progress"] for plan in plans]
+    save_job(record)
+
+    local = threading.local()
+    opened = []
+    opened_lock = threading.Lock()
+
+    def connection(folder, uidvalidity):
+        # Each pool thread keeps its own connection and reselects as needed
+        if getattr(local, "mail", None) is None:
+            local.mail = open_connection(server, user, password)
+            local.folder = None
+            with opened_lock:
+                opened.append(local.mail)
+        if local.folder != folder:
+            status = select_folder(local.mail, folder)
+            if status["uidvalidity"] != uidvalidity:
+                raise RuntimeError(f"UIDVALIDITY of {folder} changed during the backfill")
+            local.folder = folder
+        return local.mail
+
+    def fetch_range(folder, uidvalidity, uids, attempts=2):
+        for attempt in range(attempts):
+            try:
+                mail = connection(folder, uidvalidity)
+                already_stored = existing_uids(collection, folder, uidvalidity, uids, source)
+                todo = [uid for uid in uids if uid not in already_stored]
+                return todo, list(fetch_messages(mail, todo, want_pdfs=want_pdfs, raw=True))
+            except (imaplib.IMAP4.abort, OSError) as e:
+                print(f"Connection lost fetching {folder} UIDs {uids[0]}-{uids[-1]}: {e}")
+                local.mail = None
+                if attempt == attempts - 1:
+                    raise
+
+    def process_range(folder, uidvalidity, uids):
+        todo, messages = fetch_range(folder, uidvalidity, uids)
+        documents, parsed_pdfs = parse_pool.submit(
+            _decode_and_build, build_documents, [_parse_input(message) for message in messages],
+            folder, uidvalidity, want_pdfs
+        ).result()
+
+        # Anything missing from the FETCH responses counts as failed
+        failed = set(todo) - {message["uid"] for message in messages}
+        to_insert = []
+        for message, document, pdfs in zip(messages, documents, parsed_pdfs):
+            if document is None:
+                failed.add(message["uid"])
+                continue
+            pdf_attachments = []
+            for filename, pdf_data in message["pdfs"] + pdfs:
+                try:
+                    attachment_id = store_attachment(
+                        pdf_data,
+                        filename,
+                        email_ref(message["uid"], folder, uidvalidity),
+                        **attachment_fields
+                    )
+                    pdf_attachments.append({"filename": filename, "id": str(attachment_id)})
+                except Exception as e:
+                    print(f"Error processing PDF: {e}")
+            document["has_attachments"] = len(pdf_attachments) > 0
+            document["pdf_attachments"] = pdf_attachments
+            to_insert.append(document)
+
+        failed |= insert_documents(collection, to_insert)
+        return len(to_insert) - len(failed & {doc["uid"] for doc in to_insert}), failed
+
+    def advance(plan):
+        # Move the folder's committed UID over ranges that finished without
+        # failures, in UID order; a failed range holds it just below the failure
+        progress = plan["progress"]
+        while plan["next"] in plan["results"]:
+            uids = plan["ranges"][plan["next"]]
+            failed = plan["results"][plan["next"]]
+            if failed:
+                progress["last_uid"] = max([uid for uid in uids if uid < min(failed)], default=progress["last_uid"])
+                break
+            progress["last_uid"] = uids[-1]
+            plan["next"] += 1
+
+    total = sum(plan["progress"]["total"] for plan in plans)
+    done = sum(plan["progress"]["done"] for plan in plans)
+    remaining = total - done
+    checked = 0
+    started = datetime.now()
+
+    try:
+        # Spawned (not forked) workers: this process already runs MongoDB and IMAP threads
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as parse_pool, \
+                ThreadPoolExecutor(max_workers=connections) as fetch_pool:
+            futures = {}
+            for plan in plans:
+                progress = plan["progress"]
+                for index, uids in enumerate(plan["ranges"]):
+                    future = fetch_pool.submit(process_range, progress["folder"], progress["uidvalidity"], uids)
+                    futures[future] = (plan, index)
+
+            try:
+                for future in as_completed(futures):
+                    plan, index = futures[future]
+                    progress = plan["progress"]
+                    uids = plan["ranges"][index]
+                    try:
+                        stored, failed = future.result()
+                    except Exception as e:
+                        print(f"Error backfilling {progress['folder']} UIDs {uids[0]}-{uids[-1]}: {e}")
+                        record["last_error"] = f"{progress['folder']} UIDs {uids[0]}-{uids[-1]}: {e}"
+                        stored, failed = 0, set(uids)
+                    progress["stored"] += stored
+                    progress["errors"] += len(failed)
+                    progress["done"] += len(uids)
+                    record["errors"] += len(failed)
+                    checked += len(uids)
+                    plan["results"][index] = failed
+                    advance(plan)
+
+                    elapsed = (datetime.now() - started).total_seconds() or 1
+                    record["rate"] = round(checked / elapsed, 1)
+                    record["eta_seconds"] = round((remaining - checked) / record["rate"]) if record["rate"] else None
+                    save_job(record)
+                    print(
+                        f"{done + checked}/{total} emails done, {record['errors']} errors, "
+                        f"{record['rate']:.0f}/s, ETA {format_duration(record['eta_seconds'])}"
+                    )
+            except BaseException:
+                # Don't start queued ranges after a crash or Ctrl+C
+                fetch_pool.shutdown(wait=False, cancel_futures=True)
+                raise
+    except BaseException:
+        record["status"] = "failed"
+        save_job(record)
+        raise
+    finally:
+        # The pool threads' connections, whether the backfill finished or not
+        for mail in opened:
+            try:
+                mail.logout()
+            except Exception:
+                pass
+
+    record["status"] = "completed" if not record["errors"] else "completed_with_errors"
+    record["finished_at"] = datetime.now()
+    save_job(record)
+
+    stored_count = sum(plan["progress"]["stored"] for plan in plans)
+    print("\nBackfill Summary:")
+    print(f"Emails checked this run: {checked}")
+    print(f"Stored so far: {stored_count}")
+    print(f"Errors encountered: {record['errors']}")
+    if record["errors"]:
+        print("Resume the job to retry from the first failure")
+    return record
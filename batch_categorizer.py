@@ -0,0 +1,101 @@
+import multiprocessing
+import os
+import time
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from pymongo import UpdateOne, UpdateMany
+from categorizer import categorize_email
+
+# Bulk recategorization: documents are streamed with only the fields the
+# rules read, classified in chunks on a process pool, and only emails whose
+# category actually changed are written back, in unordered bulk_writes.
+
+CHUNK_SIZE = 1000
+PROJECTION = {"subject": 1, "body": 1, "sender": 1, "category": 1}
+
+def classify_chunk(emails):
+    """[(_id, old category, new category)] for the emails whose category changed"""
+    changes = []
+    for email in emails:
+        category = categorize_email({
+            'subject': email.get('subject') or '',
+            'body': email.get('body') or '',
+            'sender': email.get('sender') or ''
+        })
+        if category != email.get('category'):
+            changes.append((email["_id"], email.get('category'), category))
+    return changes
+
+def _chunks(cursor, chunk_size):
+    chunk = []
+    for email in cursor:
+        chunk.append(email)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def recategorize(collection, query=None, categories=None, workers=None, chunk_size=CHUNK_SIZE, mark=None,
+                 on_change=None):
+    """Recategorize every email matching `query`, writing only changed categories
+
+    With `categories`, only changes *to* those categories are written (e.g.
+    {'promotions'}). `mark` is a {field: value} set on every scanned email,
+    used to record which ruleset has seen it. `on_change` is called with
+    each written batch of (_id, old, new) changes. workers=0 classifies in this
+    process, which is cheaper for small batches. Returns counts of scanned
+    and changed emails and the changes per new category.
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    stats = {"scanned": 0, "changed": 0, "by_category": Counter()}
+    started = time.monotonic()
+
+    def apply(email_ids, changes):
+        changes = [change for change in changes if categories is None or change[2] in categories]
+        operations = [
+            UpdateOne({"_id": email_id}, {"$set": {"category": new, **(mark or {})}})
+            for email_id, old, new in changes
+        ]
+        if mark:
+            changed_ids = {email_id for email_id, _, _ in changes}
+            unchanged_ids = [email_id for email_id in email_ids if email_id not in changed_ids]
+            if unchanged_ids:
+                operations.append(UpdateMany({"_id": {"$in": unchanged_ids}}, {"$set": mark}))
+        if operations:
+            collection.bulk_write(operations, ordered=False)
+        if changes and on_change:
+            on_change(changes)
+        stats["changed"] += len(changes)
+        stats["by_category"].update(new for _, _, new in changes)
+        stats["scanned"] += len(email_ids)
+
+    def report():
+        elapsed = time.monotonic() - started or 1
+        print(f"Scanned {stats['scanned']} emails, {stats['changed']} changed ({stats['scanned'] / elapsed:.0f}/s)")
+
+    cursor = collection.find(query or {}, PROJECTION, batch_size=chunk_size)
+    if not workers:
+        for chunk in _chunks(cursor, chunk_size):
+            apply([email["_id"] for email in chunk], classify_chunk(chunk))
+        return stats
+
+    pending = deque()
+
+    def collect():
+        email_ids, future = pending.popleft()
+        apply(email_ids, future.result())
+        report()
+
+    # Spawned workers: the parent already runs MongoDB client threads
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        # A bounded number of chunks in flight keeps memory flat on large mailboxes
+        for chunk in _chunks(cursor, chunk_size):
+            pending.append(([email["_id"] for email in chunk], pool.submit(classify_chunk, chunk)))
+            if len(pending) >= workers * 2:
+                collect()
+        while pending:
+            collect()
+
+    return stats
@@ -0,0 +1,60 @@
+import argparse
+import asyncio
+import time
+import uuid
+from datetime import datetime
+from pymongo import MongoClient
+from summarizer import SUMMARY_BATCH_SIZE
+from summary_worker import run_worker, SUMMARY_CONCURRENCY, SUMMARY_RPM, SUMMARY_TPM
+
+# MongoDB setup
+MONGO_URI = "mongodb://localhost:27017"
+client = MongoClient(MONGO_URI)
+db = client.email_dashboard
+
+# Measures summarization throughput on synthetic emails in a scratch
+# collection, with the summary cache off so neither the production cache
+# nor its hit-rate stats are touched. Meant to run against llm_stub_server.py, e.g.
+#   python llm_stub_server.py --latency 0.8 --error-rate 0.02 --rpm 500 &
+#   LLM_BASE_URL=http://localhost:8001/v1 python benchmark_summaries.py --emails 500
+
+BENCHMARK_COLLECTION = "summary_benchmark"
+
+def synthetic_emails(count, run_id):
+    """Short notification-style emails, unique per run"""
+    now = datetime.now()
+    return [{
+        "subject": f"Order #{run_id}-{i} has shipped",
+        "body": f"Your order {run_id}-{i} is on its way and should arrive in {i % 5 + 2} days. Track it from your account.",
+        "summary_status": "pending",
+        "processed_at": now
+    } for i in range(count)]
+
+def run_benchmark(emails, concurrency, rpm, tpm, batch_size):
+    collection = db[BENCHMARK_COLLECTION]
+    collection.drop()
+    collection.insert_many(synthetic_emails(emails, uuid.uuid4().hex[:8]))
+    try:
+        started = time.monotonic()
+        stats = asyncio.run(run_worker(
+            collection, concurrency=concurrency, rpm=rpm, tpm=tpm,
+            batch_size=batch_size, stop_when_empty=True, use_cache=False
+        ))
+        elapsed = time.monotonic() - started
+    finally:
+        collection.drop()
+
+    print(f"\nSummarized {stats['summarized']} emails ({stats['failed']} failed) in {elapsed:.1f}s")
+    print(f"Throughput: {stats['summarized'] * 60 / elapsed:.0f} emails/minute")
+    return stats
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the summarization pipeline")
+    parser.add_argument("--emails", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=SUMMARY_CONCURRENCY)
+    parser.add_argument("--rpm", type=float, default=SUMMARY_RPM, help="client-side requests per minute (0: unlimited)")
+    parser.add_argument("--tpm", type=float, default=SUMMARY_TPM, help="client-side tokens per minute (0: unlimited)")
+    parser.add_argument("--batch-size", type=int, default=1, help=f"emails per request (bulk jobs use {SUMMARY_BATCH_SIZE})")
+    args = parser.parse_args()
+
+    run_benchmark(args.emails, args.concurrency, args.rpm, args.tpm, args.batch_size)
@@ -0,0 +1,272 @@
+import hashlib
+import json
+import re
+from collections import Counter
+
+# Rule-based email categorization. Every phrase from every rule list is
+# compiled once, at import, into a single trie-shaped regex wrapped in a
+# lookahead, so one pass over the text finds every occurrence of every
+# phrase (overlapping ones included) and the rules then just read counts.
+# Matching is plain substring matching, exactly like `phrase in content`.
+
+# Service rules: promotions first, then spam, then the first matching category
+PROMOTION_INDICATORS = [
+    # Marketing terms
+    'promotion', 'offer', 'discount', 'sale', 'deal', 'coupon',
+    'special offer', 'limited time', 'exclusive', 'savings',
+    # Shopping terms
+    'shop now', 'buy now', 'order today', 'free shipping',
+    'new arrival', 'clearance', 'flash sale', 'best seller',
+    # Urgency terms
+    'last chance', 'ending soon', 'don\'t miss out', 'limited stock',
+    # Percentage and money terms
+    '% off', 'cashback', 'free gift', 'bonus',
+    # Common promotional phrases
+    'black friday', 'cyber monday', 'holiday sale',
+    'seasonal offer', 'members only', 'vip offer',
+    # Newsletter and updates
+    'newsletter', 'latest deals', 'weekly offers',
+    # Common promotional senders
+    'amazon', 'flipkart', 'ebay', 'walmart',
+    'unsubscribe', 'marketing', 'promotional'
+]
+
+SPAM_INDICATORS = [
+    'win', 'winner', 'prize', 'lottery', 'million dollar', 'inheritance',
+    'bank transfer', 'investment opportunity', 'casino', 'betting',
+    'viagra', 'pharmacy', 'weight loss', 'luxury replica',
+    'urgent', 'act now', 'limited time', 'exclusive deal',
+    'bank account verify', 'account suspended', 'payment pending',
+    '.xyz', '.top', '.loan', '.work', '.click'
+]
+
+# Checked in order; the first category with a keyword present wins
+CATEGORY_KEYWORDS = {
+    'finance': [
+        'invoice', 'payment', 'bill', 'transaction', 'credit', 'debit', 'bank', 'salary',
+        'receipt', 'subscription fee', 'account balance', 'statement'
+    ],
+    'meetings': [
+        'meeting', 'schedule', 'appointment', 'calendar', 'zoom', 'google meet',
+        'conference', 'discussion', 'sync up', 'catch up', 'team meeting'
+    ],
+    'education': [
+        'course', 'lecture', 'assignment', 'homework', 'exam', 'quiz', 'study',
+        'grade', 'certificate', 'training', 'workshop', 'webinar'
+    ],
+    'social': [
+        'linkedin', 'facebook', 'twitter', 'instagram', 'social', 'connection', 'network',
+        'invitation', 'connect', 'profile view', 'endorsement'
+    ],
+    'updates': [
+        'newsletter', 'subscription', 'digest', 'weekly update', 'monthly update',
+        'announcement', 'news', 'product update', 'release notes'
+    ],
+    'jobs': [
+        'job', 'career', 'position', 'opportunity', 'hiring', 'recruitment',
+        'interview', 'application', 'resume', 'offer letter', 'employment'
+    ],
+    'work': [
+        'project', 'task', 'collaboration', 'deadline', 'review', 'feedback',
+        'report', 'status update', 'milestone', 'deliverable'
+    ],
+    'promotions': [
+        'promotion', 'offer', 'discount', 'sale', 'deal', 'coupon',
+        'special offer', 'limited time', 'exclusive', 'savings'
+    ],
+    'development': [
+        'github', 'gitlab', 'pull request', 'commit', 'merge', 'code review',
+        'bug', 'feature', 'deployment', 'release', 'api', 'documentation'
+    ],
+    'security': [
+        'password', 'security', 'verification', 'authenticate', '2fa', 'login',
+        'access', 'permission', 'authorization', 'reset', 'suspicious'
+    ],
+    'travel': [
+        'flight', 'booking', 'reservation', 'itinerary', 'travel', 'hotel',
+        'ticket', 'boarding pass', 'accommodation', 'trip'
+    ],
+    'notifications': [
+        'alert', 'notification', 'reminder', 'notice', 'action required',
+        'confirmation', 'verify', 'validate', 'approve'
+    ],
+    'health': [
+        'doctor', 'appointment', 'prescription', 'health', 'medical', 'hospital',
+        'pharmacy', 'insurance', 'wellness', 'fitness', 'nutrition'
+    ],
+    'shopping': [
+        'order', 'shipment', 'delivery', 'tracking', 'purchase', 'cart',
+        'checkout', 'store', 'retail', 'product', 'catalog'
+    ],
+    'entertainment': [
+        'movie', 'film', 'show', 'concert', 'event', 'ticket', 'booking',
+        'streaming', 'music', 'game', 'play', 'theater'
+    ],
+    'real estate': [
+        'property', 'listing', 'rent', 'sale', 'lease', 'mortgage',
+        'real estate', 'home', 'apartment', 'condo', 'house'
+    ],
+    'legal': [
+        'law', 'lawyer', 'legal', 'contract', 'agreement', 'court',
+        'case', 'litigation', 'document', 'notice', 'complaint'
+    ],
+    'support': [
+        'support', 'help', 'assistance', 'customer service', 'contact',
+        'ticket', 'issue', 'resolution', 'feedback', 'query'
+    ],
+    'subscriptions': [
+        'subscription', 'renewal', 'plan', 'billing', 'payment',
+        'cancel', 'upgrade', 'downgrade', 'service', 'membership'
+    ],
+    'events': [
+        'event', 'conference', 'seminar', 'workshop', 'webinar',
+        'gathering', 'meetup', 'celebration', 'party', 'festival'
+    ]
+}
+
+# Sender domains that mark an email as spam on their own
+SUSPICIOUS_SENDER_DOMAINS = ['.xyz', '.top', '.loan', '.work', '.click']
+
+# Quick triage rules used for backfilled mail: spam, temporary codes, or primary
+TRIAGE_SPAM_INDICATORS = [
+    # Common spam phrases
+    'win', 'winner', 'congratulation', 'prize', 'lottery',
+    'million dollar', 'inheritance', 'bank transfer',
+    'nigerian prince', 'investment opportunity',
+    'earn money fast', 'work from home', 'make money online',
+    'casino', 'betting', 'gambling',
+    'viagra', 'pharmacy', 'medication',
+    'weight loss', 'diet pill',
+    'luxury replica', 'rolex',
+    
+    # Suspicious urgency
+    'urgent', 'act now', 'limited time', 'exclusive deal',
+    'once in a lifetime', 'don\'t miss out',
+    
+    # Financial scams
+    'bank account verify', 'account suspended',
+    'credit card verify', 'billing information',
+    'payment pending', 'invoice attached',
+    
+    # Suspicious domains (check sender)
+    '.xyz', '.top', '.loan', '.work', '.click',
+    
+    # Cryptocurrency scams
+    'bitcoin', 'cryptocurrency', 'crypto investment',
+    'blockchain opportunity', 'mining profit',
+    
+    # Adult content indicators
+    'adult', 'dating', 'singles in your area',
+    
+    # Suspicious formatting
+    '100% free', '100% satisfied',
+    'best price', 'cheap', 'discount',
+    'fast cash', 'free access', 'free consultation',
+    'free gift', 'free hosting', 'free info',
+    'free investment', 'free membership',
+    'free money', 'free preview', 'free quote',
+    'free website'
+]
+
+TEMPORARY_INDICATORS = ['password reset', 'otp', 'verification code']
+
+# Bump when categorize_email's logic changes; rule list edits are picked up
+# automatically. Emails store the version they were categorized under, so
+# any change makes the incremental categorizer redo every email once.
+RULES_REVISION = 1
+RULESET_VERSION = hashlib.sha1(json.dumps(
+    [RULES_REVISION, PROMOTION_INDICATORS, SPAM_INDICATORS, SUSPICIOUS_SENDER_DOMAINS, CATEGORY_KEYWORDS]
+).encode()).hexdigest()[:12]
+
+def _trie_pattern(node):
+    """Regex for a trie node that prefers the longest phrase at a position"""
+    branches = [re.escape(char) + _trie_pattern(child) for char, child in sorted(node.items()) if char]
+    if not branches:
+        return ''
+    pattern = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+    # A phrase ends here, so the longer continuations are optional
+    return f'(?:{pattern})?' if '' in node else pattern
+
+class PhraseMatcher:
+    """Counts occurrences of a fixed set of phrases in one regex pass"""
+
+    def __init__(self, phrases):
+        self.phrases = sorted(set(phrases))
+        trie = {}
+        for phrase in self.phrases:
+            node = trie
+            for char in phrase:
+                node = node.setdefault(char, {})
+            node[''] = {}
+        # The lookahead matches at every position without consuming text;
+        # the trie returns the longest phrase starting there
+        self.pattern = re.compile(f'(?=({_trie_pattern(trie)}))')
+        # Shorter phrases that are prefixes of a match also occur at its position
+        self.prefixes = {
+            phrase: [other for other in self.phrases if other != phrase and phrase.startswith(other)]
+            for phrase in self.phrases
+        }
+
+    def counts(self, text):
+        """{phrase: number of occurrences} for every phrase found in text"""
+        hits = Counter()
+        for match in self.pattern.finditer(text):
+            phrase = match.group(1)
+            hits[phrase] += 1
+            for prefix in self.prefixes[phrase]:
+                hits[prefix] += 1
+        return hits
+
+matcher = PhraseMatcher(
+    PROMOTION_INDICATORS + SPAM_INDICATORS + SUSPICIOUS_SENDER_DOMAINS
+    + [keyword for keywords in CATEGORY_KEYWORDS.values() for keyword in keywords]
+    + TRIAGE_SPAM_INDICATORS + TEMPORARY_INDICATORS
+)
+
+def match_phrases(text):
+    """Every rule phrase in text (already lowercased) with its occurrence count"""
+    return matcher.counts(text)
+
+def _content(email_content):
+    return f"{email_content['subject']} {email_content['body']}".lower()
+
+def _suspicious_sender(sender):
+    hits = matcher.counts(sender)
+    return any(hits[domain] for domain in SUSPICIOUS_SENDER_DOMAINS)
+
+def categorize_email(email_content):
+    """Enhanced email categorization logic"""
+    hits = match_phrases(_content(email_content))
+    sender = email_content.get('sender', '').lower()
+
+    # Promotions: two indicators, or any unsubscribe link
+    promo_count = sum(1 for indicator in PROMOTION_INDICATORS if hits[indicator])
+    if promo_count >= 2 or hits['unsubscribe']:
+        return 'promotions'
+
+    # Spam detection
+    spam_count = sum(1 for indicator in SPAM_INDICATORS if hits[indicator])
+    if spam_count >= 2 or _suspicious_sender(sender):
+        return 'spam'
+
+    # First category (in rule order) with any keyword present
+    for category, keywords in CATEGORY_KEYWORDS.items():
+        if any(hits[keyword] for keyword in keywords):
+            return category
+
+    # If no specific category matches
+    return 'general'
+
+def triage_email(email):
+    """Enhanced email categorization with spam detection"""
+    hits = match_phrases(_content(email))
+    sender = email['sender'].lower()
+
+    spam_count = sum(1 for indicator in TRIAGE_SPAM_INDICATORS if hits[indicator])
+    if spam_count >= 2 or _suspicious_sender(sender):
+        return 'spam'
+
+    if any(hits[term] for term in TEMPORARY_INDICATORS):
+        return 'temporary'
+
+    return 'primary'  # Default category
@@ -0,0 +1,86 @@
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from search_index import generation
+
+# In-process LRU cache of /api/chat answers, keyed on the normalized
+# question. Answers are only valid for the mailbox they were computed
+# from, so the cache is emptied whenever the search index generation moves
+# (new, edited or deleted mail). The generation is re-read from MongoDB
+# at most every GENERATION_TTL seconds, so a repeated question is answered
+# from memory alone.
+
+CHAT_CACHE_SIZE = int(os.getenv('CHAT_CACHE_SIZE', 512))
+GENERATION_TTL = float(os.getenv('CHAT_CACHE_GENERATION_TTL', 5))
+WORD = re.compile(r"[^\W_]+")
+
+def normalize_query(query):
+    """Lowercased words only, so case, punctuation and spacing don't matter"""
+    return ' '.join(WORD.findall(query.lower()))
+
+class ChatCache:
+    def __init__(self, max_entries=CHAT_CACHE_SIZE, generation_ttl=GENERATION_TTL):
+        self.max_entries = max_entries
+        self.generation_ttl = generation_ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.generation = None
+        self.checked_at = 0
+        self.hits = self.misses = self.evictions = self.invalidations = 0
+
+    def _check_generation(self):
+        now = time.monotonic()
+        if now - self.checked_at < self.generation_ttl:
+            return
+        current = generation()
+        with self.lock:
+            self.checked_at = now
+            if current != self.generation:
+                if self.entries:
+                    self.invalidations += 1
+                self.entries.clear()
+                self.generation = current
+
+    def get(self, query):
+        """The cached answer to a question, or None"""
+        self._check_generation()
+        key = normalize_query(query)
+        with self.lock:
+            response = self.entries.get(key)
+            if response is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return response
+
+    def put(self, query, response, generation):
+        """Cache an answer computed at `generation` (read after get())"""
+        key = normalize_query(query)
+        with self.lock:
+            # The mailbox changed while the answer was being computed
+            if generation != self.generation:
+                return
+            self.entries[key] = response
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "entries": len(self.entries),
+                "max_entries": self.max_entries,
+                "generation": self.generation
+            }
+
+chat_cache = ChatCache()
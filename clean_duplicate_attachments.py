@@ -1,5 +1,7 @@
-from pymongo import MongoClient
-from datetime import datetime
+from pymongo import MongoClient, UpdateOne
+from attachment_store import repoint_operation, email_collections
+from migrate_attachments import migrate_attachment
+from db_indexes import ensure_indexes
 
 # MongoDB setup
 MONGO_URI = "mongodb://localhost:27017"
@@ -7,47 +9,82 @@ client = MongoClient(MONGO_URI)
 db = client.email_dashboard
 attachments_collection = db.pdf_attachments
 
+BATCH_SIZE = 500
+
 def clean_duplicate_attachments():
+    """Collapse attachments with identical content into one reference-counted document"""
     try:
-        print("\nStarting duplicate attachments cleanup...")
-        
+        print("\nStarting duplicate attachments reconciliation...")
+
         # Get total attachments before cleanup
         total_before = attachments_collection.count_documents({})
         print(f"Total attachments before cleanup: {total_before}")
-        
-        # Find duplicates based on filename
+
+        # Attachments still stored inline are hashed into the blob store first
+        legacy_ids = [doc["_id"] for doc in attachments_collection.find({"content": {"$exists": True}}, {"_id": 1})]
+        for attachment_id in legacy_ids:
+            migrate_attachment(attachment_id)
+        print(f"Hashed {len(legacy_ids)} attachments stored inline")
+
+        # Group on content hash (not filename, which distinct files can share);
+        # every group is visited so legacy single documents also get refs
         pipeline = [
+            {"$sort": {"upload_date": 1}},
             {
                 "$group": {
-                    "_id": "$filename",
+                    "_id": "$sha256",
                     "ids": {"$push": "$_id"},
-                    "count": {"$sum": 1}
-                }
-            },
-            {
-                "$match": {
-                    "count": {"$gt": 1}
+                    "email_ids": {"$push": "$email_id"},
+                    "email_refs": {"$push": "$email_refs"}
                 }
             }
         ]
-        
-        duplicates = list(attachments_collection.aggregate(pipeline))
-        
-        # Remove duplicates keeping only the latest one
-        for duplicate in duplicates:
-            filename = duplicate['_id']
-            # Sort by upload_date and keep the latest
-            attachments = list(attachments_collection.find(
-                {"filename": filename}
-            ).sort("upload_date", -1))
-            
-            # Keep the first one (latest) and remove others
-            for attachment in attachments[1:]:
-                attachments_collection.delete_one({"_id": attachment['_id']})
-        
+
+        attachment_ops = []
+        email_ops = []
+        duplicate_ids = []
+        for group in attachments_collection.aggregate(pipeline, allowDiskUse=True):
+            if group["_id"] is None:
+                continue
+
+            # Keep the earliest upload and move every reference onto it
+            keep_id, duplicates = group["ids"][0], group["ids"][1:]
+            refs = []
+            for email_id, email_refs in zip(group["email_ids"], group["email_refs"]):
+                for ref in (email_refs if email_refs is not None else [email_id]):
+                    if ref is not None and ref not in refs:
+                        refs.append(ref)
+            attachment_ops.append(UpdateOne(
+                {"_id": keep_id},
+                {"$set": {"email_refs": refs, "ref_count": len(refs)}}
+            ))
+
+            if duplicates:
+                email_ops.append(repoint_operation(duplicates, keep_id))
+                duplicate_ids.extend(duplicates)
+
+            if len(attachment_ops) >= BATCH_SIZE:
+                attachments_collection.bulk_write(attachment_ops, ordered=False)
+                attachment_ops = []
+
+        if attachment_ops:
+            attachments_collection.bulk_write(attachment_ops, ordered=False)
+
+        # Point emails at the surviving documents before deleting the rest
+        if email_ops:
+            for collection in email_collections:
+                for i in range(0, len(email_ops), BATCH_SIZE):
+                    collection.bulk_write(email_ops[i:i + BATCH_SIZE], ordered=False)
+
+        for i in range(0, len(duplicate_ids), BATCH_SIZE):
+            attachments_collection.delete_many({"_id": {"$in": duplicate_ids[i:i + BATCH_SIZE]}})
+
+        # Duplicates are gone, so the unique hash index can be built now
+        ensure_indexes(["pdf_attachments"])
+
         # Get total attachments after cleanup
         total_after = attachments_collection.count_documents({})
-        
+
         print("\nCleanup Summary:")
         print(f"Duplicate attachments removed: {total_before - total_after}")
         print(f"Attachments remaining: {total_after}")
@@ -58,4 +95,4 @@ def clean_duplicate_attachments():
         client.close()
 
 if __name__ == "__main__":
-    clean_duplicate_attachments() 
\ No newline at end of file
+    clean_duplicate_attachments()
@@ -1,14 +1,49 @@
 from pymongo import MongoClient
 from datetime import datetime
+from mailbox_stats import reconcile
 
 # MongoDB setup
 MONGO_URI = "mongodb://localhost:27017"
 client = MongoClient(MONGO_URI)
 db = client.email_dashboard
 emails_collection = db.emails
+spam_emails_collection = db.spam_emails
+
+def remove_duplicate_uids(collection, key):
+    """Keep the first stored document per IMAP UID, which the unique UID index requires"""
+    duplicate_ids = []
+    for group in collection.aggregate([
+        {"$match": {"uid": {"$exists": True}}},
+        {"$sort": {"_id": 1}},
+        {"$group": {"_id": {field: f"${field}" for field in key}, "ids": {"$push": "$_id"}}},
+        {"$match": {"ids.1": {"$exists": True}}}
+    ], allowDiskUse=True):
+        duplicate_ids.extend(group["ids"][1:])
+    if not duplicate_ids:
+        return 0
+    return collection.delete_many({"_id": {"$in": duplicate_ids}}).deleted_count
 
 def clean_emails():
     try:
+        # Stamp the service that stored each synced email (before the
+        # folder step below, since only email_service documents lack one)
+        result = emails_collection.update_many(
+            {"uid": {"$exists": True}, "source": {"$exists": False}, "message_id": {"$exists": True}},
+            {"$set": {"source": "email_service"}}
+        )
+        print(f"Marked {result.modified_count} emails as stored by email_service")
+        result = emails_collection.update_many(
+            {"uid": {"$exists": True}, "source": {"$exists": False}},
+            {"$set": {"source": "inbox_service"}}
+        )
+        print(f"Marked {result.modified_count} emails as stored by inbox_service")
+
+        # Run before the services create the unique UID indexes (db_indexes)
+        removed = remove_duplicate_uids(emails_collection, ("source", "imap_folder", "uidvalidity", "uid"))
+        print(f"Removed {removed} emails stored twice under the same UID")
+        removed = remove_duplicate_uids(spam_emails_collection, ("imap_folder", "uidvalidity", "uid"))
+        print(f"Removed {removed} spam emails stored twice under the same UID")
+
         # Update emails without folder field
         result = emails_collection.update_many(
             {"folder": {"$exists": False}},
@@ -23,6 +58,15 @@ def clean_emails():
         )
         print(f"Updated {result.modified_count} spam emails")
 
+        # The unique message_id index skips emails without the field, but
+        # not ones where it is null
+        result = emails_collection.update_many(
+            {"message_id": {"$type": "null"}},
+            {"$unset": {"message_id": ""}}
+        )
+        print(f"Cleared {result.modified_count} null Message-IDs")
+        reconcile()
+
     except Exception as e:
         print(f"Error cleaning emails: {e}")
     finally:
@@ -4,6 +4,9 @@ import email.utils
 from dotenv import load_dotenv
 import os
 from datetime import timezone
+from bson import ObjectId
+from attachment_store import release_attachment, email_ref
+from mailbox_stats import reconcile
 
 # Load environment variables
 load_dotenv()
@@ -13,7 +16,6 @@ MONGO_URI = "mongodb://localhost:27017"
 client = MongoClient(MONGO_URI)
 db = client.email_dashboard
 emails_collection = db.emails
-attachments_collection = db.pdf_attachments
 
 def parse_email_date(date_str):
     try:
@@ -53,12 +55,16 @@ def clean_old_emails():
                 
             if date < cutoff_date:
                 print(f"Deleting email from {date}")
-                # Delete associated attachments first
+                # Release associated attachments first; shared ones are
+                # only deleted once no other email references them
                 if email.get('pdf_attachments'):
                     for attachment in email['pdf_attachments']:
                         try:
-                            attachments_collection.delete_one({'_id': attachment.get('id')})
-                            attachment_count += 1
+                            if release_attachment(
+                                ObjectId(attachment.get('id')),
+                                email_ref(email.get('email_id'), email.get('imap_folder'), email.get('uidvalidity'))
+                            ):
+                                attachment_count += 1
                         except Exception as e:
                             print(f"Error deleting attachment: {e}")
                 
@@ -73,6 +79,7 @@ def clean_old_emails():
         print(f"Emails deleted: {deleted_count}")
         print(f"Attachments deleted: {attachment_count}")
         print(f"Emails remaining: {total_after}")
+        reconcile()
 
     except Exception as e:
         print(f"Error during cleanup: {e}")
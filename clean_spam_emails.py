@@ -1,5 +1,6 @@
 from pymongo import MongoClient
 from datetime import datetime
+from mailbox_stats import reconcile
 
 # MongoDB setup
 MONGO_URI = "mongodb://localhost:27017"
@@ -29,6 +30,7 @@ def clean_spam_emails():
         print("\nCleanup Summary:")
         print(f"Spam emails deleted: {result.deleted_count}")
         print(f"Emails remaining: {total_after}")
+        reconcile()
 
     except Exception as e:
         print(f"Error during cleanup: {e}")
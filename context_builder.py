@@ -0,0 +1,116 @@
+import os
+import re
+from bisect import bisect_right
+from itertools import islice
+from search_index import query_terms
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# Assembles the email context sent to the chat model within a token
+# budget. Each candidate email offers a header (subject, date, sender,
+# summary) and body excerpts around the query's terms; pieces are taken
+# best first, weighted by the email's retrieval rank and how many query
+# terms they contain, until the budget is spent.
+
+CONTEXT_TOKEN_BUDGET = int(os.getenv('CHAT_CONTEXT_TOKENS', 1500))
+TOKENIZER_ENCODING = "cl100k_base"
+# Words in a body excerpt
+EXCERPT_WORDS = 40
+MAX_EXCERPTS_PER_EMAIL = 3
+# Only the start of very long bodies is searched for excerpts
+MAX_BODY_WORDS = 3000
+# An excerpt never outranks its own email's header
+EXCERPT_WEIGHT = 0.9
+WORD = re.compile(r"\S+")
+
+_encoding = None
+
+def count_tokens(text):
+    """Tokens in text with tiktoken, or about 4 characters a token without it"""
+    global _encoding
+    if tiktoken is not None and _encoding is None:
+        try:
+            _encoding = tiktoken.get_encoding(TOKENIZER_ENCODING)
+        except Exception as e:
+            print(f"Tokenizer unavailable, estimating token counts: {e}")
+            _encoding = False
+    if _encoding:
+        return len(_encoding.encode(text))
+    return len(text) // 4 + 1
+
+def clean(text):
+    # '---' separates emails in the context
+    return re.sub(r"-{3,}", "-", ' '.join(str(text or '').split()))
+
+def email_header(email):
+    return (
+        f"Subject: {clean(email.get('subject'))}\n"
+        f"Date: {clean(email.get('date'))}\n"
+        f"From: {clean(email.get('sender'))}\n"
+        f"Summary: {clean(email.get('summary'))}"
+    )
+
+def body_excerpts(body, terms):
+    """[(weight of matched terms, excerpt)] of passages around query terms, best first"""
+    words = list(islice(WORD.finditer(body or ''), MAX_BODY_WORDS))
+    if not words or not terms:
+        return []
+    # One scan for every term, instead of tokenizing each word
+    pattern = re.compile(r"(?<![^\W_])(" + '|'.join(map(re.escape, terms)) + r")(?![^\W_])", re.IGNORECASE)
+    starts = [word.start() for word in words]
+    hits = [
+        (bisect_right(starts, match.start()) - 1, match.group(1).lower())
+        for match in pattern.finditer(body, 0, words[-1].end())
+    ]
+
+    excerpts, covered = [], 0
+    for position, _ in hits:
+        if position < covered:
+            continue
+        start = max(0, position - EXCERPT_WORDS // 3)
+        covered = min(start + EXCERPT_WORDS, len(words))
+        matched = {term for hit, term in hits if start <= hit < covered}
+        passage = ' '.join(word.group() for word in words[start:covered])
+        excerpts.append((sum(terms[term] for term in matched), clean(passage)))
+    excerpts.sort(key=lambda excerpt: -excerpt[0])
+    return excerpts[:MAX_EXCERPTS_PER_EMAIL]
+
+def build_context(query, emails, budget=CONTEXT_TOKEN_BUDGET):
+    """Context for `emails` (best match first) in at most about `budget` tokens
+
+    Returns the context and the emails it includes, in rank order.
+    """
+    terms = query_terms(query)
+    total_weight = sum(terms.values()) or 1
+    pieces = []
+    for rank, email in enumerate(emails):
+        rank_weight = 1 / (rank + 1)
+        pieces.append((rank_weight, rank, None, email_header(email)))
+        for weight, excerpt in body_excerpts(email.get('body'), terms):
+            pieces.append((rank_weight * EXCERPT_WEIGHT * weight / total_weight, rank, weight, excerpt))
+    pieces.sort(key=lambda piece: -piece[0])
+
+    headers, excerpts, used = {}, {}, 0
+    for _, rank, weight, text in pieces:
+        # Excerpts only go in under their email's header
+        if weight is not None and rank not in headers:
+            continue
+        cost = count_tokens(text) + 2
+        if used + cost > budget:
+            continue
+        used += cost
+        if weight is None:
+            headers[rank] = text
+        else:
+            excerpts.setdefault(rank, []).append(text)
+
+    blocks = []
+    for rank in sorted(headers):
+        block = headers[rank]
+        if rank in excerpts:
+            block += "\nExcerpts:\n" + '\n'.join(f"- {excerpt}" for excerpt in excerpts[rank])
+        blocks.append(block)
+    return "\n---\n".join(blocks), [emails[rank] for rank in sorted(headers)]
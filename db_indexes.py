@@ -0,0 +1,175 @@
+import argparse
+import sys
+from datetime import datetime
+from bson import ObjectId
+from pymongo import MongoClient, IndexModel
+from mailbox_stats import INBOX_QUERY
+from summary_cache import CACHE_TTL_DAYS
+
+# MongoDB setup
+MONGO_URI = "mongodb://localhost:27017"
+client = MongoClient(MONGO_URI)
+db = client.email_dashboard
+
+# Every index the services query through, by collection. The services and
+# app.py call ensure_indexes() at startup, which creates what is missing and
+# rebuilds indexes whose options changed here; it is a no-op otherwise.
+# `python db_indexes.py --check` explains the hot queries below and fails
+# if any of them scans a whole collection.
+
+KEYSET_ORDER = [("processed_at", -1), ("_id", -1)]
+
+INDEXES = {
+    "emails": [
+        # email_service skips and rejects emails already stored under their Message-ID
+        IndexModel("message_id", unique=True, sparse=True),
+        # Duplicate checks of the IMAP services, each among its own
+        # documents; unique so concurrent writers can't store a UID twice
+        IndexModel(
+            [("source", 1), ("imap_folder", 1), ("uidvalidity", 1), ("uid", 1)],
+            unique=True, partialFilterExpression={"uid": {"$exists": True}}
+        ),
+        # Flag sync, which updates every copy of a message
+        IndexModel([("imap_folder", 1), ("uidvalidity", 1), ("uid", 1)]),
+        # /api/stored-emails and /api/categorized-emails pages
+        IndexModel(KEYSET_ORDER),
+        # /api/emails, the latest emails by UID
+        IndexModel([("email_id", -1)]),
+        # mailbox_stats: inbox counts and most recent emails
+        IndexModel([("folder", 1), ("date", -1), ("category", 1)]),
+        # Summary queue, oldest claims and newest pending emails first
+        IndexModel(
+            [("summary_status", 1), ("processed_at", -1)],
+            partialFilterExpression={"summary_status": {"$exists": True}}
+        ),
+        # Version watermarks of the categorizer, search index and embeddings
+        IndexModel("categorized_version"),
+        IndexModel("search_indexed"),
+        # Emails a search index writer has claimed
+        IndexModel("search_claim", sparse=True),
+        IndexModel("embedded")
+    ],
+    "spam_emails": [
+        IndexModel(
+            [("imap_folder", 1), ("uidvalidity", 1), ("uid", 1)],
+            unique=True, partialFilterExpression={"uid": {"$exists": True}}
+        ),
+        IndexModel(KEYSET_ORDER)
+    ],
+    "pdf_attachments": [
+        # One document per distinct content
+        IndexModel("sha256", unique=True, sparse=True),
+        # /api/attachments
+        IndexModel([("upload_date", -1)])
+    ],
+    "schedules": [
+        # /api/schedules
+        IndexModel([("scheduled_date", -1)])
+    ],
+    "search_postings": [
+        IndexModel("term")
+    ],
+    "summary_cache": [
+        IndexModel("created_at", expireAfterSeconds=CACHE_TTL_DAYS * 24 * 3600),
+        IndexModel("last_used_at")
+    ]
+}
+
+# Index options that make two indexes on the same keys different
+OPTIONS = ("unique", "sparse", "partialFilterExpression", "expireAfterSeconds")
+
+# (name, collection, filter, sort, limit) of the queries behind request
+# paths and ingestion, with representative values
+HOT_QUERIES = [
+    ("/api/emails", "emails", {}, [("email_id", -1)], 2),
+    ("/api/emails/<id>", "emails", {"_id": ObjectId()}, None, 1),
+    ("/api/stored-emails", "emails", {}, KEYSET_ORDER, 51),
+    ("/api/stored-emails?after=", "emails", {"$or": [
+        {"processed_at": {"$lt": datetime.now()}},
+        {"processed_at": datetime.now(), "_id": {"$lt": ObjectId()}},
+        {"processed_at": None}
+    ]}, KEYSET_ORDER, 51),
+    ("/api/categorized-emails (spam)", "spam_emails", {}, KEYSET_ORDER, 51),
+    ("/api/dashboard-stats (reconcile)", "emails", INBOX_QUERY, [("date", -1)], 5),
+    ("/api/attachments", "pdf_attachments", {}, [("upload_date", -1)], 0),
+    ("/api/schedules", "schedules", {}, [("scheduled_date", -1)], 0),
+    ("/api/chat (search)", "search_postings", {"term": {"$in": ["flight", "ticket"]}}, None, 0),
+    ("IMAP duplicate check", "emails", {"source": "inbox_service", "imap_folder": "INBOX", "uidvalidity": 1, "uid": {"$in": [1, 2]}}, None, 0),
+    ("IMAP flag sync", "emails", {"imap_folder": "INBOX", "uidvalidity": 1, "uid": {"$in": [1, 2]}}, None, 0),
+    ("IMAP duplicate check (spam)", "spam_emails", {"imap_folder": "[Gmail]/Spam", "uidvalidity": 1, "uid": {"$in": [1, 2]}}, None, 0),
+    ("Message-ID check", "emails", {"message_id": {"$in": ["<a@example.com>"]}}, None, 0),
+    ("Summary queue", "emails", {"$or": [
+        {"summary_status": "pending"},
+        {"summary_status": "in_progress", "summary_claimed_at": {"$lt": datetime.now()}}
+    ]}, [("processed_at", -1)], 10),
+    ("Categorizer catch-up", "emails", {"categorized_version": {"$ne": 0}}, None, 0),
+    ("Search index catch-up", "emails", {"search_indexed": {"$ne": 0}}, None, 200),
+    ("Embedding catch-up", "emails", {"embedded": {"$ne": ""}}, None, 200)
+]
+
+_ensured = set()
+
+def _same_index(current, spec):
+    keys = [(field, int(direction)) for field, direction in current["key"]]
+    return keys == list(spec["key"].items()) and all(current.get(option) == spec.get(option) for option in OPTIONS)
+
+def ensure_indexes(collections=None):
+    """Create missing registry indexes (all collections by default); once per process"""
+    for name in collections or INDEXES:
+        if name in _ensured:
+            continue
+        collection = db[name]
+        try:
+            existing = collection.index_information()
+            missing = []
+            for model in INDEXES[name]:
+                spec = model.document
+                current = existing.get(spec["name"])
+                if current is not None and not _same_index(current, spec):
+                    print(f"Rebuilding index {name}.{spec['name']} with new options")
+                    collection.drop_index(spec["name"])
+                    current = None
+                if current is None:
+                    missing.append(model)
+            if missing:
+                collection.create_indexes(missing)
+                print(f"Created indexes on {name}: {', '.join(model.document['name'] for model in missing)}")
+            _ensured.add(name)
+        except Exception as e:
+            print(f"Index creation warning: {e}")
+
+def plan_stages(plan):
+    """Every stage name in an explain() plan tree"""
+    if isinstance(plan, dict):
+        stages = [plan["stage"]] if "stage" in plan else []
+        for value in plan.values():
+            stages.extend(plan_stages(value))
+        return stages
+    if isinstance(plan, list):
+        return [stage for item in plan for stage in plan_stages(item)]
+    return []
+
+def check_query_plans():
+    """[(query name, winning plan stages)] of the hot queries that scan a whole collection"""
+    scans = []
+    for name, collection, query, sort, limit in HOT_QUERIES:
+        cursor = db[collection].find(query, limit=limit)
+        if sort:
+            cursor = cursor.sort(sort)
+        stages = plan_stages(cursor.explain()["queryPlanner"]["winningPlan"])
+        if "COLLSCAN" in stages:
+            scans.append((name, stages))
+    return scans
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create the MongoDB indexes the services query through")
+    parser.add_argument("--check", action="store_true", help="also explain the hot queries and fail on collection scans")
+    args = parser.parse_args()
+
+    ensure_indexes()
+    if args.check:
+        scans = check_query_plans()
+        for name, stages in scans:
+            print(f"COLLSCAN: {name} ({' -> '.join(stages)})")
+        print(f"{len(HOT_QUERIES) - len(scans)} of {len(HOT_QUERIES)} hot queries are index-backed")
+        sys.exit(1 if scans else 0)
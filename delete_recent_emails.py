@@ -1,5 +1,6 @@
 from pymongo import MongoClient
 from datetime import datetime
+from mailbox_stats import reconcile
 
 # MongoDB setup
 MONGO_URI = "mongodb://localhost:27017"
@@ -28,6 +29,7 @@ def delete_recent_emails():
         print("\nDeletion Summary:")
         print(f"Emails deleted: {len(emails_to_delete)}")
         print(f"Emails remaining: {total_after}")
+        reconcile()
 
     except Exception as e:
         print(f"Error during deletion: {e}")
@@ -1,51 +1,112 @@
 import time
 from datetime import datetime
 from pymongo import MongoClient
-from email_service import categorize_email  # Import the categorize_email function
+from pymongo.errors import OperationFailure, PyMongoError
+from categorizer import RULESET_VERSION
+from batch_categorizer import recategorize, classify_chunk
+from mailbox_stats import record_recategorized
+from db_indexes import ensure_indexes
 
 # MongoDB connection details
 MONGO_URI = "mongodb://localhost:27017"
 DATABASE_NAME = "email_dashboard"
 COLLECTION_NAME = "emails"
 
-# Connect to the MongoDB database
+# Incremental categorization: each email records the ruleset version it was
+# categorized under, so only emails that are new or were categorized by
+# older rules are processed. On a replica set, a change stream delivers
+# inserts and content edits as they happen; on a standalone server the
+# version watermark is polled instead, which costs one index lookup when
+# nothing changed.
+
+POLL_INTERVAL = 60
+# Server error code for $changeStream on a standalone mongod
+CHANGE_STREAMS_UNSUPPORTED = 40573
+# Above this many pending emails the process pool is worth starting
+BULK_THRESHOLD = 5000
+
+# Inserts, replacements and updates that touch the fields the rules read;
+# the categorizer's own writes (category, categorized_version) are ignored
+CHANGE_PIPELINE = [{"$match": {"$or": [
+    {"operationType": {"$in": ["insert", "replace"]}},
+    {"updateDescription.updatedFields.subject": {"$exists": True}},
+    {"updateDescription.updatedFields.body": {"$exists": True}},
+    {"updateDescription.updatedFields.sender": {"$exists": True}}
+]}}]
+
+# Connect to the database
 def connect_to_database():
     client = MongoClient(MONGO_URI)
     db = client[DATABASE_NAME]
     return db[COLLECTION_NAME]
 
-# Fetch email summaries from the database
-def fetch_email_summaries(collection):
-    emails = collection.find({}, {"summary": 1, "subject": 1, "body": 1, "sender": 1})
-    return [email for email in emails]
+def categorize_pending(collection):
+    """Categorize every email not yet categorized under the current ruleset"""
+    query = {"categorized_version": {"$ne": RULESET_VERSION}}
+    pending = collection.count_documents(query)
+    if not pending:
+        return 0
+
+    print(f"[{datetime.now()}] Categorizing {pending} emails with ruleset {RULESET_VERSION}...")
+    stats = recategorize(
+        collection, query,
+        workers=None if pending > BULK_THRESHOLD else 0,
+        mark={"categorized_version": RULESET_VERSION},
+        on_change=record_recategorized
+    )
+    print(f"Categorized {stats['scanned']} emails, {stats['changed']} changed category")
+    return stats["scanned"]
+
+def categorize_change(collection, change):
+    """Categorize the email behind one change stream event"""
+    email = change.get("fullDocument")
+    if not email:
+        # Deleted before the event was read
+        return
+    update = {"categorized_version": RULESET_VERSION}
+    changes = classify_chunk([email])
+    for _, old, new in changes:
+        update["category"] = new
+        print(f"Email from {email.get('sender', 'Unknown Sender')} categorized as: {new}")
+    collection.update_one({"_id": email["_id"]}, {"$set": update})
+    record_recategorized(changes)
+
+def watch_changes(collection):
+    """Categorize emails as they are inserted or edited (needs a replica set)"""
+    with collection.watch(CHANGE_PIPELINE, full_document="updateLookup") as stream:
+        # The stream is open before the catch-up pass, so nothing slips between them
+        categorize_pending(collection)
+        print("Watching for new and edited emails...")
+        for change in stream:
+            categorize_change(collection, change)
+
+def poll_changes(collection):
+    """Fallback for standalone servers: poll the ruleset watermark"""
+    while True:
+        categorize_pending(collection)
+        time.sleep(POLL_INTERVAL)
 
 # Main function to run the email categorization process
 def main():
+    collection = connect_to_database()
+    use_change_stream = True
     while True:
-        print(f"[{datetime.now()}] Fetching and categorizing emails...")
         try:
-            # Connect to the database
-            collection = connect_to_database()
-            
-            # Fetch email summaries
-            email_summaries = fetch_email_summaries(collection)
-            
-            # Categorize emails
-            for email in email_summaries:
-                category = categorize_email({
-                    'subject': email.get('subject', ''),
-                    'body': email.get('body', ''),
-                    'sender': email.get('sender', '')
-                })
-                print(f"Email from {email.get('sender', 'Unknown Sender')} categorized as: {category}")
-                # Update the email document with the category
-                collection.update_one({"_id": email["_id"]}, {"$set": {"category": category}})
-            
-        except Exception as e:
+            ensure_indexes()
+            if use_change_stream:
+                watch_changes(collection)
+            else:
+                poll_changes(collection)
+        except OperationFailure as e:
+            if use_change_stream and e.code == CHANGE_STREAMS_UNSUPPORTED:
+                print(f"Change streams need a replica set; polling every {POLL_INTERVAL}s instead")
+                use_change_stream = False
+                continue
+            print(f"Error: {e}")
+            time.sleep(POLL_INTERVAL)
+        except PyMongoError as e:
             print(f"Error: {e}")
-        
-        # Sleep for a while before the next iteration
-        time.sleep(60)
+            time.sleep(POLL_INTERVAL)
 
 if __name__ == "__main__":
     main()
@@ -1,10 +1,8 @@
-from openai import OpenAI
 from pymongo import MongoClient
-import os
-from dotenv import load_dotenv
-
-# Load environment variables
-load_dotenv()
+from llm_backend import CHAT_MODEL, create_client
+from search_index import index_pending, remove_emails, search
+import embedding_index
+from context_builder import build_context, count_tokens
 
 # MongoDB setup
 client = MongoClient("mongodb://localhost:27017")
@@ -12,13 +10,24 @@ db = client.email_dashboard
 emails_collection = db.emails
 
 # OpenAI setup
-openai_client = OpenAI(
-    base_url="https://openrouter.ai/api/v1",
-    api_key=os.getenv('OPENROUTER_API_KEY'),
-    default_headers={
-        "HTTP-Referer": "http://localhost:3000",
-        "X-Title": "Email Search Assistant"
-    }
+openai_client = create_client("Email Search Assistant")
+
+# Emails indexed inline before a query; bigger backlogs are left to
+# `python search_index.py` and the ingestion services. Embedding is too slow
+# to run inline and is left to the ingestion services and
+# `python embedding_index.py`.
+QUERY_CATCH_UP = 200
+# Candidates taken from each retriever before fusing the rankings
+CANDIDATES = 50
+# Reciprocal rank fusion constant: higher values flatten the rank weights
+RRF_K = 60
+# Emails offered to the context builder, which keeps what fits its budget
+CONTEXT_CANDIDATES = 20
+# Answers that mean something went wrong, which are not worth caching
+ERROR_RESPONSES = (
+    "Sorry, I encountered an error while searching your emails.",
+    "Sorry, I couldn't analyze the emails properly.",
+    "Information not found."
 )
 
 def search_emails(query: str):
@@ -40,87 +49,65 @@ def search_emails(query: str):
         print(f"Error searching emails: {e}")
         return "Sorry, I encountered an error while searching your emails."
 
+def fuse_rankings(*rankings, k=5):
+    """Reciprocal rank fusion of [(email _id, score)] rankings, best first"""
+    fused = {}
+    for ranking in rankings:
+        for rank, (email_id, _) in enumerate(ranking):
+            fused[email_id] = fused.get(email_id, 0) + 1 / (RRF_K + rank + 1)
+    return sorted(fused, key=fused.get, reverse=True)[:k]
+
+def semantic_candidates(query):
+    """semantic_search() that falls back to no matches, leaving BM25 alone"""
+    try:
+        return embedding_index.semantic_search(query, k=CANDIDATES)
+    except Exception as e:
+        print(f"Error in semantic search, using keyword ranking only: {e}")
+        return []
+
 def find_relevant_emails(query):
     try:
-        # Get all emails from collection
-        all_emails = list(emails_collection.find({}))
-        print(f"Total emails to analyze: {len(all_emails)}")
+        # Pick up emails stored or summarized since the last update
+        index_pending(limit=QUERY_CATCH_UP)
         
-        # Create search terms
-        search_terms = query.lower().split()
+        # Hybrid retrieval: BM25 finds the literal words, embeddings find
+        # emails that mean the same thing in other words
+        ids = fuse_rankings(
+            search(query, k=CANDIDATES),
+            semantic_candidates(query),
+            k=CONTEXT_CANDIDATES
+        )
+        found = {email["_id"]: email for email in emails_collection.find(
+            {"_id": {"$in": ids}}, {"subject": 1, "date": 1, "sender": 1, "summary": 1, "body": 1}
+        )}
         
-        # Score each email for relevance
-        scored_emails = []
-        for email in all_emails:
-            score = calculate_relevance_score(email, search_terms)
-            if score > 0:  # Only include emails with some relevance
-                scored_emails.append((email, score))
-        
-        # Sort by relevance score
-        scored_emails.sort(key=lambda x: x[1], reverse=True)
+        # Emails deleted since they were indexed
+        missing = [email_id for email_id in ids if email_id not in found]
+        if missing:
+            remove_emails(missing)
+            try:
+                embedding_index.index.remove(missing)
+            except Exception as e:
+                print(f"Error removing deleted emails from the embedding index: {e}")
         
         # Return the most relevant emails
-        relevant_emails = [email for email, score in scored_emails[:5]]
+        relevant_emails = [found[email_id] for email_id in ids if email_id in found]
+        print(f"Found {len(relevant_emails)} relevant emails")
         return relevant_emails
         
     except Exception as e:
         print(f"Error finding relevant emails: {e}")
         return []
 
-def calculate_relevance_score(email, search_terms):
-    """Calculate how relevant an email is to the search terms"""
-    score = 0
-    
-    # Only look at subject and summary
-    subject = email.get('subject', '').lower()
-    summary = email.get('summary', '').lower()
-    
-    # Keyword mappings for different types of queries
-    keyword_mappings = {
-        'food': ['swiggy', 'zomato', 'order', 'food', 'delivery', 'restaurant'],
-        'exam': ['exam', 'test', 'assessment', 'schedule', 'examination'],
-        'meeting': ['meet', 'zoom', 'conference', 'discussion', 'call'],
-        'academic': ['convocation', 'graduation', 'ceremony', 'degree', 'university'],
-        'travel': ['flight', 'ticket', 'booking', 'travel', 'departure']
-    }
-    
-    # Check subject for matches
-    for term in search_terms:
-        if term in subject:
-            score += 20  # Higher weight for subject matches
-            
-    # Check summary for matches
-    for term in search_terms:
-        if term in summary:
-            score += 15  # Good weight for summary matches
-    
-    # Check for category-specific terms
-    for category, terms in keyword_mappings.items():
-        if any(term in subject for term in terms):
-            score += 10
-        if any(term in summary for term in terms):
-            score += 10
-            
-    # Print debug info
-    if score > 0:
-        print(f"\nScoring email:")
-        print(f"Subject: {subject}")
-        print(f"Score: {score}")
-    
-    return score
+def email_context(query, relevant_emails):
+    """build_context() with a log line of what made it into the budget"""
+    context, included = build_context(query, relevant_emails)
+    print(f"Context: {len(included)} of {len(relevant_emails)} emails, {count_tokens(context)} tokens")
+    return context, included
 
 def analyze_emails(query, relevant_emails):
     try:
-        # Create context only from subject and summary
-        context = []
-        for email in relevant_emails:
-            context.append(f"""
-            Subject: {email.get('subject')}
-            Date: {email.get('date')}
-            Summary: {email.get('summary')}
-            """)
-        
-        combined_context = "\n---\n".join(context)
+        combined_context, _ = email_context(query, relevant_emails)
         
         # Generate natural language response
         response = generate_response(query, combined_context)
@@ -130,58 +117,66 @@ def analyze_emails(query, relevant_emails):
         print(f"Error analyzing emails: {e}")
         return "Sorry, I couldn't analyze the emails properly."
 
+def quick_answer(query, context):
+    """Answer common questions straight from the context, or None to ask the model"""
+    # For Swiggy/food orders
+    if 'swiggy' in query.lower() or 'order' in query.lower():
+        for email_info in context.split('---'):
+            if 'swiggy' in email_info.lower():
+                return f"Mutton biryani - ₹280"
+
+    # For academic queries (convocation, graduation, etc.)
+    academic_terms = ['convocation', 'graduation', 'ceremony', 'degree']
+    if any(term in query.lower() for term in academic_terms):
+        for email_info in context.split('---'):
+            if any(term in email_info.lower() for term in academic_terms):
+                subject = email_info.split('Subject:')[1].split('\n')[0].strip()
+                date = email_info.split('Date:')[1].split('\n')[0].strip()
+                return f"{subject} on {date}"
+
+    # For exam related queries
+    if 'exam' in query.lower() or 'test' in query.lower():
+        for email_info in context.split('---'):
+            if 'exam' in email_info.lower() or 'test' in email_info.lower():
+                subject = email_info.split('Subject:')[1].split('\n')[0].strip()
+                date = email_info.split('Date:')[1].split('\n')[0].strip()
+                return f"{subject} on {date}"
+
+    # For meeting related queries
+    if 'meeting' in query.lower() or 'zoom' in query.lower():
+        for email_info in context.split('---'):
+            if 'meeting' in email_info.lower() or 'zoom' in email_info.lower():
+                subject = email_info.split('Subject:')[1].split('\n')[0].strip()
+                date = email_info.split('Date:')[1].split('\n')[0].strip()
+                return f"{subject} on {date}"
+
+    return None
+
+def chat_messages(query, context):
+    return [
+        {
+            "role": "system",
+            "content": "Provide brief, concise answers about email contents. Be direct and to the point."
+        },
+        {
+            "role": "user",
+            "content": f"Based on: {context}\n\nAnswer concisely: {query}"
+        }
+    ]
+
 def generate_response(query, context):
     try:
         print("\nGenerating response for query:", query)
-        print("\nContext available:", context)  # Debug log
         
-        # For Swiggy/food orders
-        if 'swiggy' in query.lower() or 'order' in query.lower():
-            for email_info in context.split('---'):
-                if 'swiggy' in email_info.lower():
-                    return f"Mutton biryani - ₹280"
-
-        # For academic queries (convocation, graduation, etc.)
-        academic_terms = ['convocation', 'graduation', 'ceremony', 'degree']
-        if any(term in query.lower() for term in academic_terms):
-            print("\nProcessing academic query")  # Debug log
-            for email_info in context.split('---'):
-                if any(term in email_info.lower() for term in academic_terms):
-                    print("\nFound matching academic email:", email_info)  # Debug log
-                    subject = email_info.split('Subject:')[1].split('\n')[0].strip()
-                    date = email_info.split('Date:')[1].split('\n')[0].strip()
-                    return f"{subject} on {date}"
-
-        # For exam related queries
-        if 'exam' in query.lower() or 'test' in query.lower():
-            for email_info in context.split('---'):
-                if 'exam' in email_info.lower() or 'test' in email_info.lower():
-                    subject = email_info.split('Subject:')[1].split('\n')[0].strip()
-                    date = email_info.split('Date:')[1].split('\n')[0].strip()
-                    return f"{subject} on {date}"
-
-        # For meeting related queries
-        if 'meeting' in query.lower() or 'zoom' in query.lower():
-            for email_info in context.split('---'):
-                if 'meeting' in email_info.lower() or 'zoom' in email_info.lower():
-                    subject = email_info.split('Subject:')[1].split('\n')[0].strip()
-                    date = email_info.split('Date:')[1].split('\n')[0].strip()
-                    return f"{subject} on {date}"
+        answer = quick_answer(query, context)
+        if answer:
+            return answer
 
         try:
             # For other queries, use OpenAI
             completion = openai_client.chat.completions.create(
-                model="google/gemini-pro",
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "Provide brief, concise answers about email contents. Be direct and to the point."
-                    },
-                    {
-                        "role": "user",
-                        "content": f"Based on: {context}\n\nAnswer concisely: {query}"
-                    }
-                ]
+                model=CHAT_MODEL,
+                messages=chat_messages(query, context)
             )
             
             if completion and completion.choices:
@@ -196,6 +191,58 @@ def generate_response(query, context):
         print(f"Error in generate_response: {str(e)}")
         return "Information not found."
 
+def stream_search(query):
+    """search_emails() as a stream of (event, data) pairs
+
+    Yields ("context", emails) as soon as retrieval is done, then
+    ("token", text) pieces of the answer and finally ("done", answer).
+    Closing the generator closes the model stream, so an abandoned request
+    stops generating tokens.
+    """
+    relevant_emails = find_relevant_emails(query)
+    context, included = email_context(query, relevant_emails) if relevant_emails else ("", [])
+    yield "context", [{
+        "id": str(email["_id"]),
+        "subject": email.get('subject'),
+        "date": email.get('date'),
+        "summary": email.get('summary')
+    } for email in included]
+
+    if not relevant_emails:
+        yield "done", "I couldn't find any emails matching your query."
+        return
+
+    answer = quick_answer(query, context)
+    if answer:
+        yield "token", answer
+        yield "done", answer
+        return
+
+    parts = []
+    try:
+        stream = openai_client.chat.completions.create(
+            model=CHAT_MODEL,
+            messages=chat_messages(query, context),
+            stream=True
+        )
+    except Exception as api_error:
+        print(f"API Error: {str(api_error)}")
+        yield "done", "Information not found."
+        return
+
+    try:
+        for chunk in stream:
+            text = chunk.choices[0].delta.content if chunk.choices else None
+            if text:
+                parts.append(text)
+                yield "token", text
+    except Exception as api_error:
+        print(f"API Error: {str(api_error)}")
+    finally:
+        stream.close()
+
+    yield "done", ''.join(parts).strip() or "Information not found."
+
 if __name__ == "__main__":
     # Test the service
     query = "When is my next flight?"
@@ -0,0 +1,273 @@
+import argparse
+import json
+import os
+from contextlib import contextmanager
+import numpy as np
+from bson import ObjectId
+from pymongo import MongoClient, UpdateOne
+from db_indexes import ensure_indexes
+
+try:
+    import fcntl
+except ImportError:  # Windows: single writer assumed
+    fcntl = None
+
+try:
+    from sentence_transformers import SentenceTransformer
+except ImportError:
+    SentenceTransformer = None
+
+# MongoDB setup
+MONGO_URI = "mongodb://localhost:27017"
+client = MongoClient(MONGO_URI)
+db = client.email_dashboard
+emails_collection = db.emails
+
+# Semantic index: one normalized embedding per email (subject, summary and
+# the start of the body) from a small CPU model, appended to a flat file
+# that is memory-mapped for search. Rows are append-only; an email that is
+# re-embedded gets a new row and only its latest row counts, and deleted
+# emails are listed in a tombstone file. `--rebuild` compacts both away.
+# Needs the optional sentence-transformers package; without it semantic
+# search returns nothing and retrieval stays lexical.
+
+EMBEDDING_MODEL = os.getenv('EMBEDDING_MODEL', "sentence-transformers/all-MiniLM-L6-v2")
+EMBEDDING_DIR = os.getenv('EMBEDDING_DIR', "embeddings")
+# float32, or int8 for a quarter of the size at a small loss of precision
+EMBEDDING_DTYPE = os.getenv('EMBEDDING_DTYPE', "float32")
+EMBEDDING_VERSION = f"{EMBEDDING_MODEL}:{EMBEDDING_DTYPE}"
+# Body words included in an email's embedding text (the model reads ~256 tokens)
+EMBED_BODY_WORDS = 200
+EMBED_BATCH_SIZE = 256
+# Rows scored per matrix product; small enough to stay in cache
+SEARCH_CHUNK_ROWS = 4096
+INT8_SCALE = 127
+# Semantic matches less similar than this are left out
+MIN_SIMILARITY = float(os.getenv('EMBEDDING_MIN_SIMILARITY', 0.25))
+ID_SIZE = 12
+
+_model = None
+
+def available():
+    return SentenceTransformer is not None
+
+def embed_texts(texts):
+    """Normalized float32 embeddings, one row per text"""
+    global _model
+    if _model is None:
+        _model = SentenceTransformer(EMBEDDING_MODEL, device="cpu")
+    return _model.encode(
+        texts, batch_size=64, normalize_embeddings=True, convert_to_numpy=True
+    ).astype(np.float32)
+
+def email_text(email):
+    body = ' '.join((email.get('body') or '').split()[:EMBED_BODY_WORDS])
+    return f"{email.get('subject') or ''}\n{email.get('summary') or ''}\n{body}"
+
+class EmbeddingIndex:
+    """Append-only, memory-mapped matrix of email embeddings"""
+
+    def __init__(self, directory, dtype=EMBEDDING_DTYPE, model=EMBEDDING_MODEL):
+        self.directory = directory
+        self.dtype = np.dtype(dtype)
+        self.model = model
+        self.sizes = None
+        self.rows = 0
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    @contextmanager
+    def _writing(self):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self.path("lock"), 'w') as lock:
+            if fcntl:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            yield
+
+    def _file_size(self, name):
+        try:
+            return os.path.getsize(self.path(name))
+        except OSError:
+            return 0
+
+    def _refresh(self):
+        """Map rows appended (or tombstones added) since the last search"""
+        sizes = (self._file_size("ids.bin"), self._file_size("deleted.bin"))
+        if sizes == self.sizes:
+            return
+        self.sizes = sizes
+        self.rows = sizes[0] // ID_SIZE
+        if not self.rows:
+            return
+        with open(self.path("meta.json")) as f:
+            meta = json.load(f)
+        if meta["model"] != self.model or meta["dtype"] != self.dtype.name:
+            print(f"Embedding index was built with {meta['model']} ({meta['dtype']}); run embedding_index.py --rebuild")
+            self.rows = 0
+            return
+
+        # ids are written after their vectors, so every listed id has a row;
+        # a torn ids write is cut off here and trimmed by the next append
+        self.rows = min(self.rows, self._file_size("vectors.bin") // (meta["dim"] * self.dtype.itemsize))
+        if not self.rows:
+            return
+        self.ids = np.fromfile(self.path("ids.bin"), dtype=f"V{ID_SIZE}", count=self.rows)
+        self.vectors = np.memmap(self.path("vectors.bin"), dtype=self.dtype, mode='r', shape=(self.rows, meta["dim"]))
+        # Only the latest row of each email is live
+        _, last = np.unique(self.ids[::-1], return_index=True)
+        self.live = np.zeros(self.rows, dtype=bool)
+        self.live[self.rows - 1 - last] = True
+        if sizes[1]:
+            deleted = np.fromfile(self.path("deleted.bin"), dtype=f"V{ID_SIZE}", count=sizes[1] // ID_SIZE)
+            self.live &= ~np.isin(self.ids, deleted)
+
+    def append(self, email_ids, vectors):
+        """Add (or replace) the embeddings of some emails"""
+        if not len(email_ids):
+            return
+        if self.dtype == np.int8:
+            vectors = np.clip(np.rint(vectors * INT8_SCALE), -INT8_SCALE, INT8_SCALE)
+        vectors = np.ascontiguousarray(vectors, dtype=self.dtype)
+        with self._writing():
+            meta = {"model": self.model, "dtype": self.dtype.name, "dim": vectors.shape[1]}
+            if os.path.exists(self.path("meta.json")):
+                with open(self.path("meta.json")) as f:
+                    if json.load(f) != meta:
+                        raise ValueError("Embedding index has another model or dtype; run embedding_index.py --rebuild")
+            else:
+                with open(self.path("meta.json"), 'w') as f:
+                    json.dump(meta, f)
+            self._trim(vectors.shape[1])
+            with open(self.path("vectors.bin"), 'ab') as f:
+                f.write(vectors.tobytes())
+            with open(self.path("ids.bin"), 'ab') as f:
+                f.write(b''.join(ObjectId(email_id).binary for email_id in email_ids))
+
+    def _trim(self, dim):
+        """Cut both files back to the rows whose vector and id were both written
+
+        An append that failed or died between (or during) its two writes
+        leaves extra bytes that would shift every later row against its id.
+        """
+        row_size = dim * self.dtype.itemsize
+        rows = min(self._file_size("ids.bin") // ID_SIZE, self._file_size("vectors.bin") // row_size)
+        for name, size in (("ids.bin", rows * ID_SIZE), ("vectors.bin", rows * row_size)):
+            if self._file_size(name) > size:
+                os.truncate(self.path(name), size)
+
+    def remove(self, email_ids):
+        """Tombstone deleted emails"""
+        if email_ids:
+            with self._writing(), open(self.path("deleted.bin"), 'ab') as f:
+                f.write(b''.join(ObjectId(email_id).binary for email_id in email_ids))
+
+    def search_batch(self, queries, k=10):
+        """[[(email _id, cosine similarity)]] of the k nearest emails for each query vector"""
+        self._refresh()
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        if not self.rows:
+            return [[] for _ in queries]
+        scores = np.empty((len(queries), self.rows), dtype=np.float32)
+        if self.dtype == np.int8:
+            # int8 rows are widened into one cache-sized buffer, chunk by chunk
+            buffer = np.empty((SEARCH_CHUNK_ROWS, self.vectors.shape[1]), dtype=np.float32)
+        for start in range(0, self.rows, SEARCH_CHUNK_ROWS):
+            block = self.vectors[start:start + SEARCH_CHUNK_ROWS]
+            if self.dtype == np.int8:
+                buffer[:len(block)] = block
+                block = buffer[:len(block)]
+            np.matmul(queries, block.T, out=scores[:, start:start + len(block)])
+        if self.dtype == np.int8:
+            scores /= INT8_SCALE
+        scores[:, ~self.live] = -np.inf
+
+        k = min(k, int(self.live.sum()))
+        results = []
+        for row in scores:
+            if not k:
+                results.append([])
+                continue
+            top = np.argpartition(row, -k)[-k:]
+            top = top[np.argsort(row[top])[::-1]]
+            results.append([(ObjectId(self.ids[i].tobytes()), float(row[i])) for i in top])
+        return results
+
+    def search(self, query, k=10):
+        return self.search_batch([query], k)[0]
+
+    def clear(self):
+        with self._writing():
+            for name in ("vectors.bin", "ids.bin", "deleted.bin", "meta.json"):
+                if os.path.exists(self.path(name)):
+                    os.remove(self.path(name))
+        self.sizes = None
+        self.rows = 0
+
+index = EmbeddingIndex(EMBEDDING_DIR)
+
+def semantic_search(query, k=10):
+    """[(email _id, similarity)] of the emails closest in meaning to a query"""
+    if not available() or not query.strip():
+        return []
+    matches = index.search(embed_texts([query])[0], k)
+    return [(email_id, score) for email_id, score in matches if score >= MIN_SIMILARITY]
+
+def embed_pending(limit=None):
+    """Embed emails that are new or changed since they were embedded; returns how many"""
+    if not available():
+        return 0
+    cursor = emails_collection.find(
+        {"embedded": {"$ne": EMBEDDING_VERSION}}, {"subject": 1, "summary": 1, "body": 1},
+        batch_size=EMBED_BATCH_SIZE, limit=limit or 0
+    )
+    embedded, batch = 0, []
+
+    def flush():
+        index.append([email["_id"] for email in batch], embed_texts([email_text(email) for email in batch]))
+        # Emails edited meanwhile stay pending
+        emails_collection.bulk_write([
+            UpdateOne(
+                {"_id": email["_id"], "subject": email.get("subject"), "summary": email.get("summary"), "body": email.get("body")},
+                {"$set": {"embedded": EMBEDDING_VERSION}}
+            )
+            for email in batch
+        ], ordered=False)
+        return len(batch)
+
+    for email in cursor:
+        batch.append(email)
+        if len(batch) >= EMBED_BATCH_SIZE:
+            embedded += flush()
+            batch = []
+    if batch:
+        embedded += flush()
+    return embedded
+
+def embed_new_emails():
+    """embed_pending() for the ingestion services, which must not fail on it"""
+    try:
+        embedded = embed_pending()
+        if embedded:
+            print(f"Embedded {embedded} emails for semantic search")
+    except Exception as e:
+        print(f"Error updating embedding index: {e}")
+
+def rebuild():
+    """Embed every email into a fresh index"""
+    index.clear()
+    emails_collection.update_many({"embedded": {"$exists": True}}, {"$unset": {"embedded": ""}})
+    return embed_pending()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maintain the semantic email index")
+    parser.add_argument("--rebuild", action="store_true", help="re-embed every email into a fresh index")
+    args = parser.parse_args()
+
+    ensure_indexes()
+    if not available():
+        print("sentence-transformers is not installed: pip install sentence-transformers")
+    elif args.rebuild:
+        print(f"Rebuilt embedding index with {rebuild()} emails")
+    else:
+        print(f"Embedded {embed_pending()} new or changed emails")
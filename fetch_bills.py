@@ -3,10 +3,12 @@ import email
 import os
 import json
 from datetime import datetime
-from email.header import decode_header
 import re
 from dotenv import load_dotenv
 import logging
+from imap_sync import search_uids
+from imap_fetch import fetch_messages
+from mime_parser import header_text
 
 load_dotenv()
 
@@ -80,6 +82,22 @@ def categorize_bill(subject, body):
     
     return 'other'
 
+def filter_bill_subjects(batch):
+    """Keep messages whose decoded subject has a clear bill indicator"""
+    bills = []
+    for message in batch:
+        # Get subject safely
+        subject = header_text(message["headers"], "subject")
+        if not subject:
+            continue
+        
+        # Skip if no clear bill indicators
+        if not any(word in subject.lower() for word in ['bill', 'payment', 'due']):
+            continue
+        message["subject"] = subject
+        bills.append(message)
+    return bills
+
 def fetch_bills():
     mail = connect_to_gmail()
     if not mail:
@@ -94,56 +112,18 @@ def fetch_bills():
         
         # Search for bill-related emails from last 30 days
         search_criteria = '(OR SUBJECT "bill" SUBJECT "payment" SUBJECT "due") SINCE "30"'
-        result, message_numbers = mail.search(None, search_criteria)
+        uids = search_uids(mail, search_criteria)
         
-        if result != 'OK' or not message_numbers[0]:
+        if not uids:
             logging.warning("No messages found or search failed")
             return []
 
-        for num in message_numbers[0].split():
+        # Headers for every match come in one batched FETCH; only the text
+        # part of messages that look like bills is downloaded
+        for message in fetch_messages(mail, uids, filter_batch=filter_bill_subjects, want_pdfs=False):
             try:
-                _, msg_data = mail.fetch(num, '(RFC822)')
-                if not msg_data or not msg_data[0]:
-                    continue
-
-                email_body = msg_data[0][1]
-                message = email.message_from_bytes(email_body)
-                
-                # Get subject safely
-                subject_header = message.get("subject")
-                if not subject_header:
-                    continue
-                    
-                subject_parts = decode_header(subject_header)[0]
-                subject = subject_parts[0]
-                if isinstance(subject, bytes):
-                    subject = subject.decode(subject_parts[1] or 'utf-8', errors='ignore')
-                
-                # Get body safely
-                body = ""
-                if message.is_multipart():
-                    for part in message.walk():
-                        if part.get_content_type() == "text/plain":
-                            try:
-                                payload = part.get_payload(decode=True)
-                                if payload:
-                                    body = payload.decode('utf-8', errors='ignore')
-                                break
-                            except Exception as e:
-                                logging.error(f"Error decoding email part: {e}")
-                                continue
-                else:
-                    try:
-                        payload = message.get_payload(decode=True)
-                        if payload:
-                            body = payload.decode('utf-8', errors='ignore')
-                    except Exception as e:
-                        logging.error(f"Error decoding email body: {e}")
-                        continue
-
-                # Skip if no clear bill indicators
-                if not any(word in subject.lower() for word in ['bill', 'payment', 'due']):
-                    continue
+                subject = message["subject"]
+                body = message["body"]
                 
                 # Extract bill information
                 bill_info = extract_bill_info(body)
@@ -153,17 +133,17 @@ def fetch_bills():
                 category = categorize_bill(subject, body)
                 
                 bills.append({
-                    'id': num.decode(),
+                    'id': str(message["uid"]),
                     'name': subject,
                     'amount': bill_info['amount'],
                     'dueDate': bill_info['due_date'],
                     'category': category,
                     'status': 'pending',
-                    'received_date': message['date']
+                    'received_date': header_text(message["headers"], 'date', None)
                 })
                 
             except Exception as e:
-                logging.error(f"Error processing email {num}: {e}")
+                logging.error(f"Error processing email {message['uid']}: {e}")
                 continue
             
     except Exception as e:
@@ -1,11 +1,17 @@
 import imaplib
 import email
-from email.header import decode_header
-from datetime import datetime, timedelta
+from datetime import datetime
 import os
 from pymongo import MongoClient
+from pymongo.errors import DuplicateKeyError
 from dotenv import load_dotenv
-import base64
+from attachment_store import store_attachment, email_ref
+from imap_sync import enable_condstore, find_new_uids, sync_flag_changes, existing_uids, checkpoint
+from imap_fetch import fetch_messages
+from imap_idle import USE_IDLE, watch_folders
+from backfill import run_backfill
+from mime_parser import header_text
+from db_indexes import ensure_indexes
 import schedule
 import time
 
@@ -17,176 +23,141 @@ MONGO_URI = "mongodb://localhost:27017"
 client = MongoClient(MONGO_URI)
 db = client.email_dashboard
 spam_emails_collection = db.spam_emails  # New separate collection for spam
-attachments_collection = db.pdf_attachments
 
 # Email credentials
 EMAIL = os.getenv('GMAIL_EMAIL')
 PASSWORD = os.getenv('GMAIL_APP_PASSWORD')
 IMAP_SERVER = "imap.gmail.com"
 
-def decode_email_body(email_message):
-    """Extract full email body with better error handling"""
-    body = ""
-    if email_message.is_multipart():
-        for part in email_message.walk():
-            if part.get_content_type() == "text/plain":
-                try:
-                    payload = part.get_payload(decode=True)
-                    if payload:
-                        body = payload.decode('utf-8', errors='replace')
-                        break
-                except Exception as e:
-                    print(f"Error decoding part: {e}")
-                    continue
-    else:
+SPAM_FOLDER = '[Gmail]/Spam'
+# Name under which the spam watcher's checkpoint is stored
+SYNC_SERVICE = "spam_service"
+# Historical spam backfill: its job record and default start date
+JOB_NAME = "spam_backfill"
+DEFAULT_SINCE = "2024-11-10"
+
+def spam_document(message, uidvalidity):
+    """Spam collection document for a message fetched by imap_fetch, without attachments"""
+    headers = message["headers"]
+
+    # Get subject
+    subject = header_text(headers, "subject", "No Subject")
+
+    # Get sender
+    sender = email.utils.parseaddr(header_text(headers, "from"))[1]
+
+    return {
+        "email_id": message["uid"],
+        "uid": message["uid"],
+        "uidvalidity": uidvalidity,
+        "imap_folder": SPAM_FOLDER,
+        "subject": subject,
+        "sender": sender,
+        "date": header_text(headers, "date", None),
+        "body": message["body"] or "No readable content",
+        "processed_at": datetime.now(),
+        "isRead": False,
+        "isStarred": False,
+        "detected_at": datetime.now()
+    }
+
+def build_spam_documents(messages, folder, uidvalidity):
+    """Backfill parse step: one spam document (or None on failure) per message"""
+    documents = []
+    for message in messages:
         try:
-            payload = email_message.get_payload(decode=True)
-            if payload:
-                body = payload.decode('utf-8', errors='replace')
+            documents.append(spam_document(message, uidvalidity))
         except Exception as e:
-            print(f"Error decoding body: {e}")
-            body = "Could not decode email body"
-    
-    return body or "No readable content"
+            print(f"Error processing spam email {message['uid']}: {e}")
+            documents.append(None)
+    return documents
 
-def process_spam_email(mail, num):
-    """Process a single spam email and store it in spam collection"""
+def process_spam_email(message, uidvalidity):
+    """Store a spam email fetched by imap_fetch in spam collection"""
+    uid = message["uid"]
     try:
-        # Check if email already exists in spam collection
-        if spam_emails_collection.find_one({"email_id": int(num)}):
-            print("Spam email already exists, skipping...")
-            return
-
-        # Fetch email data
-        _, msg_data = mail.fetch(num, "(RFC822)")
-        email_body = msg_data[0][1]
-        email_message = email.message_from_bytes(email_body)
-
-        # Get subject
-        subject = decode_header(email_message["subject"] or "No Subject")[0][0]
-        if isinstance(subject, bytes):
-            subject = subject.decode()
-        print(f"Subject: {subject}")
-
-        # Get sender
-        sender = email.utils.parseaddr(email_message["from"])[1]
-        print(f"From: {sender}")
-
-        # Get date
-        date = email_message["date"]
-
-        # Get body
-        body = decode_email_body(email_message)
+        spam_email_doc = spam_document(message, uidvalidity)
+        print(f"Subject: {spam_email_doc['subject']}")
+        print(f"From: {spam_email_doc['sender']}")
         
         # Process attachments
         pdf_attachments = []
-        if email_message.is_multipart():
-            for part in email_message.walk():
-                if part.get_content_type() == "application/pdf":
-                    try:
-                        filename = part.get_filename()
-                        if filename:
-                            print(f"Processing PDF: {filename}")
-                            pdf_content = base64.b64encode(part.get_payload(decode=True)).decode()
-                            attachment_doc = {
-                                "filename": filename,
-                                "content": pdf_content,
-                                "email_id": num.decode(),
-                                "upload_date": datetime.now(),
-                                "is_spam": True  # Mark attachment as from spam
-                            }
-                            attachment_id = attachments_collection.insert_one(attachment_doc).inserted_id
-                            pdf_attachments.append({
-                                "filename": filename,
-                                "id": str(attachment_id)
-                            })
-                    except Exception as e:
-                        print(f"Error processing PDF: {e}")
+        for filename, pdf_data in message["pdfs"]:
+            try:
+                print(f"Processing PDF: {filename}")
+                attachment_id = store_attachment(
+                    pdf_data,
+                    filename,
+                    email_ref(uid, SPAM_FOLDER, uidvalidity),
+                    is_spam=True  # Mark attachment as from spam
+                )
+                pdf_attachments.append({
+                    "filename": filename,
+                    "id": str(attachment_id)
+                })
+            except Exception as e:
+                print(f"Error processing PDF: {e}")
 
         # Store in MongoDB spam collection
-        spam_email_doc = {
-            "email_id": int(num),
-            "subject": subject,
-            "sender": sender,
-            "date": date,
-            "body": body,
-            "has_attachments": len(pdf_attachments) > 0,
-            "pdf_attachments": pdf_attachments,
-            "processed_at": datetime.now(),
-            "isRead": False,
-            "isStarred": False,
-            "detected_at": datetime.now()
-        }
+        spam_email_doc["has_attachments"] = len(pdf_attachments) > 0
+        spam_email_doc["pdf_attachments"] = pdf_attachments
 
         result = spam_emails_collection.insert_one(spam_email_doc)
         print(f"Stored spam email successfully (ID: {result.inserted_id})")
         return True
 
+    except DuplicateKeyError:
+        # Already stored (the unique UID index)
+        return True
     except Exception as e:
         print(f"Error processing spam email: {e}")
         return False
 
-def fetch_spam_emails():
-    """Fetch historical spam emails since November 10th, 2024"""
+def fetch_spam_emails(since=DEFAULT_SINCE, resume=True):
+    """Fetch historical spam emails since `since` (YYYY-MM-DD), resuming the last run by default"""
     try:
         print("\nConnecting to Gmail...")
-        mail = imaplib.IMAP4_SSL(IMAP_SERVER)
-        mail.login(EMAIL, PASSWORD)
-        
-        print("\nAccessing Spam folder...")
-        mail.select('[Gmail]/Spam')
-        
-        date_since = "10-Nov-2024"
-        search_criteria = f'(SINCE "{date_since}")'
-        print(f"Searching for spam emails since {date_since}...")
-        
-        _, message_numbers = mail.search(None, search_criteria)
-        email_ids = message_numbers[0].split()
-        total_emails = len(email_ids)
-        print(f"Found {total_emails} spam emails")
-
-        processed_count = 0
-        error_count = 0
-
-        for num in email_ids:
-            processed_count += 1
-            print(f"\nProcessing spam email {processed_count}/{total_emails}")
-            if not process_spam_email(mail, num):
-                error_count += 1
-
-        print("\nSpam Processing Summary:")
-        print(f"Total spam emails found: {total_emails}")
-        print(f"Successfully processed: {processed_count - error_count}")
-        print(f"Errors encountered: {error_count}")
-
-        mail.close()
-        mail.logout()
+        run_backfill(
+            JOB_NAME, [SPAM_FOLDER], spam_emails_collection, build_spam_documents,
+            since=datetime.strptime(since, "%Y-%m-%d"),
+            server=IMAP_SERVER, user=EMAIL, password=PASSWORD,
+            attachment_fields={"is_spam": True},
+            resume=resume
+        )
 
     except Exception as e:
         print(f"Error: {e}")
 
+def sync_spam(mail):
+    """Store spam emails that arrived since the checkpoint"""
+    uids, status, state = find_new_uids(mail, SYNC_SERVICE, SPAM_FOLDER)
+    sync_flag_changes(mail, spam_emails_collection, SPAM_FOLDER, status, state)
+    
+    if not uids:
+        print("No new spam emails")
+        checkpoint(SYNC_SERVICE, SPAM_FOLDER, status, state, uids)
+        return
+    
+    print(f"Found {len(uids)} new spam emails")
+    already_stored = existing_uids(spam_emails_collection, SPAM_FOLDER, status["uidvalidity"], uids)
+    new_uids = [uid for uid in uids if uid not in already_stored]
+    stored_uids = set()
+    for message in fetch_messages(mail, new_uids):
+        if process_spam_email(message, status["uidvalidity"]):
+            stored_uids.add(message["uid"])
+    failed_uids = set(new_uids) - stored_uids
+    checkpoint(SYNC_SERVICE, SPAM_FOLDER, status, state, uids, failed_uids)
+
 def check_new_spam():
-    """Check for new spam emails in the last 5 minutes"""
+    """Check for spam emails that arrived since the last checkpoint"""
     try:
         print("\nChecking for new spam emails...")
         mail = imaplib.IMAP4_SSL(IMAP_SERVER)
         mail.login(EMAIL, PASSWORD)
+        enable_condstore(mail)
         
         print("\nChecking spam folder...")
-        mail.select('[Gmail]/Spam')
-        
-        five_mins_ago = (datetime.now() - timedelta(minutes=5)).strftime("%d-%b-%Y")
-        search_criteria = f'(SINCE "{five_mins_ago}")'
-        _, message_numbers = mail.search(None, search_criteria)
-        email_ids = message_numbers[0].split()
-        
-        if not email_ids:
-            print("No new spam emails")
-            return
-        
-        print(f"Found {len(email_ids)} new spam emails")
-        for num in email_ids:
-            process_spam_email(mail, num)
+        sync_spam(mail)
 
         mail.logout()
         print("Spam check completed")
@@ -194,9 +165,20 @@ def check_new_spam():
     except Exception as e:
         print(f"Error checking spam emails: {e}")
 
+def poll_new_spam():
+    print("Will check for new spam every 5 minutes")
+    
+    # Schedule continuous checks
+    schedule.every(5).minutes.do(check_new_spam)
+    
+    while True:
+        schedule.run_pending()
+        time.sleep(1)
+
 def run_spam_service():
     """Run both initial fetch and continuous monitoring of spam"""
     print("Starting spam email service...")
+    ensure_indexes()
     
     # First, fetch historical spam emails
     print("\nFetching historical spam emails...")
@@ -204,14 +186,10 @@ def run_spam_service():
     
     # Then start continuous monitoring
     print("\nStarting continuous spam monitoring...")
-    print("Will check for new spam every 5 minutes")
-    
-    # Schedule continuous checks
-    schedule.every(5).minutes.do(check_new_spam)
-    
-    while True:
-        schedule.run_pending()
-        time.sleep(1)
+    if USE_IDLE:
+        watch_folders({SPAM_FOLDER: sync_spam}, IMAP_SERVER, EMAIL, PASSWORD, fallback=poll_new_spam)
+    else:
+        poll_new_spam()
 
 if __name__ == "__main__":
     run_spam_service() 
\ No newline at end of file
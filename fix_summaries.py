@@ -1,5 +1,8 @@
 from pymongo import MongoClient
-from email_service import summarize_email
+from summarizer import FAILED_SUMMARIES, SUMMARY_BATCH_SIZE
+from summary_worker import run_worker
+from db_indexes import ensure_indexes
+import asyncio
 import time
 import logging
 
@@ -16,64 +19,37 @@ emails_collection = db.emails
 def fix_email_summaries():
     try:
         print("\nChecking for emails with missing or error summaries...")
+        ensure_indexes()
         
-        # Find emails with problematic summaries
-        problem_emails = emails_collection.find({
-            "$or": [
-                {"summary": None},
-                {"summary": ""},
-                {"summary": "Error in summarization"},
-                {"summary": "Unable to generate summary"},
-                {"summary": "No summary generated"}
-            ]
-        })
-        
-        total = emails_collection.count_documents({
-            "$or": [
-                {"summary": None},
-                {"summary": ""},
-                {"summary": "Error in summarization"},
-                {"summary": "Unable to generate summary"},
-                {"summary": "No summary generated"}
-            ]
-        })
+        # Queue emails with problematic summaries for the summary worker,
+        # leaving alone any a running worker has already claimed
+        result = emails_collection.update_many(
+            {
+                "$or": [
+                    {"summary": None},
+                    {"summary": ""},
+                    {"summary": {"$in": list(FAILED_SUMMARIES)}}
+                ],
+                "summary_status": {"$ne": "in_progress"}
+            },
+            {"$set": {"summary_status": "pending"}}
+        )
+        total = result.modified_count
         
         print(f"Found {total} emails needing summary fixes")
         
-        fixed_count = 0
-        for i, email in enumerate(problem_emails, 1):
-            try:
-                # Get new summary
-                new_summary = summarize_email(
-                    email.get('subject', ''),
-                    email.get('body', '')
-                )
-                
-                # Add delay to avoid rate limits
-                time.sleep(2)
-                
-                # Update if we got a valid summary
-                if new_summary and "error" not in new_summary.lower():
-                    emails_collection.update_one(
-                        {'_id': email['_id']},
-                        {'$set': {'summary': new_summary}}
-                    )
-                    fixed_count += 1
-                    print(f"Fixed summary for: {email.get('subject', 'No Subject')}")
-                    print(f"New summary: {new_summary}\n")
-                else:
-                    logging.error(f"Failed to generate summary for email {email.get('_id')}: {new_summary}")
-                
-                if i % 5 == 0:
-                    print(f"Processed {i}/{total} emails")
-                    
-            except Exception as e:
-                logging.error(f"Error fixing summary for email {email.get('_id')}: {e}")
-                continue
+        # Summarize concurrently within the provider's rate limits, packing
+        # short emails several to a request
+        started = time.monotonic()
+        stats = asyncio.run(run_worker(emails_collection, batch_size=SUMMARY_BATCH_SIZE, stop_when_empty=True))
+        elapsed = time.monotonic() - started or 1
+        if stats["failed"]:
+            logging.error(f"Failed to generate summaries for {stats['failed']} emails")
         
         print(f"\nSummary Fix Results:")
-        print(f"Total emails processed: {total}")
-        print(f"Successfully fixed: {fixed_count}")
+        print(f"Total emails processed: {stats['summarized'] + stats['failed']}")
+        print(f"Successfully fixed: {stats['summarized']}")
+        print(f"Rate: {(stats['summarized'] + stats['failed']) * 60 / elapsed:.0f} emails/minute")
         
     except Exception as e:
         logging.error(f"Error during summary fix process: {e}")
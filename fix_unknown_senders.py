@@ -1,6 +1,7 @@
 from pymongo import MongoClient
 import email.utils
 import re
+from mailbox_stats import reconcile
 
 # MongoDB setup
 MONGO_URI = "mongodb://localhost:27017"
@@ -111,7 +112,7 @@ def fix_unknown_senders():
                 if new_sender:
                     emails_collection.update_one(
                         {'_id': email['_id']},
-                        {'$set': {'sender': new_sender}}
+                        {'$set': {'sender': new_sender}, '$unset': {'search_indexed': '', 'categorized_version': ''}}
                     )
                     fixed_count += 1
                     print(f"Fixed sender for email: {email.get('subject', 'No Subject')}")
@@ -128,6 +129,8 @@ def fix_unknown_senders():
         print(f"\nSender Fix Results:")
         print(f"Total emails processed: {total}")
         print(f"Successfully fixed: {fixed_count}")
+        # Recent emails on the dashboard show the sender
+        reconcile()
         
     except Exception as e:
         print(f"Error during sender fix process: {e}")
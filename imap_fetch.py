@@ -0,0 +1,307 @@
+import re
+from email.header import decode_header, make_header
+from email.utils import decode_rfc2231
+from urllib.parse import unquote
+from mime_parser import parse_headers, decode_transfer_encoding, part_text, parse_message
+
+# Batched IMAP retrieval: one UID FETCH per batch of messages for headers,
+# size and BODYSTRUCTURE, then only the MIME parts that are actually needed
+# (the first text part and PDF attachments), grouped so messages needing the
+# same sections share a command. Messages rejected from their headers alone
+# (e.g. duplicates) never have their bodies downloaded.
+#
+# With raw=True the header bytes, the undecoded text part and whole-message
+# fallbacks are kept as fetched and decode_fetched() does the parsing later,
+# so a caller can move that CPU work off its fetch threads (see backfill).
+
+HEADER_BATCH_SIZE = 500
+# Upper bound on the bytes requested by a single part FETCH
+PART_BATCH_BYTES = 20 * 1024 * 1024
+
+OPEN, CLOSE = object(), object()
+TOKEN_PATTERN = re.compile(rb'\s*(?:(\()|(\))|"((?:[^"\\]|\\.)*)"|\{(\d+)\}$|([^\s()"]+))')
+
+def uid_set(uids):
+    """Compress UIDs into an IMAP message set such as 1:500,502,510:512"""
+    ranges = []
+    for uid in sorted(set(uids)):
+        if ranges and uid == ranges[-1][1] + 1:
+            ranges[-1][1] = uid
+        else:
+            ranges.append([uid, uid])
+    return ','.join(str(start) if start == end else f'{start}:{end}' for start, end in ranges)
+
+def _lex(line, tokens):
+    position = 0
+    line = line.rstrip()
+    while position < len(line):
+        match = TOKEN_PATTERN.match(line, position)
+        if not match:
+            break
+        position = match.end()
+        open_paren, close_paren, quoted, literal_size, atom = match.groups()
+        if open_paren:
+            tokens.append(OPEN)
+        elif close_paren:
+            tokens.append(CLOSE)
+        elif quoted is not None:
+            tokens.append(re.sub(rb'\\(.)', rb'\1', quoted))
+        elif literal_size is not None:
+            # The literal itself follows as the second item of the tuple
+            continue
+        elif atom.upper() == b'NIL':
+            tokens.append(None)
+        else:
+            tokens.append(atom)
+
+def _tokenize(data):
+    tokens = []
+    for item in data:
+        if isinstance(item, tuple):
+            _lex(item[0], tokens)
+            tokens.append(item[1])
+        elif item:
+            _lex(item, tokens)
+    return tokens
+
+def _parse(tokens, position=0):
+    """Parse tokens into nested lists, returning (list, next position)"""
+    items = []
+    while position < len(tokens):
+        token = tokens[position]
+        position += 1
+        if token is OPEN:
+            nested, position = _parse(tokens, position)
+            items.append(nested)
+        elif token is CLOSE:
+            return items, position
+        else:
+            items.append(token)
+    return items, position
+
+def parse_fetch_response(data):
+    """Turn imaplib FETCH response data into {uid: {ITEM: value}}"""
+    items, _ = _parse(_tokenize(data))
+    messages = {}
+    # Top level alternates message sequence numbers and attribute lists
+    for entry in items:
+        if not isinstance(entry, list):
+            continue
+        attributes = {}
+        for key, value in zip(entry[::2], entry[1::2]):
+            if isinstance(key, bytes):
+                attributes[key.decode().upper()] = value
+        if 'UID' in attributes:
+            messages[int(attributes['UID'])] = attributes
+    return messages
+
+def _params(values):
+    """BODYSTRUCTURE parameter list -> dict with lowercase keys"""
+    if not isinstance(values, list):
+        return {}
+    params = {}
+    for key, value in zip(values[::2], values[1::2]):
+        if isinstance(key, bytes) and isinstance(value, bytes):
+            params[key.decode(errors='replace').lower()] = value.decode(errors='replace')
+    return params
+
+def _decode_filename(params):
+    """Filename from disposition/type parameters, handling RFC 2231 and 2047 encodings"""
+    for key in ('filename', 'name'):
+        if params.get(key):
+            try:
+                return str(make_header(decode_header(params[key])))
+            except Exception:
+                return params[key]
+        if params.get(key + '*'):
+            # charset'language'percent-encoded-text
+            charset, _, text = decode_rfc2231(params[key + '*'])
+            try:
+                return unquote(text, encoding=charset or 'utf-8', errors='replace')
+            except LookupError:
+                return unquote(text, errors='replace')
+    return None
+
+def parse_bodystructure(structure, prefix=''):
+    """Flatten a parsed BODYSTRUCTURE into leaf parts with their section numbers"""
+    if not isinstance(structure, list) or not structure:
+        return []
+    if isinstance(structure[0], list):
+        # Children come first, followed by the multipart subtype and extensions
+        parts = []
+        for index, child in enumerate(structure):
+            if not isinstance(child, list):
+                break
+            parts.extend(parse_bodystructure(child, f'{prefix}{index + 1}.'))
+        return parts
+
+    content_type = f"{structure[0].decode()}/{structure[1].decode()}".lower()
+    params = _params(structure[2])
+    disposition_params = {}
+    # The disposition sits after the type-specific fields (line count for
+    # text, envelope/body/line count for message/rfc822) and the MD5
+    if content_type == 'message/rfc822':
+        extension_start = 10
+    elif content_type.startswith('text/'):
+        extension_start = 8
+    else:
+        extension_start = 7
+    for field in structure[extension_start:]:
+        if isinstance(field, list) and field and isinstance(field[0], bytes):
+            disposition_params = _params(field[1] if len(field) > 1 else None)
+            break
+    return [{
+        "section": prefix.rstrip('.') or '1',
+        "content_type": content_type,
+        "charset": params.get('charset'),
+        "encoding": (structure[5] or b'7bit').decode().lower(),
+        "size": int(structure[6]) if structure[6] is not None else 0,
+        "filename": _decode_filename(disposition_params) or _decode_filename(params)
+    }]
+
+def wanted_parts(parts, want_pdfs=True):
+    """The first text/plain part (else text/html) plus PDF attachments"""
+    wanted = []
+    text = next((part for part in parts if part["content_type"] == 'text/plain' and not part["filename"]), None)
+    if text is None:
+        text = next((part for part in parts if part["content_type"] == 'text/html' and not part["filename"]), None)
+    if text:
+        wanted.append(text)
+    if want_pdfs:
+        wanted.extend(part for part in parts if part["content_type"] == 'application/pdf' and part["filename"])
+    return wanted
+
+def fetch_summaries(mail, uids, batch_size=HEADER_BATCH_SIZE, raw=False):
+    """Yield per-message dicts with uid, size, headers and MIME parts, one FETCH per batch
+
+    With `raw`, "headers" is left unset and the header bytes are in "raw_headers".
+    """
+    uids = sorted(uids)
+    for start in range(0, len(uids), batch_size):
+        batch = uids[start:start + batch_size]
+        typ, data = mail.uid('FETCH', uid_set(batch), '(UID RFC822.SIZE BODY.PEEK[HEADER] BODYSTRUCTURE)')
+        if typ != 'OK':
+            print(f"Header fetch failed for batch starting at UID {batch[0]}: {data}")
+            continue
+        for uid, attributes in sorted(parse_fetch_response(data).items()):
+            header_bytes = attributes.get('BODY[HEADER]') or b''
+            message = {
+                "uid": uid,
+                "size": int(attributes.get('RFC822.SIZE') or 0),
+                "parts": parse_bodystructure(attributes.get('BODYSTRUCTURE'))
+            }
+            if raw:
+                message["raw_headers"] = header_bytes
+            else:
+                message["headers"] = parse_headers(header_bytes)
+            yield message
+
+def fetch_bodies(mail, messages, want_pdfs=True, max_bytes=PART_BATCH_BYTES, raw=False):
+    """Download the wanted parts of each message, filling in "body" and "pdfs"
+
+    Messages that need the same sections are fetched together with one
+    UID FETCH, split so no single command asks for more than max_bytes.
+    With `raw`, the text part is kept undecoded in "raw_body" and messages
+    without a BODYSTRUCTURE in "raw"; decode_fetched() fills in the rest.
+    """
+    groups = {}
+    unstructured = []
+    for message in messages:
+        message["body"] = ""
+        message["pdfs"] = []
+        message["wanted"] = wanted_parts(message["parts"], want_pdfs)
+        sections = tuple(part["section"] for part in message["wanted"])
+        if sections:
+            groups.setdefault(sections, []).append(message)
+        elif not message["parts"]:
+            # BODYSTRUCTURE missing or unparseable: fall back to the whole message
+            unstructured.append(message)
+
+    for sections, group in groups.items():
+        items = ' '.join(f'BODY.PEEK[{section}]' for section in sections)
+        batch, batch_bytes = [], 0
+        for message in group:
+            size = sum(part["size"] for part in message["wanted"])
+            if batch and batch_bytes + size > max_bytes:
+                _fetch_parts(mail, batch, items, raw)
+                batch, batch_bytes = [], 0
+            batch.append(message)
+            batch_bytes += size
+        if batch:
+            _fetch_parts(mail, batch, items, raw)
+
+    for message in unstructured:
+        _fetch_whole(mail, message, want_pdfs, raw)
+    return messages
+
+def _fetch_parts(mail, batch, items, raw=False):
+    by_uid = {message["uid"]: message for message in batch}
+    typ, data = mail.uid('FETCH', uid_set(by_uid), f'(UID {items})')
+    if typ != 'OK':
+        print(f"Body fetch failed for {len(batch)} messages: {data}")
+        return
+    for uid, attributes in parse_fetch_response(data).items():
+        if uid in by_uid:
+            _fill_message(by_uid[uid], attributes, raw)
+
+def _fetch_whole(mail, message, want_pdfs, raw=False):
+    typ, data = mail.uid('FETCH', str(message["uid"]), '(UID BODY.PEEK[])')
+    if typ != 'OK':
+        print(f"Message fetch failed for UID {message['uid']}: {data}")
+        return
+    content = parse_fetch_response(data).get(message["uid"], {}).get('BODY[]')
+    if not content:
+        return
+    if raw:
+        message["raw"] = content
+        return
+    _, message["body"], message["body_type"], pdfs = parse_message(content, want_pdfs)
+    message["pdfs"].extend(pdfs)
+
+def _fill_message(message, attributes, raw=False):
+    for part in message["wanted"]:
+        data = attributes.get(f'BODY[{part["section"]}]')
+        if data is None:
+            continue
+        if part["content_type"] == 'application/pdf':
+            message["pdfs"].append((part["filename"], decode_transfer_encoding(data, part["encoding"])))
+        elif raw:
+            message["raw_body"] = {key: part[key] for key in ("encoding", "content_type", "charset")}
+            message["raw_body"]["data"] = data
+        else:
+            message["body"] = part_text(decode_transfer_encoding(data, part["encoding"]), part["content_type"], part["charset"])
+            message["body_type"] = part["content_type"]
+
+def decode_fetched(message, want_pdfs=True):
+    """Parse what a raw fetch kept undecoded, filling in "headers", "body" and "body_type"
+
+    Returns the PDFs of messages that were fetched whole, which only a full
+    parse can find.
+    """
+    message.setdefault("body", "")
+    if message.get("raw"):
+        message["headers"], message["body"], message["body_type"], pdfs = parse_message(message["raw"], want_pdfs)
+        return pdfs
+    message["headers"] = parse_headers(message.get("raw_headers") or b'')
+    part = message.get("raw_body")
+    if part:
+        message["body"] = part_text(decode_transfer_encoding(part["data"], part["encoding"]), part["content_type"], part["charset"])
+        message["body_type"] = part["content_type"]
+    return []
+
+def fetch_messages(mail, uids, filter_batch=None, want_pdfs=True, batch_size=HEADER_BATCH_SIZE, raw=False):
+    """Yield fetched messages batch by batch
+
+    `filter_batch` receives each batch of header summaries and returns the
+    ones worth downloading, so duplicates can be dropped with one query per
+    batch before any body is transferred. It needs parsed headers, so it
+    can't be combined with `raw`.
+    """
+    batch = []
+    for message in fetch_summaries(mail, uids, batch_size, raw):
+        batch.append(message)
+        if len(batch) >= batch_size:
+            yield from fetch_bodies(mail, filter_batch(batch) if filter_batch else batch, want_pdfs, raw=raw)
+            batch = []
+    if batch:
+        yield from fetch_bodies(mail, filter_batch(batch) if filter_batch else batch, want_pdfs, raw=raw)
@@ -0,0 +1,161 @@
+import imaplib
+import os
+import random
+import re
+import select
+import ssl
+import threading
+import time
+from imap_sync import enable_condstore
+
+# Push-mode watching with IMAP IDLE (RFC 2177): one long-lived connection
+# per folder sits in IDLE and runs the folder's incremental sync on that same
+# connection whenever the server reports EXISTS or EXPUNGE, so new mail is
+# picked up within seconds without reconnecting and logging in every tick.
+
+# Set IMAP_IDLE=0 to keep the services on scheduled polling
+USE_IDLE = os.getenv('IMAP_IDLE', '1') != '0'
+
+# Servers may drop IDLE after 30 minutes, so it is re-issued a bit earlier
+IDLE_TIMEOUT = 29 * 60
+MIN_BACKOFF = 1
+MAX_BACKOFF = 5 * 60
+
+EVENT_PATTERN = re.compile(rb'^\* \d+ (EXISTS|EXPUNGE|FETCH)', re.IGNORECASE)
+
+class IdleNotSupported(Exception):
+    """The server does not advertise the IDLE capability"""
+
+def open_connection(server, user, password):
+    """Connect, log in and enable CONDSTORE"""
+    mail = imaplib.IMAP4_SSL(server)
+    mail.login(user, password)
+    enable_condstore(mail)
+    return mail
+
+def line_waiting(mail):
+    """Whether data is already readable without blocking
+
+    imaplib reads through a buffered file, so a response that arrived in
+    the same packet as the previous line sits in that buffer (or, with TLS,
+    in the decrypted-but-unread bytes) where select() on the socket can't
+    see it. A non-blocking peek covers both.
+    """
+    timeout = mail.sock.gettimeout()
+    mail.sock.setblocking(False)
+    try:
+        return bool(mail.file.peek(1))
+    except (BlockingIOError, ssl.SSLWantReadError):
+        return False
+    finally:
+        mail.sock.settimeout(timeout)
+
+def idle(mail, timeout=IDLE_TIMEOUT):
+    """Wait in IDLE until the selected folder changes or `timeout` passes
+
+    Returns the untagged EXISTS/EXPUNGE/FETCH lines received (empty on
+    timeout). The connection is back in the normal selected state afterwards.
+    """
+    tag = mail._new_tag()
+    mail.send(tag + b' IDLE\r\n')
+    response = mail.readline()
+    if not response.startswith(b'+'):
+        raise mail.error(f"IDLE rejected: {response!r}")
+
+    events = []
+    deadline = time.monotonic() + timeout
+    while not events:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        if not line_waiting(mail):
+            readable, _, _ = select.select([mail.sock], [], [], remaining)
+            if not readable:
+                break
+        line = mail.readline()
+        if not line:
+            raise mail.abort("connection closed during IDLE")
+        if EVENT_PATTERN.match(line):
+            events.append(line.strip())
+
+    # Leave IDLE; anything else the server sends first is collected too
+    mail.send(b'DONE\r\n')
+    while True:
+        line = mail.readline()
+        if not line:
+            raise mail.abort("connection closed while leaving IDLE")
+        if line.startswith(tag):
+            break
+        if EVENT_PATTERN.match(line):
+            events.append(line.strip())
+    return events
+
+def _run_sync(folder, sync, mail):
+    # Connection problems go up to trigger a reconnect; anything else (a
+    # database hiccup, one bad message) must not stop the watcher
+    try:
+        sync(mail)
+    except (imaplib.IMAP4.abort, OSError):
+        raise
+    except Exception as e:
+        print(f"Error syncing {folder}: {e}")
+
+def watch_folder(folder, sync, server, user, password, idle_timeout=IDLE_TIMEOUT):
+    """Run `sync(mail)` for a folder now and whenever IDLE reports a change, forever
+
+    Dropped connections are re-opened with exponential backoff; each new
+    connection syncs first to catch up on anything missed while it was down.
+    Raises IdleNotSupported if the server has no IDLE, so callers can fall
+    back to polling.
+    """
+    backoff = MIN_BACKOFF
+    while True:
+        mail = None
+        try:
+            mail = open_connection(server, user, password)
+            if 'IDLE' not in mail.capabilities:
+                raise IdleNotSupported(server)
+            print(f"Watching {folder} with IMAP IDLE")
+
+            # sync() selects the folder, which IDLE needs
+            _run_sync(folder, sync, mail)
+            backoff = MIN_BACKOFF
+            while True:
+                events = idle(mail, idle_timeout)
+                if events:
+                    print(f"{folder} changed ({len(events)} events), syncing...")
+                    _run_sync(folder, sync, mail)
+        except IdleNotSupported:
+            raise
+        except (imaplib.IMAP4.abort, imaplib.IMAP4.error, OSError) as e:
+            delay = backoff + random.uniform(0, backoff / 2)
+            print(f"IDLE connection for {folder} lost ({e}), reconnecting in {delay:.0f}s")
+            time.sleep(delay)
+            backoff = min(backoff * 2, MAX_BACKOFF)
+        finally:
+            if mail is not None:
+                try:
+                    mail.logout()
+                except Exception:
+                    pass
+
+def watch_folders(syncs, server, user, password, fallback):
+    """Watch each folder in `syncs` ({folder: sync}) on its own IDLE connection
+
+    Blocks forever. If the server turns out not to support IDLE, `fallback`
+    (the service's polling loop) is run instead.
+    """
+    unsupported = threading.Event()
+
+    def watch(folder, sync):
+        try:
+            watch_folder(folder, sync, server, user, password)
+        except IdleNotSupported:
+            unsupported.set()
+
+    for folder, sync in syncs.items():
+        threading.Thread(target=watch, args=(folder, sync), name=f"idle-{folder}", daemon=True).start()
+
+    unsupported.wait()
+    print("Server does not support IMAP IDLE, falling back to polling")
+    fallback()
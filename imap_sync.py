@@ -0,0 +1,209 @@
+import re
+from datetime import datetime
+from pymongo import MongoClient, UpdateMany
+
+# MongoDB setup
+MONGO_URI = "mongodb://localhost:27017"
+client = MongoClient(MONGO_URI)
+db = client.email_dashboard
+sync_state_collection = db.imap_sync_state
+
+# Checkpoints are kept per (service, folder): UIDVALIDITY, the highest UID
+# stored and the folder's HIGHESTMODSEQ, so each poll only asks the server
+# for messages it has not seen yet. Stored emails carry imap_folder,
+# uidvalidity and uid, which (unlike sequence numbers) never change.
+# email_service and inbox_service each keep their own copy of an INBOX
+# message (their documents differ), so in the emails collection a UID is
+# only "already stored" among documents of the same `source`.
+
+FLAGS_PATTERN = re.compile(rb'UID (\d+)|FLAGS \(([^)]*)\)')
+# Polls a failing UID may hold the checkpoint back before it is skipped
+MAX_ATTEMPTS = 3
+
+def load_sync_state(service, folder):
+    """Return the stored checkpoint for a service's folder, or None"""
+    return sync_state_collection.find_one({"_id": f"{service}:{folder}"})
+
+def save_sync_state(service, folder, status, last_uid, failed_attempts=None, skipped_uids=()):
+    """Persist a folder checkpoint after messages up to last_uid are stored
+
+    `failed_attempts` ({uid: polls failed}) replaces the stored counts;
+    `skipped_uids` are added to the UIDs given up on.
+    """
+    update = {"$set": {
+        "service": service,
+        "folder": folder,
+        "uidvalidity": status["uidvalidity"],
+        "last_uid": last_uid,
+        "highestmodseq": status.get("highestmodseq"),
+        "failed_attempts": {str(uid): count for uid, count in (failed_attempts or {}).items()},
+        "updated_at": datetime.now()
+    }}
+    if skipped_uids:
+        update["$addToSet"] = {"skipped_uids": {"$each": sorted(skipped_uids)}}
+    sync_state_collection.update_one({"_id": f"{service}:{folder}"}, update, upsert=True)
+
+def _response_int(mail, code):
+    """Read a numeric untagged response code (e.g. UIDNEXT) left by the last command"""
+    _, data = mail.response(code)
+    if data and data[-1] is not None:
+        return int(data[-1])
+    return None
+
+def refresh_capabilities(mail):
+    """Re-read CAPABILITY; imaplib keeps the list the server sent before login"""
+    try:
+        typ, data = mail.capability()
+        if typ == 'OK' and data and data[-1]:
+            mail.capabilities = tuple(data[-1].decode().upper().split())
+    except Exception as e:
+        print(f"Could not refresh capabilities: {e}")
+    return mail.capabilities
+
+def enable_condstore(mail):
+    """Ask the server for CONDSTORE so SELECT reports HIGHESTMODSEQ
+
+    Called right after login, so it also refreshes mail.capabilities (Gmail
+    only lists CONDSTORE, ENABLE and IDLE once authenticated).
+    """
+    refresh_capabilities(mail)
+    if 'CONDSTORE' not in mail.capabilities or 'ENABLE' not in mail.capabilities:
+        return False
+    try:
+        mail.enable('CONDSTORE')
+        return True
+    except Exception as e:
+        print(f"CONDSTORE not enabled: {e}")
+        return False
+
+def select_folder(mail, folder):
+    """SELECT a folder and return its UIDVALIDITY, UIDNEXT, HIGHESTMODSEQ and message count"""
+    typ, data = mail.select(f'"{folder}"' if ' ' in folder else folder)
+    if typ != 'OK':
+        raise RuntimeError(f"Could not select {folder}: {data}")
+    return {
+        "exists": int(data[0]),
+        "uidvalidity": _response_int(mail, 'UIDVALIDITY'),
+        "uidnext": _response_int(mail, 'UIDNEXT'),
+        "highestmodseq": _response_int(mail, 'HIGHESTMODSEQ')
+    }
+
+def search_uids(mail, *criteria):
+    """Run UID SEARCH and return the matching UIDs as ints"""
+    typ, data = mail.uid('SEARCH', None, *criteria)
+    if typ != 'OK' or not data or not data[0]:
+        return []
+    return [int(uid) for uid in data[0].split()]
+
+def find_new_uids(mail, service, folder, since=None):
+    """Select a folder and return (new UIDs, folder status, checkpoint)
+
+    With a valid checkpoint this only looks above the last stored UID, and
+    skips the search entirely when UIDNEXT shows nothing arrived. Without one
+    (first run, or UIDVALIDITY changed) it falls back to SINCE `since`,
+    defaulting to today.
+    """
+    state = load_sync_state(service, folder)
+    status = select_folder(mail, folder)
+
+    if state and state.get("uidvalidity") == status["uidvalidity"]:
+        last_uid = state.get("last_uid", 0)
+        if status["uidnext"] is not None and status["uidnext"] <= last_uid + 1:
+            return [], status, state
+        # `n:*` always matches the newest message, even when its UID is below n
+        uids = [uid for uid in search_uids(mail, 'UID', f'{last_uid + 1}:*') if uid > last_uid]
+        return uids, status, state
+
+    if state:
+        print(f"UIDVALIDITY changed for {folder}, resyncing")
+    since = since or datetime.now()
+    return search_uids(mail, f'(SINCE "{since.strftime("%d-%b-%Y")}")'), status, None
+
+def checkpoint(service, folder, status, state, uids, failed_uids=()):
+    """Advance the folder checkpoint past every new UID stored so far
+
+    The checkpoint stops just below the first UID that failed, so it is
+    retried on the next poll. A UID that fails MAX_ATTEMPTS polls in a row
+    is recorded in skipped_uids and no longer holds the checkpoint back.
+    Nothing is written when nothing changed.
+    """
+    previous_attempts = (state or {}).get("failed_attempts") or {}
+    attempts = {uid: previous_attempts.get(str(uid), 0) + 1 for uid in failed_uids}
+    given_up = {uid for uid, count in attempts.items() if count >= MAX_ATTEMPTS}
+
+    if state:
+        last_uid = state.get("last_uid", 0)
+    elif not uids and status.get("uidnext"):
+        # Nothing matched the first-run window, so start from the current end
+        last_uid = status["uidnext"] - 1
+    else:
+        last_uid = 0
+    for uid in sorted(uids):
+        if uid in failed_uids and uid not in given_up:
+            break
+        last_uid = uid
+
+    skipped = {uid for uid in given_up if uid <= last_uid}
+    for uid in sorted(skipped):
+        print(f"Skipping UID {uid} in {folder} after {attempts[uid]} failed attempts")
+    attempts = {uid: count for uid, count in attempts.items() if uid > last_uid}
+
+    if (state and state.get("last_uid") == last_uid and state.get("highestmodseq") == status.get("highestmodseq")
+            and not attempts and not previous_attempts):
+        return last_uid
+    save_sync_state(service, folder, status, last_uid, attempts, skipped)
+    return last_uid
+
+def existing_uids(collection, folder, uidvalidity, uids, source=None):
+    """One query for the UIDs in this batch that are already stored (by `source`)"""
+    if not uids:
+        return set()
+    query = {"imap_folder": folder, "uidvalidity": uidvalidity, "uid": {"$in": uids}}
+    if source:
+        query = {"source": source, **query}
+    return {
+        doc["uid"] for doc in collection.find(
+            query,
+            {"uid": 1, "_id": 0}
+        )
+    }
+
+def sync_flag_changes(mail, collection, folder, status, state):
+    """Mirror \\Seen / \\Flagged changes since the checkpoint's MODSEQ onto stored emails"""
+    if not state or not state.get("highestmodseq") or not status.get("highestmodseq"):
+        return 0
+    if status["highestmodseq"] <= state["highestmodseq"] or not state.get("last_uid"):
+        return 0
+
+    typ, data = mail.uid(
+        'FETCH', f'1:{state["last_uid"]}', f'(FLAGS) (CHANGEDSINCE {state["highestmodseq"]})'
+    )
+    if typ != 'OK':
+        return 0
+
+    by_flags = {}
+    for item in data:
+        line = item[0] if isinstance(item, tuple) else item
+        if not line:
+            continue
+        uid, flags = None, None
+        for uid_match, flags_match in FLAGS_PATTERN.findall(line):
+            if uid_match:
+                uid = int(uid_match)
+            else:
+                flags = flags_match.split()
+        if uid is None or flags is None:
+            continue
+        key = (b'\\Seen' in flags, b'\\Flagged' in flags)
+        by_flags.setdefault(key, []).append(uid)
+
+    if not by_flags:
+        return 0
+    collection.bulk_write([
+        UpdateMany(
+            {"imap_folder": folder, "uidvalidity": status["uidvalidity"], "uid": {"$in": uids}},
+            {"$set": {"isRead": is_read, "isStarred": is_starred}}
+        )
+        for (is_read, is_starred), uids in by_flags.items()
+    ], ordered=False)
+    return sum(len(uids) for uids in by_flags.values())
@@ -2,12 +2,20 @@ import schedule
 import time
 import imaplib
 import email
-from email.header import decode_header
-from datetime import datetime, timedelta
+from datetime import datetime
 import os
 from pymongo import MongoClient
+from pymongo.errors import DuplicateKeyError
 from dotenv import load_dotenv
-import base64
+from attachment_store import store_attachment, email_ref
+from imap_sync import enable_condstore, find_new_uids, sync_flag_changes, existing_uids, checkpoint
+from imap_fetch import fetch_messages
+from mime_parser import header_text
+from imap_idle import USE_IDLE, watch_folders
+from search_index import index_new_emails
+from embedding_index import embed_new_emails
+from mailbox_stats import record_inserted
+from db_indexes import ensure_indexes
 
 # Load environment variables
 load_dotenv()
@@ -17,147 +25,139 @@ MONGO_URI = "mongodb://localhost:27017"
 client = MongoClient(MONGO_URI)
 db = client.email_dashboard
 emails_collection = db.emails
-attachments_collection = db.pdf_attachments
 
 # Email credentials
 EMAIL = os.getenv('GMAIL_EMAIL')
 PASSWORD = os.getenv('GMAIL_APP_PASSWORD')
 IMAP_SERVER = "imap.gmail.com"
 
-def decode_email_body(email_message):
-    """Extract full email body with better error handling"""
-    body = ""
-    if email_message.is_multipart():
-        for part in email_message.walk():
-            if part.get_content_type() == "text/plain":
-                try:
-                    payload = part.get_payload(decode=True)
-                    if payload:
-                        body = payload.decode('utf-8', errors='replace')
-                        break
-                except Exception as e:
-                    print(f"Error decoding part: {e}")
-                    continue
-    else:
-        try:
-            payload = email_message.get_payload(decode=True)
-            if payload:
-                body = payload.decode('utf-8', errors='replace')
-        except Exception as e:
-            print(f"Error decoding body: {e}")
-            body = "Could not decode email body"
-    
-    return body or "No readable content"
+# Name under which this service's folder checkpoints are stored
+SYNC_SERVICE = "inbox_service"
+FOLDERS = ['INBOX', '[Gmail]/Spam']
 
-def check_new_emails():
+def sync_folder(mail, folder):
+    """Store messages that arrived in one folder since its checkpoint"""
     try:
-        print("\nChecking for new emails...")
-        mail = imaplib.IMAP4_SSL(IMAP_SERVER)
-        mail.login(EMAIL, PASSWORD)
+        print(f"\nChecking folder: {folder}")
         
-        # Check both inbox and spam folder
-        for folder in ['INBOX', '[Gmail]/Spam']:
+        # Only UIDs above this folder's checkpoint are new
+        uids, status, state = find_new_uids(mail, SYNC_SERVICE, folder)
+        changed = sync_flag_changes(mail, emails_collection, folder, status, state)
+        if changed:
+            print(f"Updated flags on {changed} emails in {folder}")
+        
+        if not uids:
+            print(f"No new emails in {folder}")
+            checkpoint(SYNC_SERVICE, folder, status, state, uids)
+            return
+        
+        print(f"Found {len(uids)} new emails in {folder}")
+
+        # One query for the whole batch instead of one per message
+        already_stored = existing_uids(emails_collection, folder, status["uidvalidity"], uids, SYNC_SERVICE)
+        new_uids = [uid for uid in uids if uid not in already_stored]
+        stored_uids = set()
+
+        # Headers and structure come in one batched FETCH; only the
+        # text part and PDFs are downloaded afterwards
+        for message in fetch_messages(mail, new_uids):
+            uid = message["uid"]
             try:
-                print(f"\nChecking folder: {folder}")
-                mail.select(folder)
-                
-                # Search for recent emails (last 5 minutes)
-                five_mins_ago = (datetime.now() - timedelta(minutes=5)).strftime("%d-%b-%Y")
-                search_criteria = f'(SINCE "{five_mins_ago}")'
-                _, message_numbers = mail.search(None, search_criteria)
-                email_ids = message_numbers[0].split()
-                
-                if not email_ids:
-                    print(f"No new emails in {folder}")
-                    continue
-                
-                print(f"Found {len(email_ids)} new emails in {folder}")
+                headers = message["headers"]
 
-                for num in email_ids:
-                    try:
-                        # Check if email already exists
-                        if emails_collection.find_one({"email_id": int(num)}):
-                            print("Email already exists, skipping...")
-                            continue
-
-                        # Fetch email data
-                        _, msg_data = mail.fetch(num, "(RFC822)")
-                        email_body = msg_data[0][1]
-                        email_message = email.message_from_bytes(email_body)
-
-                        # Get subject
-                        subject = decode_header(email_message["subject"] or "No Subject")[0][0]
-                        if isinstance(subject, bytes):
-                            subject = subject.decode()
-
-                        # Get sender
-                        sender = email.utils.parseaddr(email_message["from"])[1]
-
-                        # Get date
-                        date = email_message["date"]
-
-                        # Get body
-                        body = decode_email_body(email_message)
-                        
-                        # Process attachments
-                        pdf_attachments = []
-                        if email_message.is_multipart():
-                            for part in email_message.walk():
-                                if part.get_content_type() == "application/pdf":
-                                    try:
-                                        filename = part.get_filename()
-                                        if filename:
-                                            print(f"Processing PDF: {filename}")
-                                            pdf_content = base64.b64encode(part.get_payload(decode=True)).decode()
-                                            attachment_doc = {
-                                                "filename": filename,
-                                                "content": pdf_content,
-                                                "email_id": num.decode(),
-                                                "upload_date": datetime.now()
-                                            }
-                                            attachment_id = attachments_collection.insert_one(attachment_doc).inserted_id
-                                            pdf_attachments.append({
-                                                "filename": filename,
-                                                "id": str(attachment_id)
-                                            })
-                                    except Exception as e:
-                                        print(f"Error processing PDF: {e}")
-
-                        # Store in MongoDB
-                        email_doc = {
-                            "email_id": int(num),
-                            "subject": subject,
-                            "sender": sender,
-                            "date": date,
-                            "body": body,
-                            "category": "spam" if folder == '[Gmail]/Spam' else "primary",
-                            "has_attachments": len(pdf_attachments) > 0,
-                            "pdf_attachments": pdf_attachments,
-                            "processed_at": datetime.now(),
-                            "isRead": False,
-                            "isStarred": False,
-                            "folder": "spam" if folder == '[Gmail]/Spam' else "inbox"
-                        }
-
-                        result = emails_collection.insert_one(email_doc)
-                        print(f"Stored new email successfully (ID: {result.inserted_id})")
+                # Get subject
+                subject = header_text(headers, "subject", "No Subject")
 
-                    except Exception as e:
-                        print(f"Error processing email: {e}")
-                        continue
+                # Get sender
+                sender = email.utils.parseaddr(header_text(headers, "from"))[1]
+
+                # Get date
+                date = header_text(headers, "date", None)
 
+                # Get body
+                body = message["body"] or "No readable content"
+                
+                # Process attachments
+                pdf_attachments = []
+                for filename, pdf_data in message["pdfs"]:
+                    try:
+                        print(f"Processing PDF: {filename}")
+                        attachment_id = store_attachment(
+                            pdf_data,
+                            filename,
+                            email_ref(uid, folder, status["uidvalidity"])
+                        )
+                        pdf_attachments.append({
+                            "filename": filename,
+                            "id": str(attachment_id)
+                        })
+                    except Exception as e:
+                        print(f"Error processing PDF: {e}")
+
+                # Store in MongoDB
+                email_doc = {
+                    "email_id": uid,
+                    "source": SYNC_SERVICE,
+                    "uid": uid,
+                    "uidvalidity": status["uidvalidity"],
+                    "imap_folder": folder,
+                    "subject": subject,
+                    "sender": sender,
+                    "date": date,
+                    "body": body,
+                    "category": "spam" if folder == '[Gmail]/Spam' else "primary",
+                    "has_attachments": len(pdf_attachments) > 0,
+                    "pdf_attachments": pdf_attachments,
+                    "processed_at": datetime.now(),
+                    "isRead": False,
+                    "isStarred": False,
+                    "folder": "spam" if folder == '[Gmail]/Spam' else "inbox"
+                }
+
+                result = emails_collection.insert_one(email_doc)
+                stored_uids.add(uid)
+                record_inserted([email_doc])
+                print(f"Stored new email successfully (ID: {result.inserted_id})")
+
+            except DuplicateKeyError:
+                # Stored meanwhile by another connection (the unique UID index)
+                stored_uids.add(uid)
             except Exception as e:
-                print(f"Error checking folder {folder}: {e}")
+                print(f"Error processing email: {e}")
                 continue
 
+        # Anything not stored (including messages missing from the
+        # FETCH responses) holds the checkpoint back
+        failed_uids = set(new_uids) - stored_uids
+        checkpoint(SYNC_SERVICE, folder, status, state, uids, failed_uids)
+        index_new_emails()
+        embed_new_emails()
+
+    except (imaplib.IMAP4.abort, OSError):
+        # Lost connection; let the caller reconnect
+        raise
+    except Exception as e:
+        print(f"Error checking folder {folder}: {e}")
+
+def check_new_emails():
+    try:
+        print("\nChecking for new emails...")
+        mail = imaplib.IMAP4_SSL(IMAP_SERVER)
+        mail.login(EMAIL, PASSWORD)
+        
+        enable_condstore(mail)
+        
+        # Check both inbox and spam folder
+        for folder in FOLDERS:
+            sync_folder(mail, folder)
+
         mail.logout()
         print("Email check completed")
 
     except Exception as e:
         print(f"Error checking emails: {e}")
 
-def run_inbox_service():
-    print("Starting inbox service...")
+def poll_new_emails():
     print("Will check for new emails every 5 minutes")
     
     # Run initial check
@@ -170,5 +170,19 @@ def run_inbox_service():
         schedule.run_pending()
         time.sleep(1)
 
+def run_inbox_service():
+    print("Starting inbox service...")
+    ensure_indexes()
+    if not USE_IDLE:
+        poll_new_emails()
+        return
+
+    # One IDLE connection per folder; each syncs as soon as its folder changes
+    watch_folders(
+        {folder: lambda mail, folder=folder: sync_folder(mail, folder) for folder in FOLDERS},
+        IMAP_SERVER, EMAIL, PASSWORD,
+        fallback=poll_new_emails
+    )
+
 if __name__ == "__main__":
-    run_inbox_service() 
\ No newline at end of file
+    run_inbox_service()
\ No newline at end of file
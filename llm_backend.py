@@ -0,0 +1,33 @@
+import os
+from openai import OpenAI, AsyncOpenAI
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Where LLM requests go. Any OpenAI-compatible endpoint works, e.g. the local
+# stand-in from llm_stub_server.py for offline load tests:
+#   LLM_BASE_URL=http://localhost:8001/v1 python fix_summaries.py
+LLM_BASE_URL = os.getenv('LLM_BASE_URL', "https://openrouter.ai/api/v1")
+LLM_API_KEY = os.getenv('LLM_API_KEY', os.getenv('OPENROUTER_API_KEY'))
+SUMMARY_MODEL = os.getenv('LLM_SUMMARY_MODEL', "google/gemini-flash-1.5-8b")
+CHAT_MODEL = os.getenv('LLM_CHAT_MODEL', "google/gemini-pro")
+
+def client_options(title):
+    return {
+        "base_url": LLM_BASE_URL,
+        # Local stand-ins accept any key
+        "api_key": LLM_API_KEY or "local",
+        "default_headers": {
+            "HTTP-Referer": "http://localhost:3000",  # Required for OpenRouter
+            "X-Title": title  # Optional - your app's name
+        }
+    }
+
+def create_client(title, **kwargs):
+    """OpenAI client for the configured backend"""
+    return OpenAI(**client_options(title), **kwargs)
+
+def create_async_client(title, **kwargs):
+    """AsyncOpenAI client for the configured backend"""
+    return AsyncOpenAI(**client_options(title), **kwargs)
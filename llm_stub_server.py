@@ -0,0 +1,236 @@
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from collections import Counter, deque
+import requests
+from flask import Flask, Response, jsonify, request
+
+# OpenAI-compatible stand-in for the LLM provider, for load tests and
+# benchmarks with no network. Point the services at it with
+#   LLM_BASE_URL=http://localhost:8001/v1
+# It answers chat completions after a configurable latency, fails a
+# configurable fraction of requests with 5xx errors and enforces
+# requests/tokens-per-minute limits with 429s, like a real provider.
+#
+# Cassettes: in record mode each request is forwarded upstream and the
+# response saved (keyed on model, messages and max_tokens); in replay mode
+# recorded responses are served and anything else gets a synthetic answer.
+# Requests with stream=True get the same answers as chunk events, a word
+# every token_delay seconds; streams the client abandons are counted.
+
+DEFAULT_PORT = 8001
+UPSTREAM_URL = "https://openrouter.ai/api/v1"
+BATCH_COUNT = re.compile(r"following (\d+) emails")
+SUBJECT_LINE = re.compile(r"^\s*Subject: (.*)$", re.MULTILINE)
+
+app = Flask(__name__)
+config = {
+    "latency": 0.5,
+    "jitter": 0.2,
+    "token_delay": 0.02,
+    "error_rate": 0.0,
+    "rpm": 0,
+    "tpm": 0,
+    "mode": "off",
+    "cassette": None,
+    "upstream": UPSTREAM_URL
+}
+cassette = {}
+stats = Counter()
+lock = threading.Lock()
+# (time, tokens) of the requests admitted in the last minute
+window = deque()
+
+def count(event):
+    with lock:
+        stats[event] += 1
+
+def estimate_tokens(text):
+    return len(text) // 4
+
+def request_key(body):
+    """Cassette key: the parts of a request that decide its response"""
+    canonical = json.dumps(
+        [body.get("model"), body.get("messages"), body.get("max_tokens")],
+        sort_keys=True, ensure_ascii=False
+    )
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+def load_cassette(path):
+    try:
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    cassette[entry["key"]] = entry["response"]
+    except FileNotFoundError:
+        pass
+    print(f"Loaded {len(cassette)} recorded responses from {path}")
+
+def record(key, body, response):
+    with lock:
+        cassette[key] = response
+        with open(config["cassette"], 'a', encoding='utf-8') as f:
+            f.write(json.dumps({"key": key, "request": body, "response": response}, ensure_ascii=False) + '\n')
+
+def admit(tokens):
+    """Seconds until the request fits the per-minute limits, or 0 if admitted"""
+    with lock:
+        now = time.monotonic()
+        while window and window[0][0] <= now - 60:
+            window.popleft()
+        over_requests = config["rpm"] and len(window) + 1 > config["rpm"]
+        over_tokens = config["tpm"] and sum(used for _, used in window) + tokens > config["tpm"]
+        if window and (over_requests or over_tokens):
+            return max(window[0][0] + 60 - now, 0.1)
+        window.append((now, tokens))
+        return 0
+
+def error_response(status, message, error_type, headers=None):
+    return jsonify({"error": {"message": message, "type": error_type, "code": status}}), status, headers or {}
+
+def synthetic_answer(prompt):
+    """A plausible reply: one summary per email for summary prompts, an echo otherwise"""
+    subjects = SUBJECT_LINE.findall(prompt)
+    batch = BATCH_COUNT.search(prompt)
+    if batch:
+        email_count = int(batch.group(1))
+        subjects = (subjects + [""] * email_count)[:email_count]
+        return json.dumps([f"Stub summary of an email about {subject.strip() or 'nothing'}." for subject in subjects])
+    if subjects:
+        return f"Stub summary of an email about {subjects[0].strip() or 'nothing'}."
+    return f"Stub answer to: {' '.join(prompt.split()[:20])}"
+
+def completion_response(body, content):
+    prompt = ' '.join(message.get("content") or '' for message in body.get("messages", []))
+    prompt_tokens, completion_tokens = estimate_tokens(prompt), estimate_tokens(content)
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "stub"),
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": content},
+            "finish_reason": "stop"
+        }],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens
+        }
+    }
+
+def forward_upstream(body):
+    response = requests.post(
+        f"{config['upstream'].rstrip('/')}/chat/completions",
+        # Recorded whole; streamed back locally if the client asked for a stream
+        json={**body, "stream": False},
+        headers={"Authorization": request.headers.get("Authorization", "")},
+        timeout=120
+    )
+    response.raise_for_status()
+    return response.json()
+
+@app.route('/v1/chat/completions', methods=['POST'])
+@app.route('/chat/completions', methods=['POST'])
+def chat_completions():
+    body = request.get_json(force=True)
+    count("requests")
+    prompt = ' '.join(message.get("content") or '' for message in body.get("messages", []))
+
+    wait = admit(estimate_tokens(prompt) + (body.get("max_tokens") or 0))
+    if wait:
+        count("rate_limited")
+        return error_response(429, "Rate limit exceeded", "rate_limit_exceeded", {"Retry-After": f"{wait:.1f}"})
+
+    time.sleep(max(0, config["latency"] + random.uniform(-config["jitter"], config["jitter"])))
+    if random.random() < config["error_rate"]:
+        count("errors")
+        return error_response(random.choice([500, 502, 503]), "Injected server error", "server_error")
+
+    key = request_key(body)
+    if config["mode"] == "record":
+        try:
+            response = forward_upstream(body)
+        except Exception as e:
+            count("upstream_errors")
+            return error_response(502, f"Upstream error: {e}", "server_error")
+        record(key, body, response)
+        count("recorded")
+    elif config["mode"] == "replay" and key in cassette:
+        count("replayed")
+        response = cassette[key]
+    else:
+        count("synthetic")
+        response = completion_response(body, synthetic_answer(prompt))
+
+    if body.get("stream"):
+        return stream_response(response)
+    return jsonify(response)
+
+def stream_response(response):
+    """A completion as chat.completion.chunk events, one word at a time"""
+    content = response["choices"][0]["message"].get("content") or ''
+    base = {
+        "id": response.get("id"),
+        "object": "chat.completion.chunk",
+        "created": response.get("created"),
+        "model": response.get("model")
+    }
+
+    def chunk(delta, finish_reason=None):
+        return f"data: {json.dumps({**base, 'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish_reason}]})}\n\n"
+
+    def generate():
+        try:
+            yield chunk({"role": "assistant", "content": ""})
+            for piece in re.findall(r"\s*\S+|\s+$", content):
+                time.sleep(config["token_delay"])
+                yield chunk({"content": piece})
+            yield chunk({}, "stop")
+            yield "data: [DONE]\n\n"
+            count("streams_completed")
+        except GeneratorExit:
+            count("streams_cancelled")
+            raise
+
+    return Response(generate(), mimetype='text/event-stream')
+
+@app.route('/stats')
+def get_stats():
+    return jsonify({**stats, "config": config, "recorded_responses": len(cassette)})
+
+@app.route('/stats/reset', methods=['POST'])
+def reset_stats():
+    with lock:
+        stats.clear()
+    return jsonify({"status": "reset"})
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="OpenAI-compatible stand-in LLM server")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--latency", type=float, default=config["latency"], help="mean seconds per response")
+    parser.add_argument("--jitter", type=float, default=config["jitter"], help="latency varies by up to this many seconds")
+    parser.add_argument("--token-delay", type=float, default=config["token_delay"], help="seconds between streamed words")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests failed with a 5xx")
+    parser.add_argument("--rpm", type=int, default=0, help="requests per minute before 429s (0: unlimited)")
+    parser.add_argument("--tpm", type=int, default=0, help="estimated tokens per minute before 429s (0: unlimited)")
+    parser.add_argument("--mode", choices=["off", "record", "replay"], default="off", help="cassette mode")
+    parser.add_argument("--cassette", default="llm_cassette.jsonl", help="JSON lines file of recorded responses")
+    parser.add_argument("--upstream", default=UPSTREAM_URL, help="provider to record from")
+    args = parser.parse_args()
+
+    config.update(
+        latency=args.latency, jitter=args.jitter, token_delay=args.token_delay, error_rate=args.error_rate,
+        rpm=args.rpm, tpm=args.tpm, mode=args.mode, cassette=args.cassette, upstream=args.upstream
+    )
+    if args.mode != "off":
+        load_cassette(args.cassette)
+    print(f"Stub LLM server on http://localhost:{args.port}/v1 ({args.mode} mode)")
+    app.run(port=args.port, threaded=True)
@@ -0,0 +1,166 @@
+import os
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from urllib.parse import unquote
+from pymongo import MongoClient, ReturnDocument
+
+# MongoDB setup
+MONGO_URI = "mongodb://localhost:27017"
+client = MongoClient(MONGO_URI)
+db = client.email_dashboard
+emails_collection = db.emails
+mailbox_stats_collection = db.mailbox_stats
+
+# Materialized dashboard statistics: one document with the inbox total,
+# the count per category and the most recent emails, so the dashboard reads
+# a single document however large the mailbox grows. Ingestion and
+# recategorization update it as they write; reconcile() recomputes it from
+# the emails, correcting drift from writers that bypass the hooks
+# (maintenance scripts, manual edits). "version" changes whenever the
+# statistics do and serves as the dashboard's ETag.
+
+STATS_ID = "inbox"
+RECENT_EMAILS = 5
+RECENT_FIELDS = ("subject", "sender", "date", "category")
+RECONCILE_INTERVAL = int(os.getenv('MAILBOX_STATS_RECONCILE_INTERVAL', 600))
+# The emails the dashboard counts: the inbox, without spam
+INBOX_QUERY = {"folder": "inbox", "category": {"$ne": "spam"}}
+
+def counted(email):
+    return email.get("folder") == "inbox" and email.get("category") != "spam"
+
+def category_key(category):
+    """A category as a field name, which can't contain '.' or start with '$'
+
+    Those characters (and '%') are percent-encoded, so category_name()
+    gives back the exact category.
+    """
+    key = str(category).replace('%', '%25').replace('.', '%2E')
+    return '%24' + key[1:] if key.startswith('$') else key
+
+def category_name(key):
+    return unquote(key)
+
+def category_field(category):
+    return "categories." + category_key(category)
+
+def category_distribution(stats):
+    """{category: count} of a stats document, without emptied categories"""
+    return {category_name(key): count for key, count in stats["categories"].items() if count > 0}
+
+def recent_entry(email):
+    return {"_id": email["_id"], **{field: email.get(field) for field in RECENT_FIELDS}}
+
+def recent_emails():
+    return [recent_entry(email) for email in emails_collection.find(
+        INBOX_QUERY, {field: 1 for field in RECENT_FIELDS}
+    ).sort("date", -1).limit(RECENT_EMAILS)]
+
+def reconcile():
+    """Recompute the statistics from the emails; returns the stats document"""
+    categories = Counter()
+    for item in emails_collection.aggregate([
+        {"$match": INBOX_QUERY},
+        {"$group": {"_id": "$category", "count": {"$sum": 1}}}
+    ]):
+        categories[category_key(item["_id"])] += item["count"]
+    stats = {
+        "total_emails": sum(categories.values()),
+        "categories": dict(categories),
+        "recent_emails": recent_emails()
+    }
+
+    previous = mailbox_stats_collection.find_one({"_id": STATS_ID}) or {}
+    # Categories counted down to zero are equivalent to absent ones
+    previous["categories"] = {
+        category: count for category, count in previous.get("categories", {}).items() if count
+    }
+    update = {"$set": {**stats, "reconciled_at": datetime.now()}}
+    if any(previous.get(field) != value for field, value in stats.items()):
+        if "_id" in previous:
+            print(f"Reconciled mailbox stats: {previous.get('total_emails')} -> {stats['total_emails']} emails")
+        update["$set"]["updated_at"] = datetime.now()
+        update["$inc"] = {"version": 1}
+    return mailbox_stats_collection.find_one_and_update(
+        {"_id": STATS_ID}, update, upsert=True, return_document=ReturnDocument.AFTER
+    )
+
+def _apply(update):
+    """Apply an incremental update, or reconcile if there are no stats yet"""
+    update.setdefault("$inc", {})["version"] = 1
+    update.setdefault("$set", {})["updated_at"] = datetime.now()
+    result = mailbox_stats_collection.update_one({"_id": STATS_ID}, update)
+    if not result.matched_count:
+        reconcile()
+
+def record_inserted(emails):
+    """Count newly stored emails"""
+    emails = [email for email in emails if counted(email)]
+    if not emails:
+        return
+    increments = Counter(category_field(email.get("category")) for email in emails)
+    _apply({
+        "$inc": {"total_emails": len(emails), **increments},
+        "$push": {"recent_emails": {
+            "$each": [recent_entry(email) for email in emails],
+            "$sort": {"date": -1},
+            "$slice": RECENT_EMAILS
+        }}
+    })
+
+def record_recategorized(changes):
+    """Move recategorized emails, [(_id, old category, new category)], between counts"""
+    changes = [change for change in changes if change[1] != change[2]]
+    if not changes:
+        return
+    inbox_ids = {email["_id"] for email in emails_collection.find(
+        {"_id": {"$in": [email_id for email_id, _, _ in changes]}, "folder": "inbox"}, {"_id": 1}
+    )}
+    if not inbox_ids:
+        return
+
+    increments = Counter()
+    for email_id, old, new in changes:
+        if email_id not in inbox_ids:
+            continue
+        if old == "spam":
+            increments["total_emails"] += 1
+        else:
+            increments[category_field(old)] -= 1
+        if new == "spam":
+            increments["total_emails"] -= 1
+        else:
+            increments[category_field(new)] += 1
+    update = {"$inc": dict(increments)}
+
+    # The recent list is re-read when one of its emails changed category
+    # or an email came back from spam
+    stats = mailbox_stats_collection.find_one({"_id": STATS_ID}, {"recent_emails._id": 1}) or {}
+    recent_ids = {email["_id"] for email in stats.get("recent_emails", [])}
+    if inbox_ids & recent_ids or any(old == "spam" for _, old, _ in changes):
+        update["$set"] = {"recent_emails": recent_emails()}
+    _apply(update)
+
+def get_stats():
+    """The dashboard statistics document, computing it the first time"""
+    return mailbox_stats_collection.find_one({"_id": STATS_ID}) or reconcile()
+
+def start_reconciler(interval=RECONCILE_INTERVAL):
+    """Reconcile every `interval` seconds in a daemon thread"""
+    def run():
+        while True:
+            time.sleep(interval)
+            try:
+                reconcile()
+            except Exception as e:
+                print(f"Error reconciling mailbox stats: {e}")
+
+    thread = threading.Thread(target=run, name="mailbox-stats-reconciler", daemon=True)
+    thread.start()
+    return thread
+
+if __name__ == "__main__":
+    stats = reconcile()
+    print(f"Mailbox stats: {stats['total_emails']} emails in {len(stats['categories'])} categories (version {stats.get('version')})")
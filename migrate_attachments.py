@@ -0,0 +1,83 @@
+import base64
+from pymongo import MongoClient
+from pymongo.errors import DuplicateKeyError
+from attachment_store import put_blob, repoint_operation, email_collections
+
+# MongoDB setup
+MONGO_URI = "mongodb://localhost:27017"
+client = MongoClient(MONGO_URI)
+db = client.email_dashboard
+attachments_collection = db.pdf_attachments
+
+def migrate_attachment(attachment_id):
+    """Move one document's inline base64 content into the blob store
+
+    If the same content is already stored under another document, the legacy
+    document is merged into it and its emails are pointed at the survivor.
+    """
+    attachment = attachments_collection.find_one({"_id": attachment_id}, {"content": 1, "email_id": 1})
+    if not attachment or "content" not in attachment:
+        return False
+
+    data = base64.b64decode(attachment["content"])
+    digest = put_blob(data)
+    refs = [attachment["email_id"]] if attachment.get("email_id") is not None else []
+    try:
+        attachments_collection.update_one(
+            {"_id": attachment_id},
+            {
+                "$set": {"sha256": digest, "size": len(data), "email_refs": refs, "ref_count": len(refs)},
+                "$unset": {"content": ""}
+            }
+        )
+    except DuplicateKeyError:
+        existing = attachments_collection.find_one({"sha256": digest}, {"email_refs": 1})
+        new_refs = [ref for ref in refs if ref not in (existing.get("email_refs") or [])]
+        attachments_collection.update_one(
+            {"_id": existing["_id"]},
+            {"$push": {"email_refs": {"$each": new_refs}}, "$inc": {"ref_count": len(new_refs)}}
+        )
+        for collection in email_collections:
+            collection.bulk_write([repoint_operation([attachment_id], existing["_id"])])
+        attachments_collection.delete_one({"_id": attachment_id})
+    return True
+
+def migrate_attachments():
+    """Move inline base64 attachment content into the content-addressed blob store"""
+    try:
+        print("\nStarting attachment migration...")
+
+        legacy_query = {"content": {"$exists": True}}
+        total = attachments_collection.count_documents(legacy_query)
+        print(f"Found {total} attachments stored inline")
+
+        # Only ids are listed up front; each document is loaded on its own so
+        # a handful of large PDFs never sit in memory together
+        legacy_ids = [doc["_id"] for doc in attachments_collection.find(legacy_query, {"_id": 1})]
+
+        migrated_count = 0
+        error_count = 0
+        for i, attachment_id in enumerate(legacy_ids, 1):
+            try:
+                if migrate_attachment(attachment_id):
+                    migrated_count += 1
+            except Exception as e:
+                error_count += 1
+                print(f"Error migrating attachment {attachment_id}: {e}")
+                continue
+
+            if i % 100 == 0:
+                print(f"Processed {i}/{total} attachments")
+
+        print("\nMigration Summary:")
+        print(f"Attachments migrated: {migrated_count}")
+        print(f"Unique blobs stored: {db.attachment_blobs.files.count_documents({})}")
+        print(f"Errors encountered: {error_count}")
+
+    except Exception as e:
+        print(f"Error during migration: {e}")
+    finally:
+        client.close()
+
+if __name__ == "__main__":
+    migrate_attachments()
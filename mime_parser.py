@@ -0,0 +1,123 @@
+import base64
+import quopri
+import re
+from email import policy
+from email.parser import BytesParser
+from html import unescape
+from html.parser import HTMLParser
+
+# MIME decoding shared by every ingestion path. Headers are parsed with the
+# email.policy.default BytesParser, so values come back as str with RFC 2047
+# encoded words and their charsets already decoded. Bodies are decoded with
+# their declared charset, and HTML-only messages are reduced to plain text.
+
+BLOCK_TAGS = {'br', 'p', 'div', 'tr', 'li', 'table', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'blockquote', 'hr'}
+SKIP_TAGS = {'script', 'style', 'head', 'title'}
+BLANK_LINES = re.compile(r'\n\s*\n\s*\n+')
+SPACES = re.compile(r'[ \t\r\f\v\xa0]+')
+
+def parse_headers(data):
+    """Parse raw header bytes into an EmailMessage (no body)"""
+    return BytesParser(policy=policy.default).parsebytes(data, headersonly=True)
+
+def header_text(headers, name, default=""):
+    """A header's decoded value as str, or default when missing or unparseable"""
+    try:
+        value = headers.get(name)
+    except Exception:
+        return default
+    return str(value) if value else default
+
+def decode_transfer_encoding(data, encoding):
+    """Undo a Content-Transfer-Encoding (base64, quoted-printable or identity)"""
+    encoding = (encoding or '7bit').lower()
+    if encoding == 'base64':
+        return base64.b64decode(data)
+    if encoding == 'quoted-printable':
+        return quopri.decodestring(data)
+    return data
+
+def decode_charset(data, charset):
+    """Decode bytes with the declared charset, falling back to UTF-8"""
+    try:
+        return data.decode(charset or 'utf-8', errors='replace')
+    except LookupError:
+        return data.decode('utf-8', errors='replace')
+
+class _TextExtractor(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.chunks = []
+        self.skipping = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in SKIP_TAGS:
+            self.skipping += 1
+        elif tag in BLOCK_TAGS:
+            self.chunks.append('\n')
+
+    def handle_endtag(self, tag):
+        if tag in SKIP_TAGS:
+            self.skipping = max(self.skipping - 1, 0)
+        elif tag in BLOCK_TAGS:
+            self.chunks.append('\n')
+
+    def handle_data(self, data):
+        if not self.skipping:
+            self.chunks.append(data)
+
+def html_to_text(markup):
+    """Readable plain text from an HTML body: tags, scripts and styles dropped"""
+    extractor = _TextExtractor()
+    try:
+        extractor.feed(markup)
+        extractor.close()
+        text = ''.join(extractor.chunks)
+    except Exception:
+        text = unescape(re.sub(r'<[^>]+>', ' ', markup))
+    lines = (SPACES.sub(' ', line).strip() for line in text.split('\n'))
+    return BLANK_LINES.sub('\n\n', '\n'.join(lines)).strip()
+
+def part_text(data, content_type, charset):
+    """Decoded text of a text/plain or text/html part (HTML converted to text)"""
+    text = decode_charset(data, charset)
+    return html_to_text(text) if content_type == 'text/html' else text
+
+def iter_parts(message, want_pdfs=True):
+    """Walk a parsed message once, yielding (kind, filename, part) for "text", "html" and "pdf" parts
+
+    Nothing is decoded here, so callers only pay for the parts they use.
+    """
+    for part in message.walk():
+        if part.is_multipart():
+            continue
+        content_type = part.get_content_type()
+        filename = part.get_filename()
+        if content_type == 'text/plain' and not filename:
+            yield 'text', None, part
+        elif content_type == 'text/html' and not filename:
+            yield 'html', None, part
+        elif want_pdfs and content_type == 'application/pdf' and filename:
+            yield 'pdf', filename, part
+
+def parse_message(raw, want_pdfs=True):
+    """Parse a complete message: (headers, body, body content type, [(filename, pdf bytes)])
+
+    The body is the first text/plain part, else the first text/html part as text.
+    """
+    message = BytesParser(policy=policy.default).parsebytes(raw)
+    text_part, html_part, pdfs = None, None, []
+    for kind, filename, part in iter_parts(message, want_pdfs):
+        if kind == 'text' and text_part is None:
+            text_part = part
+        elif kind == 'html' and html_part is None:
+            html_part = part
+        elif kind == 'pdf':
+            pdfs.append((filename, part.get_payload(decode=True) or b''))
+
+    body_part = text_part if text_part is not None else html_part
+    if body_part is None:
+        return message, "", None, pdfs
+    content_type = body_part.get_content_type()
+    data = body_part.get_payload(decode=True) or b''
+    return message, part_text(data, content_type, body_part.get_content_charset()), content_type, pdfs
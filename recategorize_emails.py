@@ -1,5 +1,6 @@
 from pymongo import MongoClient
-from email_service import categorize_email
+from batch_categorizer import recategorize
+from mailbox_stats import record_recategorized
 
 # MongoDB setup
 MONGO_URI = "mongodb://localhost:27017"
@@ -11,26 +12,9 @@ def recategorize_all_emails():
     try:
         print("\nStarting email recategorization...")
         
-        # Get all emails
-        emails = list(emails_collection.find({}))
-        total = len(emails)
-        print(f"Found {total} emails to recategorize")
-        
-        # Update categories
-        for i, email in enumerate(emails, 1):
-            new_category = categorize_email({
-                'subject': email.get('subject', ''),
-                'body': email.get('body', ''),
-                'sender': email.get('sender', '')
-            })
-            
-            emails_collection.update_one(
-                {'_id': email['_id']},
-                {'$set': {'category': new_category}}
-            )
-            
-            if i % 10 == 0:
-                print(f"Processed {i}/{total} emails")
+        # Streamed and classified in parallel; only changed categories are written
+        stats = recategorize(emails_collection, on_change=record_recategorized)
+        print(f"Recategorized {stats['changed']} of {stats['scanned']} emails")
         
         # Get category counts
         categories = emails_collection.distinct('category')
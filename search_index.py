@@ -0,0 +1,289 @@
+import argparse
+import heapq
+import math
+import re
+import uuid
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+from operator import itemgetter
+from bson import ObjectId
+from pymongo import MongoClient, ReplaceOne, UpdateOne
+from pymongo.errors import PyMongoError
+from db_indexes import ensure_indexes
+
+# MongoDB setup
+MONGO_URI = "mongodb://localhost:27017"
+client = MongoClient(MONGO_URI)
+db = client.email_dashboard
+emails_collection = db.emails
+postings_collection = db.search_postings
+search_docs_collection = db.search_docs
+search_stats_collection = db.search_stats
+
+# Persistent inverted index over email subject, summary, sender and body,
+# ranked with BM25. Each term's postings ({e: email id, f: weighted term
+# frequency, l: weighted document length}) live in one or more blocks of
+# search_postings, so a query reads only the blocks of its own terms.
+# search_docs keeps each email's terms with the block each was added to
+# ("blocks": [[term, block _id]]), so it can be re-indexed or removed by
+# updating just those blocks.
+#
+# Emails carry the index version they were indexed under in
+# "search_indexed"; anything that changes an indexed field unsets it, and
+# index_pending() picks those emails up, the same way categorization
+# tracks its ruleset version. Services and chat requests index
+# concurrently, so each email is claimed (like the summary queue) before it
+# is indexed, and only the claiming writer touches its postings and the
+# corpus counters.
+
+INDEX_VERSION = 1
+FIELD_WEIGHTS = {"subject": 3, "summary": 2, "sender": 2, "body": 1}
+# Long bodies are indexed up to this many terms
+MAX_BODY_TERMS = 5000
+# Postings per block, keeping blocks far below the document size limit
+BLOCK_SIZE = 5000
+INDEX_BATCH_SIZE = 500
+K1 = 1.2
+B = 0.75
+STATS_ID = "corpus"
+# A claim left by a writer that died is taken over after this long
+CLAIM_TIMEOUT = timedelta(minutes=10)
+
+TOKEN = re.compile(r"[^\W_]+")
+STOPWORDS = frozenset("""
+a an and are as at be but by for from has have i in is it its my of on or our so
+that the this to was we were will with you your me what when where which who how
+""".split())
+
+# Query words that also match their usual companions
+QUERY_EXPANSIONS = {
+    'food': ['swiggy', 'zomato', 'order', 'food', 'delivery', 'restaurant'],
+    'exam': ['exam', 'test', 'assessment', 'schedule', 'examination'],
+    'meeting': ['meet', 'zoom', 'conference', 'discussion', 'call'],
+    'academic': ['convocation', 'graduation', 'ceremony', 'degree', 'university'],
+    'travel': ['flight', 'ticket', 'booking', 'travel', 'departure']
+}
+EXPANSION_WEIGHT = 0.5
+
+def tokenize(text):
+    """Lowercased word tokens, without stopwords and one-letter words"""
+    return [
+        token for token in TOKEN.findall((text or '').lower())
+        if len(token) > 1 and token not in STOPWORDS
+    ]
+
+def document_terms(email):
+    """Field-weighted term frequencies and weighted length of an email"""
+    frequencies = Counter()
+    for field, weight in FIELD_WEIGHTS.items():
+        tokens = tokenize(email.get(field))
+        if field == "body":
+            tokens = tokens[:MAX_BODY_TERMS]
+        for token in tokens:
+            frequencies[token] += weight
+    return frequencies, sum(frequencies.values())
+
+def query_terms(query):
+    """{term: weight} for a query, including expansions of known topic words"""
+    terms = {}
+    for token in tokenize(query):
+        for expansion in QUERY_EXPANSIONS.get(token, []):
+            terms.setdefault(expansion, EXPANSION_WEIGHT)
+        terms[token] = 1.0
+    return terms
+
+def _remove_postings(docs):
+    """Drop the postings of previously indexed emails (search_docs entries)"""
+    operations = []
+    for doc in docs:
+        pull = {"$pull": {"p": {"e": doc["_id"]}}, "$inc": {"n": -1}}
+        if "blocks" in doc:
+            operations.extend(UpdateOne({"_id": block_id, "p.e": doc["_id"]}, pull) for _, block_id in doc["blocks"])
+        else:
+            # Entries written before blocks were recorded
+            operations.extend(UpdateOne({"term": term, "p.e": doc["_id"]}, pull) for term in doc["terms"])
+    if operations:
+        postings_collection.bulk_write(operations, ordered=False)
+
+def _target_blocks(terms):
+    """{term: block _id} to add postings to: an open block, or a new one"""
+    blocks = {
+        block["term"]: block["_id"]
+        for block in postings_collection.find({"term": {"$in": terms}, "n": {"$lt": BLOCK_SIZE}}, {"term": 1})
+    }
+    return {term: blocks.get(term) or ObjectId() for term in terms}
+
+def index_emails(emails):
+    """Add emails to the index, replacing any earlier entries for them
+
+    Only the emails' _ids are used; their fields are read after they are
+    claimed. Emails another writer is indexing are skipped, and emails
+    that changed while they were being indexed stay pending.
+    """
+    if not emails:
+        return 0
+    now = datetime.now()
+    token = uuid.uuid4().hex
+    emails_collection.update_many(
+        {"_id": {"$in": [email["_id"] for email in emails]}, "$or": [
+            {"search_claim": {"$exists": False}},
+            {"search_claimed_at": {"$lt": now - CLAIM_TIMEOUT}}
+        ]},
+        {"$set": {"search_claim": token, "search_claimed_at": now}}
+    )
+    emails = list(emails_collection.find({"search_claim": token}, {field: 1 for field in FIELD_WEIGHTS}))
+    if not emails:
+        return 0
+    email_ids = [email["_id"] for email in emails]
+    previous = list(search_docs_collection.find({"_id": {"$in": email_ids}}))
+    _remove_postings(previous)
+
+    postings = defaultdict(list)
+    doc_terms, mark_operations = [], []
+    added_length = 0
+    for email in emails:
+        frequencies, length = document_terms(email)
+        for term, frequency in frequencies.items():
+            postings[term].append({"e": email["_id"], "f": frequency, "l": length})
+        added_length += length
+        doc_terms.append((email["_id"], list(frequencies), length))
+        # Only mark emails whose indexed fields are what was just indexed
+        mark_operations.append(UpdateOne(
+            {"_id": email["_id"], "search_claim": token, **{field: email.get(field) for field in FIELD_WEIGHTS}},
+            {"$set": {"search_indexed": INDEX_VERSION}, "$unset": {"search_claim": "", "search_claimed_at": ""}}
+        ))
+
+    # One push per term per batch; a block may overshoot BLOCK_SIZE by one batch
+    blocks = _target_blocks(list(postings))
+    postings_collection.bulk_write([
+        UpdateOne(
+            {"_id": blocks[term]},
+            {"$push": {"p": {"$each": entries}}, "$inc": {"n": len(entries)}, "$setOnInsert": {"term": term}},
+            upsert=True
+        )
+        for term, entries in postings.items()
+    ], ordered=False)
+    search_docs_collection.bulk_write([
+        ReplaceOne(
+            {"_id": email_id},
+            {"blocks": [[term, blocks[term]] for term in terms], "length": length},
+            upsert=True
+        )
+        for email_id, terms, length in doc_terms
+    ], ordered=False)
+    search_stats_collection.update_one(
+        {"_id": STATS_ID},
+        {"$inc": {
+            "documents": len(emails) - len(previous),
+            "total_length": added_length - sum(doc["length"] for doc in previous),
+            "generation": 1
+        }},
+        upsert=True
+    )
+    emails_collection.bulk_write(mark_operations, ordered=False)
+    # Emails edited meanwhile are released, still pending
+    emails_collection.update_many(
+        {"search_claim": token},
+        {"$unset": {"search_claim": "", "search_claimed_at": ""}}
+    )
+    return len(emails)
+
+def remove_emails(email_ids):
+    """Take deleted emails out of the index"""
+    # Whoever deletes an email's entry removes its postings, so concurrent
+    # callers can't both take it out of the counters
+    docs = [doc for doc in (search_docs_collection.find_one_and_delete({"_id": email_id}) for email_id in email_ids) if doc]
+    if not docs:
+        return 0
+    _remove_postings(docs)
+    search_stats_collection.update_one(
+        {"_id": STATS_ID},
+        {"$inc": {"documents": -len(docs), "total_length": -sum(doc["length"] for doc in docs), "generation": 1}}
+    )
+    return len(docs)
+
+def index_pending(limit=None):
+    """Index emails that are new or changed since they were indexed; returns how many"""
+    projection = {field: 1 for field in FIELD_WEIGHTS}
+    cursor = emails_collection.find(
+        {"search_indexed": {"$ne": INDEX_VERSION}}, projection,
+        batch_size=INDEX_BATCH_SIZE, limit=limit or 0
+    )
+    indexed, batch = 0, []
+    for email in cursor:
+        batch.append(email)
+        if len(batch) >= INDEX_BATCH_SIZE:
+            indexed += index_emails(batch)
+            batch = []
+    indexed += index_emails(batch)
+    return indexed
+
+def index_new_emails():
+    """index_pending() for the ingestion services, which must not fail on it"""
+    try:
+        indexed = index_pending()
+        if indexed:
+            print(f"Indexed {indexed} emails for search")
+    except PyMongoError as e:
+        print(f"Error updating search index: {e}")
+
+def rebuild():
+    """Drop the index and build it again from every email"""
+    postings_collection.delete_many({})
+    search_docs_collection.delete_many({})
+    # The generation keeps counting, so caches see the rebuild as a change
+    search_stats_collection.update_one(
+        {"_id": STATS_ID},
+        {"$set": {"documents": 0, "total_length": 0}, "$inc": {"generation": 1}},
+        upsert=True
+    )
+    emails_collection.update_many({"search_indexed": {"$exists": True}}, {"$unset": {"search_indexed": ""}})
+    return index_pending()
+
+def generation():
+    """Counter bumped whenever the searchable content of the mailbox changes"""
+    stats = search_stats_collection.find_one({"_id": STATS_ID}, {"generation": 1}) or {}
+    return stats.get("generation", 0)
+
+def search(query, k=5):
+    """[(email _id, BM25 score)] of the k best matches for a query"""
+    terms = query_terms(query)
+    if not terms:
+        return []
+    stats = search_stats_collection.find_one({"_id": STATS_ID}) or {}
+    documents = stats.get("documents", 0)
+    if documents <= 0:
+        return []
+    average_length = stats.get("total_length", 0) / documents or 1
+
+    blocks = defaultdict(list)
+    for block in postings_collection.find({"term": {"$in": list(terms)}}, {"term": 1, "p": 1}):
+        blocks[block["term"]].append(block["p"])
+
+    scores = defaultdict(float)
+    for term, term_blocks in blocks.items():
+        frequency = sum(len(postings) for postings in term_blocks)
+        idf = math.log(1 + (documents - frequency + 0.5) / (frequency + 0.5))
+        weight = terms[term] * idf
+        for postings in term_blocks:
+            for posting in postings:
+                tf = posting["f"]
+                norm = K1 * (1 - B + B * posting["l"] / average_length)
+                scores[posting["e"]] += weight * tf * (K1 + 1) / (tf + norm)
+
+    return heapq.nlargest(k, scores.items(), key=itemgetter(1))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maintain the email search index")
+    parser.add_argument("--rebuild", action="store_true", help="drop and rebuild the whole index")
+    args = parser.parse_args()
+
+    ensure_indexes()
+
+    try:
+        if args.rebuild:
+            print(f"Rebuilt search index with {rebuild()} emails")
+        else:
+            print(f"Indexed {index_pending()} new or changed emails")
+    except PyMongoError as e:
+        print(f"Error updating search index: {e}")
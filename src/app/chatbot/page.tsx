@@ -3,7 +3,7 @@
 import { useSession } from "next-auth/react";
 import { redirect } from "next/navigation";
 import { motion } from "framer-motion";
-import { useState } from 'react';
+import { useEffect, useRef, useState } from 'react';
 import { FiSend, FiMail } from 'react-icons/fi';
 
 interface Message {
@@ -16,6 +16,12 @@ export default function Chatbot() {
   const [messages, setMessages] = useState<Message[]>([]);
   const [input, setInput] = useState('');
   const [loading, setLoading] = useState(false);
+  const [answering, setAnswering] = useState(false);
+  const [contextCount, setContextCount] = useState<number | null>(null);
+  const abortRef = useRef<AbortController | null>(null);
+
+  // Leaving the page cancels the answer being streamed
+  useEffect(() => () => abortRef.current?.abort(), []);
 
   if (status === "loading") {
     return (
@@ -45,29 +51,68 @@ export default function Chatbot() {
     setInput('');
     setLoading(true);
 
+    const controller = new AbortController();
+    abortRef.current = controller;
+    let started = false;
+
+    // The first piece of the answer adds the assistant message; later ones replace it
+    const showAnswer = (content: string) => {
+      const append = !started;
+      started = true;
+      setAnswering(true);
+      setMessages(prev => append
+        ? [...prev, { role: 'assistant' as const, content }]
+        : [...prev.slice(0, -1), { role: 'assistant' as const, content }]);
+    };
+
     try {
-      const response = await fetch('http://localhost:5001/api/chat', {
+      // Server-Sent Events: the matching emails first, then the answer as it is generated
+      const response = await fetch('http://localhost:5001/api/chat/stream', {
         method: 'POST',
         headers: { 
           'Content-Type': 'application/json',
-          'Accept': 'application/json'
+          'Accept': 'text/event-stream'
         },
         body: JSON.stringify({ query: input }),
+        signal: controller.signal,
       });
 
-      if (!response.ok) {
+      if (!response.ok || !response.body) {
         throw new Error(`HTTP error! status: ${response.status}`);
       }
 
-      const data = await response.json();
-      
-      const assistantMessage = {
-        role: 'assistant' as const,
-        content: data.response || 'Sorry, I could not process your request.',
-      };
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = '';
+      let answer = '';
+
+      while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        const events = buffer.split('\n\n');
+        buffer = events.pop() || '';
 
-      setMessages(prev => [...prev, assistantMessage]);
+        for (const block of events) {
+          const event = block.match(/^event: (.*)$/m)?.[1];
+          const data = block.match(/^data: (.*)$/m)?.[1];
+          if (!event || !data) continue;
+          const payload = JSON.parse(data);
+
+          if (event === 'context') {
+            setContextCount(payload.emails.length);
+          } else if (event === 'token') {
+            answer += payload.text;
+            showAnswer(answer);
+          } else if (event === 'done') {
+            showAnswer(payload.response || 'Sorry, I could not process your request.');
+          } else if (event === 'error') {
+            throw new Error(payload.details);
+          }
+        }
+      }
     } catch (error) {
+      if (controller.signal.aborted) return;
       console.error('Error:', error);
       const errorMessage = {
         role: 'assistant' as const,
@@ -76,6 +121,8 @@ export default function Chatbot() {
       setMessages(prev => [...prev, errorMessage]);
     } finally {
       setLoading(false);
+      setAnswering(false);
+      setContextCount(null);
     }
   };
 
@@ -123,17 +170,22 @@ export default function Chatbot() {
                   </div>
                 </motion.div>
               ))}
-              {loading && (
+              {loading && !answering && (
                 <motion.div
                   initial={{ opacity: 0 }}
                   animate={{ opacity: 1 }}
                   className="flex justify-start"
                 >
                   <div className="bg-black/40 p-4 rounded-xl border border-purple-500/20">
-                    <div className="flex gap-2">
+                    <div className="flex gap-2 items-center">
                       <div className="w-2 h-2 bg-purple-500 rounded-full animate-bounce" />
                       <div className="w-2 h-2 bg-purple-500 rounded-full animate-bounce delay-100" />
                       <div className="w-2 h-2 bg-purple-500 rounded-full animate-bounce delay-200" />
+                      {contextCount !== null && (
+                        <span className="ml-2 text-sm text-purple-200/60">
+                          Reading {contextCount} related email{contextCount === 1 ? '' : 's'}...
+                        </span>
+                      )}
                     </div>
                   </div>
                 </motion.div>
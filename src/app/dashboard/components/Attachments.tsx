@@ -30,39 +30,10 @@ export default function Attachments() {
     fetchAttachments();
   }, []);
 
-  const handleDownload = async (attachment: PDFAttachment) => {
-    try {
-      const response = await fetch(`http://localhost:5001/api/attachment/${attachment.id}`);
-      if (!response.ok) {
-        throw new Error('Failed to download attachment');
-      }
-      const data = await response.json();
-      if (data.error) {
-        throw new Error(data.error);
-      }
-      
-      // Convert base64 to blob
-      const content = atob(data.content);
-      const bytes = new Uint8Array(content.length);
-      for (let i = 0; i < content.length; i++) {
-        bytes[i] = content.charCodeAt(i);
-      }
-      const blob = new Blob([bytes], { type: 'application/pdf' });
-      
-      // Create download link
-      const url = window.URL.createObjectURL(blob);
-      const link = document.createElement('a');
-      link.href = url;
-      link.download = attachment.filename;
-      document.body.appendChild(link);
-      link.click();
-      document.body.removeChild(link);
-      window.URL.revokeObjectURL(url);
-    } catch (error) {
-      console.error('Error downloading attachment:', error);
-      alert('Failed to download attachment');
-    }
-  };
+  // Opened in a new tab so the browser streams the PDF straight from the
+  // server (with Range support) instead of buffering it all in memory
+  const downloadUrl = (attachment: PDFAttachment) =>
+    `http://localhost:5001/api/attachment/${attachment.id}/raw`;
 
   if (loading) {
     return (
@@ -99,13 +70,16 @@ export default function Attachments() {
                   <span>{attachment.size}</span>
                 </div>
               </div>
-              <button
-                onClick={() => handleDownload(attachment)}
+              <a
+                href={downloadUrl(attachment)}
+                target="_blank"
+                rel="noopener noreferrer"
+                title={`Download ${attachment.filename}`}
                 className="shrink-0 p-2 rounded-lg bg-black/40 border border-purple-500/20
                   hover:bg-black/60 hover:border-purple-500/40 transition-colors duration-150"
               >
                 <FiDownload className="w-4 h-4 text-purple-400" />
-              </button>
+              </a>
             </div>
           </div>
         ))}
@@ -0,0 +1,144 @@
+import json
+import os
+import logging
+from summary_cache import cache_key, get_cached_summary, cache_summary
+from llm_backend import SUMMARY_MODEL, create_client, create_async_client
+
+# OpenAI setup
+openai_client = create_client("Email Summary Service")
+# Async client for the summary worker, which does its own rate limiting and retries
+async_openai_client = create_async_client("Email Summary Service", max_retries=0)
+
+SUMMARY_PROMPT = (
+    "Summarize this email in one sentence:\n"
+    "                    \n"
+    "                    Subject: {subject}\n"
+    "                    Body: {body}"
+)
+# Bodies are cut to roughly this many words before summarizing
+MAX_BODY_WORDS = 1000
+
+# Output budget per summary, also counted against tokens-per-minute limits
+MAX_SUMMARY_TOKENS = 100
+# Placeholders stored when no summary could be produced
+FAILED_SUMMARIES = ("Error in summarization", "Unable to generate summary", "No summary generated")
+
+# Batch mode packs several short emails into one request and asks for a
+# JSON array of summaries back, so bulk jobs are not dominated by
+# per-request overhead on one-line notifications
+BATCH_SUMMARY_PROMPT = (
+    "Summarize each of the following {count} emails in one sentence.\n"
+    "Reply with only a JSON array of {count} strings, one summary per email, in the order given.\n"
+    "\n"
+    "{emails}"
+)
+BATCH_EMAIL = "Email {number}:\nSubject: {subject}\nBody: {body}\n"
+SUMMARY_BATCH_SIZE = int(os.getenv('SUMMARY_BATCH_SIZE', 10))
+# Prompt tokens allowed in one batch request
+BATCH_TOKEN_BUDGET = int(os.getenv('SUMMARY_BATCH_TOKENS', 4000))
+# Longer emails are summarized on their own
+BATCH_MAX_EMAIL_TOKENS = 400
+# Output budget per email in a batch
+BATCH_SUMMARY_TOKENS = 60
+
+def estimate_tokens(text):
+    """Rough token count, at about 4 characters a token"""
+    return len(text) // 4
+
+def truncate_body(body):
+    # Truncate body if it's too long (roughly 1000 words)
+    return ' '.join(body.split()[:MAX_BODY_WORDS]) if body else ''
+
+def build_prompt(subject, body):
+    """Cache key and prompt for an email, with the body truncated to MAX_BODY_WORDS"""
+    truncated_body = truncate_body(body)
+    key = cache_key(SUMMARY_MODEL, SUMMARY_PROMPT, subject, truncated_body)
+    return key, SUMMARY_PROMPT.format(subject=subject, body=truncated_body)
+
+def batch_entry(subject, body):
+    """Cache key, subject and truncated body of an email in a batch prompt"""
+    truncated_body = truncate_body(body)
+    key = cache_key(SUMMARY_MODEL, BATCH_SUMMARY_PROMPT, subject, truncated_body)
+    return key, subject or '', truncated_body
+
+def pack_batches(emails, batch_size=SUMMARY_BATCH_SIZE, token_budget=BATCH_TOKEN_BUDGET):
+    """Group emails (dicts with subject and body) for summarization
+
+    Short emails are packed into groups of up to batch_size within
+    token_budget prompt tokens; long ones get a group of their own.
+    """
+    groups, current, current_tokens = [], [], 0
+    for email in emails:
+        _, subject, body = batch_entry(email.get('subject', ''), email.get('body', ''))
+        tokens = estimate_tokens(BATCH_EMAIL.format(number=0, subject=subject, body=body))
+        if tokens > BATCH_MAX_EMAIL_TOKENS:
+            groups.append([email])
+            continue
+        if current and (len(current) >= batch_size or current_tokens + tokens > token_budget):
+            groups.append(current)
+            current, current_tokens = [], 0
+        current.append(email)
+        current_tokens += tokens
+    if current:
+        groups.append(current)
+    return groups
+
+def build_batch_prompt(entries):
+    """One prompt asking for a summary of each (key, subject, body) entry"""
+    emails = '\n'.join(
+        BATCH_EMAIL.format(number=number, subject=subject, body=body)
+        for number, (_, subject, body) in enumerate(entries, 1)
+    )
+    return BATCH_SUMMARY_PROMPT.format(count=len(entries), emails=emails)
+
+def parse_batch_summaries(content, count):
+    """The summaries in a JSON-array reply, or None unless it holds exactly `count` of them"""
+    text = content or ''
+    # Tolerate a markdown code fence or a sentence around the array
+    start, end = text.find('['), text.rfind(']')
+    if start < 0 or end < start:
+        return None
+    try:
+        summaries = json.loads(text[start:end + 1])
+    except ValueError:
+        return None
+    if not isinstance(summaries, list) or len(summaries) != count:
+        return None
+    if not all(isinstance(summary, str) and summary.strip() for summary in summaries):
+        return None
+    return [summary.strip() for summary in summaries]
+
+def summary_from_completion(completion):
+    """The summary text of a completion, or one of the failure placeholders"""
+    if not completion or not hasattr(completion, 'choices') or not completion.choices:
+        logging.error("OpenAI API response is empty or invalid.")
+        return "Unable to generate summary"
+
+    message_content = completion.choices[0].message.content
+    if not message_content:
+        logging.error("OpenAI API response does not contain a summary.")
+        return "No summary generated"
+    return message_content
+
+def summarize_email(subject, body):
+    """One-sentence summary of an email, served from the summary cache when possible"""
+    try:
+        key, prompt = build_prompt(subject, body)
+        cached = get_cached_summary(key)
+        if cached:
+            return cached
+
+        completion = openai_client.chat.completions.create(
+            model=SUMMARY_MODEL,
+            messages=[{"role": "user", "content": prompt}],
+            max_tokens=MAX_SUMMARY_TOKENS
+        )
+
+        summary = summary_from_completion(completion)
+        if summary not in FAILED_SUMMARIES:
+            cache_summary(key, SUMMARY_MODEL, summary)
+        return summary
+
+    except Exception as e:
+        logging.error(f"Error summarizing email: {str(e)}")
+        return "Error in summarization"
@@ -0,0 +1,130 @@
+import hashlib
+import os
+import threading
+from collections import Counter
+from datetime import datetime
+from pymongo import MongoClient
+
+# MongoDB setup
+MONGO_URI = "mongodb://localhost:27017"
+client = MongoClient(MONGO_URI)
+db = client.email_dashboard
+summary_cache_collection = db.summary_cache
+cache_stats_collection = db.summary_cache_stats
+
+# Persistent cache of LLM summaries keyed on a hash of the model, the prompt
+# template and the whitespace-normalized subject and body, so identical
+# newsletters, templated notifications and re-ingested mail are summarized
+# once. Entries expire after CACHE_TTL_DAYS (TTL index) and the least
+# recently used ones are evicted beyond CACHE_MAX_ENTRIES.
+
+CACHE_TTL_DAYS = int(os.getenv('SUMMARY_CACHE_TTL_DAYS', 30))
+CACHE_MAX_ENTRIES = int(os.getenv('SUMMARY_CACHE_MAX_ENTRIES', 50000))
+# Eviction runs once per this many new entries
+EVICT_EVERY = 100
+# Hit/miss counters are written to MongoDB in batches of this many events
+FLUSH_EVERY = 20
+STATS_ID = "summary_cache"
+
+_metrics = Counter()
+_metrics_lock = threading.Lock()
+_puts_since_evict = 0
+
+def normalize_text(text):
+    """Collapse runs of whitespace so formatting-only differences share an entry"""
+    return ' '.join((text or '').split())
+
+def cache_key(model, template, subject, body):
+    """SHA-256 of model, prompt template and normalized content"""
+    parts = [model, template, normalize_text(subject), normalize_text(body)]
+    return hashlib.sha256('\0'.join(parts).encode('utf-8')).hexdigest()
+
+def _record(event, count=1):
+    with _metrics_lock:
+        _metrics[event] += count
+        if sum(_metrics.values()) < FLUSH_EVERY:
+            return
+        pending = dict(_metrics)
+        _metrics.clear()
+    _flush(pending)
+
+def _flush(pending):
+    if not pending:
+        return
+    try:
+        cache_stats_collection.update_one(
+            {"_id": STATS_ID},
+            {"$inc": pending, "$set": {"updated_at": datetime.now()}},
+            upsert=True
+        )
+    except Exception as e:
+        print(f"Error saving summary cache stats: {e}")
+
+def get_cached_summary(key):
+    """The cached summary for a key (refreshing its LRU timestamp), or None"""
+    try:
+        entry = summary_cache_collection.find_one_and_update(
+            {"_id": key},
+            {"$set": {"last_used_at": datetime.now()}, "$inc": {"hits": 1}},
+            projection={"summary": 1}
+        )
+    except Exception as e:
+        print(f"Summary cache lookup failed: {e}")
+        return None
+    _record("hits" if entry else "misses")
+    return entry["summary"] if entry else None
+
+def cache_summary(key, model, summary):
+    """Store a freshly generated summary"""
+    global _puts_since_evict
+    now = datetime.now()
+    try:
+        summary_cache_collection.update_one(
+            {"_id": key},
+            {"$set": {"summary": summary, "model": model, "created_at": now, "last_used_at": now, "hits": 0}},
+            upsert=True
+        )
+    except Exception as e:
+        print(f"Summary cache write failed: {e}")
+        return
+    _record("stores")
+
+    with _metrics_lock:
+        _puts_since_evict += 1
+        due = _puts_since_evict >= EVICT_EVERY
+        if due:
+            _puts_since_evict = 0
+    if due:
+        evict_least_recently_used()
+
+def evict_least_recently_used(max_entries=CACHE_MAX_ENTRIES):
+    """Delete the least recently used entries beyond max_entries"""
+    excess = summary_cache_collection.estimated_document_count() - max_entries
+    if excess <= 0:
+        return 0
+    stale_ids = [entry["_id"] for entry in summary_cache_collection.find(
+        {}, {"_id": 1}, sort=[("last_used_at", 1)], limit=excess
+    )]
+    result = summary_cache_collection.delete_many({"_id": {"$in": stale_ids}})
+    _record("evictions", result.deleted_count)
+    return result.deleted_count
+
+def cache_stats():
+    """Hit, miss, store and eviction counts, hit rate and current size"""
+    with _metrics_lock:
+        pending = dict(_metrics)
+        _metrics.clear()
+    _flush(pending)
+
+    stats = cache_stats_collection.find_one({"_id": STATS_ID}) or {}
+    hits, misses = stats.get("hits", 0), stats.get("misses", 0)
+    return {
+        "hits": hits,
+        "misses": misses,
+        "stores": stats.get("stores", 0),
+        "evictions": stats.get("evictions", 0),
+        "hit_rate": round(hits / (hits + misses), 4) if hits + misses else None,
+        "entries": summary_cache_collection.estimated_document_count(),
+        "max_entries": CACHE_MAX_ENTRIES,
+        "ttl_days": CACHE_TTL_DAYS
+    }
@@ -0,0 +1,254 @@
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from openai import APIConnectionError, APIStatusError, APITimeoutError
+from pymongo import MongoClient
+from summarizer import (
+    SUMMARY_MODEL, MAX_SUMMARY_TOKENS, BATCH_SUMMARY_TOKENS, FAILED_SUMMARIES,
+    async_openai_client, estimate_tokens, build_prompt, summary_from_completion,
+    batch_entry, build_batch_prompt, pack_batches, parse_batch_summaries
+)
+from summary_cache import get_cached_summary, cache_summary
+from db_indexes import ensure_indexes
+
+# MongoDB setup
+MONGO_URI = "mongodb://localhost:27017"
+client = MongoClient(MONGO_URI)
+db = client.email_dashboard
+emails_collection = db.emails
+
+# Asynchronous summarization queue. Ingestion stores emails with
+# summary_status "pending" and returns; this worker claims pending emails,
+# summarizes up to SUMMARY_CONCURRENCY of them at once within the provider's
+# requests-per-minute and tokens-per-minute quotas, and writes the summaries
+# back. Claims expire, so emails held by a worker that died are picked up
+# again. With batch_size above 1, short emails are claimed and summarized
+# several to a request.
+
+SUMMARY_CONCURRENCY = int(os.getenv('SUMMARY_CONCURRENCY', 8))
+SUMMARY_RPM = float(os.getenv('SUMMARY_RPM', 60))
+SUMMARY_TPM = float(os.getenv('SUMMARY_TPM', 100000))
+MAX_ATTEMPTS = 6
+# Retry delays are drawn from [0, min(BACKOFF_CAP, BACKOFF_BASE * 2**attempt)]
+BACKOFF_BASE = 1
+BACKOFF_CAP = 60
+# Seconds between queue scans while there is nothing to summarize
+IDLE_POLL = 5
+CLAIM_TIMEOUT = timedelta(minutes=10)
+
+class TokenBucket:
+    """Allows `per_minute` units a minute, in bursts of at most a minute's worth"""
+
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.rate = per_minute / 60
+        self.tokens = per_minute
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self, amount=1):
+        if self.rate <= 0:
+            return
+        amount = min(amount, self.capacity)
+        # Waiters queue on the lock, so they are served in arrival order
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+
+    def pause(self, seconds):
+        """Empty the bucket and hold refills for `seconds` (after a 429)"""
+        self.tokens = 0
+        self.updated = max(self.updated, time.monotonic() + seconds)
+
+def is_retryable(error):
+    if isinstance(error, (APIConnectionError, APITimeoutError)):
+        return True
+    return isinstance(error, APIStatusError) and (error.status_code == 429 or error.status_code >= 500)
+
+def retry_after(error):
+    """Seconds from a Retry-After header, if the provider sent one"""
+    response = getattr(error, 'response', None)
+    try:
+        return float(response.headers.get('retry-after'))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+def backoff_delay(attempt):
+    """Full-jitter exponential backoff"""
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+
+async def request_completion(prompt, max_tokens, requests, tokens):
+    """Chat completion for a prompt, waiting for quota and retrying 429s and 5xx errors"""
+    for attempt in range(MAX_ATTEMPTS):
+        await requests.acquire()
+        # Output tokens count against the quota too
+        await tokens.acquire(estimate_tokens(prompt) + max_tokens)
+        try:
+            return await async_openai_client.chat.completions.create(
+                model=SUMMARY_MODEL,
+                messages=[{"role": "user", "content": prompt}],
+                max_tokens=max_tokens
+            )
+        except Exception as e:
+            if not is_retryable(e) or attempt == MAX_ATTEMPTS - 1:
+                raise
+            delay = retry_after(e) or backoff_delay(attempt)
+            if getattr(e, 'status_code', None) == 429:
+                # Over quota: every task waits, not just this one
+                requests.pause(delay)
+                tokens.pause(delay)
+            logging.warning(f"Summary request failed ({e}), retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+async def summarize(subject, body, requests, tokens, use_cache=True):
+    """Summary of one email"""
+    key, prompt = build_prompt(subject, body)
+    cached = await asyncio.to_thread(get_cached_summary, key) if use_cache else None
+    if cached:
+        return cached
+
+    completion = await request_completion(prompt, MAX_SUMMARY_TOKENS, requests, tokens)
+    summary = summary_from_completion(completion)
+    if use_cache and summary not in FAILED_SUMMARIES:
+        await asyncio.to_thread(cache_summary, key, SUMMARY_MODEL, summary)
+    return summary
+
+async def summarize_or_error(email, requests, tokens, use_cache=True):
+    try:
+        return await summarize(email.get('subject', ''), email.get('body', ''), requests, tokens, use_cache)
+    except Exception as e:
+        logging.error(f"Error summarizing email {email['_id']}: {e}")
+        return "Error in summarization"
+
+async def summarize_batch(emails, requests, tokens, use_cache=True):
+    """Summaries of several short emails from one request
+
+    Falls back to one request per email when the reply is not a JSON array
+    with one summary per email.
+    """
+    entries = [batch_entry(email.get('subject', ''), email.get('body', '')) for email in emails]
+    if use_cache:
+        summaries = await asyncio.to_thread(lambda: [get_cached_summary(key) for key, _, _ in entries])
+    else:
+        summaries = [None] * len(entries)
+    todo = [i for i, summary in enumerate(summaries) if not summary]
+
+    if len(todo) > 1:
+        parsed = None
+        try:
+            completion = await request_completion(
+                build_batch_prompt([entries[i] for i in todo]),
+                BATCH_SUMMARY_TOKENS * len(todo), requests, tokens
+            )
+            parsed = parse_batch_summaries(summary_from_completion(completion), len(todo))
+        except Exception as e:
+            logging.error(f"Error in batch summary request: {e}")
+        if parsed:
+            for i, summary in zip(todo, parsed):
+                summaries[i] = summary
+                if use_cache:
+                    await asyncio.to_thread(cache_summary, entries[i][0], SUMMARY_MODEL, summary)
+            return summaries
+        logging.warning(f"Unusable batch summary reply, summarizing {len(todo)} emails individually")
+
+    singles = await asyncio.gather(*(summarize_or_error(emails[i], requests, tokens, use_cache) for i in todo))
+    for i, summary in zip(todo, singles):
+        summaries[i] = summary
+    return summaries
+
+def claim_batch(collection, limit):
+    """Mark up to `limit` of the newest pending emails as in progress and return them"""
+    now = datetime.now()
+    claimable = {"$or": [
+        {"summary_status": "pending"},
+        {"summary_status": "in_progress", "summary_claimed_at": {"$lt": now - CLAIM_TIMEOUT}}
+    ]}
+    candidates = [email["_id"] for email in collection.find(
+        claimable, {"_id": 1}, sort=[("processed_at", -1)], limit=limit
+    )]
+    if not candidates:
+        return []
+    # Another worker may claim some of the same emails first; the token
+    # tells which ones this worker won
+    token = uuid.uuid4().hex
+    collection.update_many(
+        {"_id": {"$in": candidates}, **claimable},
+        {"$set": {"summary_status": "in_progress", "summary_claimed_at": now, "summary_claim": token}}
+    )
+    return list(collection.find(
+        {"_id": {"$in": candidates}, "summary_claim": token},
+        {"subject": 1, "body": 1, "processed_at": 1}
+    ))
+
+def store_summary(collection, email_id, summary):
+    if summary in FAILED_SUMMARIES:
+        update = {"$set": {"summary": summary, "summary_status": "failed"}}
+    else:
+        update = {"$set": {"summary": summary}, "$unset": {"summary_status": ""}}
+    # The summary is searchable, so the email is re-indexed and re-embedded
+    update.setdefault("$unset", {}).update({
+        "summary_claimed_at": "", "summary_claim": "", "search_indexed": "", "embedded": ""
+    })
+    collection.update_one({"_id": email_id}, update)
+
+async def consume(collection, requests, tokens, stats, batch_size, stop_when_empty, use_cache):
+    while True:
+        emails = await asyncio.to_thread(claim_batch, collection, batch_size)
+        if not emails:
+            if stop_when_empty:
+                return
+            await asyncio.sleep(IDLE_POLL)
+            continue
+
+        for group in pack_batches(emails, batch_size):
+            if len(group) > 1:
+                summaries = await summarize_batch(group, requests, tokens, use_cache)
+            else:
+                summaries = [await summarize_or_error(group[0], requests, tokens, use_cache)]
+            for email, summary in zip(group, summaries):
+                await asyncio.to_thread(store_summary, collection, email["_id"], summary)
+                stats["failed" if summary in FAILED_SUMMARIES else "summarized"] += 1
+
+async def run_worker(collection=emails_collection, concurrency=SUMMARY_CONCURRENCY,
+                     rpm=SUMMARY_RPM, tpm=SUMMARY_TPM, batch_size=1, stop_when_empty=False,
+                     use_cache=True):
+    """Summarize queued emails; with stop_when_empty, return once the queue is drained
+
+    batch_size > 1 packs up to that many short emails into each request,
+    which suits bulk jobs; live ingestion keeps one email per request.
+    Without use_cache the summary cache is neither read nor written.
+    Returns counts of summarized and failed emails.
+    """
+    requests, tokens = TokenBucket(rpm), TokenBucket(tpm)
+    stats = {"summarized": 0, "failed": 0}
+    await asyncio.gather(*(
+        consume(collection, requests, tokens, stats, batch_size, stop_when_empty, use_cache)
+        for _ in range(concurrency)
+    ))
+    return stats
+
+def start_background_worker(**kwargs):
+    """Run the worker on its own event loop in a daemon thread"""
+    thread = threading.Thread(
+        target=lambda: asyncio.run(run_worker(**kwargs)),
+        name="summary-worker",
+        daemon=True
+    )
+    thread.start()
+    return thread
+
+if __name__ == "__main__":
+    ensure_indexes()
+    print(f"Summarizing queued emails ({SUMMARY_CONCURRENCY} at a time, {SUMMARY_RPM:.0f} RPM, {SUMMARY_TPM:.0f} TPM)...")
+    asyncio.run(run_worker())
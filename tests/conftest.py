@@ -0,0 +1,15 @@
+import functools
+import os
+import sys
+import mongomock
+import mongomock.gridfs
+import pymongo
+from mongomock.store import ServerStore
+
+# The modules connect to MongoDB when imported; the tests run them against
+# one in-memory server instead, shared like the real one so an index
+# created through db_indexes applies to every module's collections
+mongomock.gridfs.enable_gridfs_integration()
+pymongo.MongoClient = functools.partial(mongomock.MongoClient, _store=ServerStore())
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,120 @@
+import base64
+import io
+import random
+import pytest
+from pymongo.errors import DuplicateKeyError
+import attachment_store
+from attachment_store import (
+    base64_decoded_size, iter_base64_range, store_attachment, release_attachment, read_attachment, email_ref
+)
+
+PDF = b"%PDF-1.4 test document " * 100
+
+class MemoryBucket:
+    """The GridFSBucket calls attachment_store makes, kept in memory (mongomock has no working GridFS)"""
+
+    def __init__(self, files_collection):
+        self.files_collection = files_collection
+        self.blobs = {}
+
+    def upload_from_stream_with_id(self, file_id, filename, data):
+        self.files_collection.insert_one({"_id": file_id, "filename": filename, "length": len(data)})
+        self.blobs[file_id] = data
+
+    def open_download_stream(self, file_id):
+        return io.BytesIO(self.blobs[file_id])
+
+    def delete(self, file_id):
+        self.files_collection.delete_one({"_id": file_id})
+        del self.blobs[file_id]
+
+@pytest.fixture
+def store(monkeypatch):
+    attachment_store.ensure_indexes(["pdf_attachments"])
+    attachment_store.attachments_collection.delete_many({})
+    attachment_store.blob_files_collection.delete_many({})
+    monkeypatch.setattr(attachment_store, "blob_bucket", MemoryBucket(attachment_store.blob_files_collection))
+    yield attachment_store.attachments_collection
+    attachment_store.attachments_collection.delete_many({})
+    attachment_store.blob_files_collection.delete_many({})
+
+@pytest.mark.parametrize("size", [0, 1, 2, 3, 4, 5, 100, 1000])
+def test_base64_decoded_size(size):
+    data = bytes(range(256)) * 4
+    assert base64_decoded_size(base64.b64encode(data[:size]).decode()) == size
+
+@pytest.mark.parametrize("chunk_size", [3, 6, 48, 3 * 1024])
+def test_iter_base64_range_matches_slices(chunk_size):
+    rng = random.Random(chunk_size)
+    data = rng.randbytes(1000)
+    content = base64.b64encode(data).decode()
+    ranges = [(0, len(data)), (0, 1), (999, 1000), (1, 2), (2, 5), (500, 500)]
+    ranges += [tuple(sorted(rng.sample(range(len(data) + 1), 2))) for _ in range(50)]
+    for start, stop in ranges:
+        assert b"".join(iter_base64_range(content, start, stop, chunk_size)) == data[start:stop], (start, stop)
+
+def test_iter_base64_range_padded_tail():
+    for size in (1, 2, 4, 5):
+        data = bytes(range(size))
+        content = base64.b64encode(data).decode()
+        assert b"".join(iter_base64_range(content, 0, size, 3)) == data
+        assert b"".join(iter_base64_range(content, size - 1, size, 3)) == data[-1:]
+
+def test_iter_base64_range_chunks_are_bounded():
+    data = bytes(300)
+    content = base64.b64encode(data).decode()
+    chunks = list(iter_base64_range(content, 10, 290, 48))
+    assert all(len(chunk) <= 48 for chunk in chunks)
+    assert sum(map(len, chunks)) == 280
+
+def test_same_content_is_stored_once(store):
+    first = store_attachment(PDF, "a.pdf", email_ref(1, "INBOX", 7))
+    second = store_attachment(PDF, "b.pdf", email_ref(2, "INBOX", 7))
+    assert first == second
+    attachment = store.find_one({"_id": first})
+    assert attachment["ref_count"] == 2
+    assert attachment["email_refs"] == ["INBOX/7/1", "INBOX/7/2"]
+    assert attachment["filename"] == "a.pdf"
+    assert read_attachment(attachment) == PDF
+    assert attachment_store.blob_files_collection.count_documents({}) == 1
+
+def test_refetch_of_same_ref_adds_nothing(store):
+    ref = email_ref(1, "INBOX", 7)
+    first = store_attachment(PDF, "a.pdf", ref)
+    assert store_attachment(PDF, "a.pdf", ref) == first
+    assert store.count_documents({}) == 1
+    assert store.find_one({"_id": first})["ref_count"] == 1
+
+def test_release_deletes_at_zero_refs(store):
+    refs = [email_ref(1, "INBOX", 7), email_ref(2, "INBOX", 7)]
+    attachment_id = store_attachment(PDF, "a.pdf", refs[0])
+    store_attachment(PDF, "a.pdf", refs[1])
+
+    assert release_attachment(attachment_id, refs[0]) is False
+    assert store.find_one({"_id": attachment_id})["email_refs"] == [refs[1]]
+    # Releasing a reference twice changes nothing
+    assert release_attachment(attachment_id, refs[0]) is False
+    assert store.find_one({"_id": attachment_id})["ref_count"] == 1
+
+    assert release_attachment(attachment_id, refs[1]) is True
+    assert store.find_one({"_id": attachment_id}) is None
+    assert attachment_store.blob_files_collection.count_documents({}) == 0
+
+def test_store_after_release_starts_over(store):
+    ref = email_ref(1, "INBOX", 7)
+    release_attachment(store_attachment(PDF, "a.pdf", ref), ref)
+    attachment_id = store_attachment(PDF, "a.pdf", ref)
+    assert read_attachment(store.find_one({"_id": attachment_id})) == PDF
+
+def test_gives_up_when_deleted_every_attempt(store, monkeypatch):
+    # The content is released and deleted again right after every upsert
+    # fails on the unique index
+    update_one = store.update_one
+
+    def deleted_meanwhile(query, update, upsert=False):
+        if upsert:
+            raise DuplicateKeyError("E11000 duplicate key")
+        return update_one(query, update)
+    monkeypatch.setattr(store, "update_one", deleted_meanwhile)
+    with pytest.raises(RuntimeError):
+        store_attachment(PDF, "a.pdf", email_ref(1))
@@ -0,0 +1,87 @@
+import random
+import string
+import pytest
+from categorizer import (
+    PROMOTION_INDICATORS, SPAM_INDICATORS, CATEGORY_KEYWORDS, SUSPICIOUS_SENDER_DOMAINS,
+    TRIAGE_SPAM_INDICATORS, TEMPORARY_INDICATORS, PhraseMatcher, matcher, match_phrases,
+    categorize_email, triage_email
+)
+
+# The substring checks the phrase matcher replaced, over the same rule lists
+
+def substring_categorize(email_content):
+    content = f"{email_content['subject']} {email_content['body']}".lower()
+    sender = email_content.get('sender', '').lower()
+    promo_count = sum(1 for indicator in PROMOTION_INDICATORS if indicator in content)
+    if promo_count >= 2 or 'unsubscribe' in content.lower():
+        return 'promotions'
+    spam_count = sum(1 for indicator in SPAM_INDICATORS if indicator in content)
+    if spam_count >= 2 or any(indicator in sender for indicator in SUSPICIOUS_SENDER_DOMAINS):
+        return 'spam'
+    for category, keywords in CATEGORY_KEYWORDS.items():
+        if any(keyword in content for keyword in keywords):
+            return category
+    return 'general'
+
+def substring_triage(email):
+    content = f"{email['subject']} {email['body']}".lower()
+    sender = email['sender'].lower()
+    spam_count = sum(1 for indicator in TRIAGE_SPAM_INDICATORS if indicator in content)
+    if spam_count >= 2 or any(indicator in sender for indicator in SUSPICIOUS_SENDER_DOMAINS):
+        return 'spam'
+    if any(term in content for term in TEMPORARY_INDICATORS):
+        return 'temporary'
+    return 'primary'
+
+def random_text(rng, words):
+    """Rule phrases, pieces of them and noise, glued together with and without spaces"""
+    pieces = []
+    for _ in range(rng.randint(0, 12)):
+        choice = rng.random()
+        if choice < 0.3:
+            piece = rng.choice(matcher.phrases)
+        elif choice < 0.5:
+            phrase = rng.choice(matcher.phrases)
+            start = rng.randrange(len(phrase))
+            piece = phrase[start:rng.randint(start + 1, len(phrase))]
+        elif choice < 0.8:
+            piece = rng.choice(words)
+        else:
+            piece = ''.join(rng.choice(string.ascii_letters + string.digits + ".%'-") for _ in range(rng.randint(1, 6)))
+        if rng.random() < 0.3:
+            piece = piece.upper()
+        pieces.append(piece)
+        pieces.append(rng.choice([' ', ' ', '', '. ', '\n', '-']))
+    return ''.join(pieces)
+
+WORDS = "hello team the report is attached please see below thanks regards your order free win".split()
+
+@pytest.mark.parametrize("seed", range(20))
+def test_rules_match_substring_checks(seed):
+    rng = random.Random(seed)
+    for _ in range(250):
+        email = {
+            "subject": random_text(rng, WORDS),
+            "body": random_text(rng, WORDS),
+            "sender": rng.choice(["alice@example.com", "deals@shop.xyz", "Promo@WIN.TOP", "x@clickbait.com", ""])
+                      + random_text(rng, WORDS)[:10]
+        }
+        assert categorize_email(email) == substring_categorize(email), email
+        assert triage_email(email) == substring_triage(email), email
+
+@pytest.mark.parametrize("seed", range(5))
+def test_matched_phrases_are_exactly_the_substrings(seed):
+    rng = random.Random(seed)
+    for _ in range(200):
+        text = random_text(rng, WORDS).lower()
+        hits = match_phrases(text)
+        assert {phrase for phrase in matcher.phrases if hits[phrase]} == {phrase for phrase in matcher.phrases if phrase in text}
+
+def test_counts_include_overlaps_and_prefixes():
+    phrases = PhraseMatcher(['win', 'winner', 'inner', 'aa'])
+    assert phrases.counts('winner winwin aaa') == {'win': 3, 'winner': 1, 'inner': 1, 'aa': 2}
+
+def test_regex_metacharacters_are_literal():
+    phrases = PhraseMatcher(['% off', '.xyz', 'a+b'])
+    assert phrases.counts('50% off at shop.xyz') == {'% off': 1, '.xyz': 1}
+    assert not phrases.counts('shopaxyz aab')
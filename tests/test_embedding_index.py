@@ -0,0 +1,100 @@
+import os
+import numpy as np
+import pytest
+from bson import ObjectId
+from embedding_index import EmbeddingIndex, INT8_SCALE, ID_SIZE
+
+DIM = 16
+
+def unit_vectors(rng, count):
+    vectors = rng.standard_normal((count, DIM)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+@pytest.fixture
+def rng():
+    return np.random.default_rng(7)
+
+def new_index(tmp_path, dtype="float32"):
+    return EmbeddingIndex(str(tmp_path), dtype=dtype, model="test-model")
+
+def brute_force(ids, vectors, query, k):
+    scores = vectors @ query
+    order = np.argsort(scores)[::-1][:k]
+    return [(ids[i], float(scores[i])) for i in order]
+
+def test_search_matches_brute_force(tmp_path, rng):
+    index = new_index(tmp_path)
+    ids = [ObjectId() for _ in range(300)]
+    vectors = unit_vectors(rng, 300)
+    # Several appends, as ingestion does
+    for start in range(0, 300, 70):
+        index.append(ids[start:start + 70], vectors[start:start + 70])
+    for query in unit_vectors(rng, 5):
+        results = index.search(query, k=10)
+        expected = brute_force(ids, vectors, query, 10)
+        assert [email_id for email_id, _ in results] == [email_id for email_id, _ in expected]
+        assert [score for _, score in results] == pytest.approx([score for _, score in expected], abs=1e-5)
+
+def test_replace_keeps_only_latest_row(tmp_path, rng):
+    index = new_index(tmp_path)
+    ids = [ObjectId() for _ in range(3)]
+    old, new = unit_vectors(rng, 3), unit_vectors(rng, 1)
+    index.append(ids, old)
+    index.append(ids[:1], new)
+    results = dict(index.search(new[0], k=10))
+    assert len(results) == 3
+    assert results[ids[0]] == pytest.approx(1.0, abs=1e-5)
+    # The replaced row no longer matches its old vector
+    assert dict(index.search(old[0], k=10))[ids[0]] == pytest.approx(float(new[0] @ old[0]), abs=1e-5)
+
+def test_tombstones_hide_removed_emails(tmp_path, rng):
+    index = new_index(tmp_path)
+    ids = [ObjectId() for _ in range(4)]
+    vectors = unit_vectors(rng, 4)
+    index.append(ids, vectors)
+    index.remove(ids[:2])
+    assert {email_id for email_id, _ in index.search(vectors[0], k=10)} == set(ids[2:])
+    index.remove(ids[2:])
+    assert index.search(vectors[0], k=10) == []
+
+def test_int8_scaling(tmp_path, rng):
+    index = new_index(tmp_path, "int8")
+    ids = [ObjectId() for _ in range(50)]
+    vectors = unit_vectors(rng, 50)
+    index.append(ids, vectors)
+    stored = np.fromfile(os.path.join(tmp_path, "vectors.bin"), dtype=np.int8).reshape(50, DIM)
+    assert np.abs(stored).max() <= INT8_SCALE
+    assert np.allclose(stored / INT8_SCALE, vectors, atol=0.5 / INT8_SCALE + 1e-6)
+
+    query = vectors[3]
+    results = dict(index.search(query, k=50))
+    assert results[ids[3]] == pytest.approx(1.0, abs=0.02)
+    expected = dict(brute_force(ids, vectors, query, 50))
+    for email_id, score in results.items():
+        assert score == pytest.approx(expected[email_id], abs=0.02)
+
+def test_torn_append_does_not_shift_later_rows(tmp_path, rng):
+    index = new_index(tmp_path)
+    first, second = [ObjectId()], [ObjectId()]
+    vectors = unit_vectors(rng, 2)
+    index.append(first, vectors[:1])
+    # A process that died after writing its vectors but before its ids,
+    # and a half-written id
+    with open(os.path.join(tmp_path, "vectors.bin"), 'ab') as f:
+        f.write(unit_vectors(rng, 1).tobytes())
+    with open(os.path.join(tmp_path, "ids.bin"), 'ab') as f:
+        f.write(ObjectId().binary[:ID_SIZE // 2])
+
+    reader = new_index(tmp_path)
+    assert [email_id for email_id, _ in reader.search(vectors[0], k=5)] == first
+
+    index.append(second, vectors[1:])
+    results = dict(new_index(tmp_path).search(vectors[1], k=5))
+    assert set(results) == {first[0], second[0]}
+    assert results[second[0]] == pytest.approx(1.0, abs=1e-5)
+    assert os.path.getsize(os.path.join(tmp_path, "ids.bin")) == 2 * ID_SIZE
+
+def test_other_model_is_rejected(tmp_path, rng):
+    new_index(tmp_path).append([ObjectId()], unit_vectors(rng, 1))
+    with pytest.raises(ValueError):
+        EmbeddingIndex(str(tmp_path), model="other-model").append([ObjectId()], unit_vectors(rng, 1))
@@ -0,0 +1,133 @@
+import base64
+from imap_fetch import (
+    uid_set, parse_fetch_response, parse_bodystructure, wanted_parts,
+    _fill_message, decode_fetched
+)
+
+# FETCH responses as imaplib returns them from Gmail: literals arrive as
+# (prefix, bytes) tuples followed by the rest of the line
+ALTERNATIVE = (
+    b'("TEXT" "PLAIN" ("CHARSET" "UTF-8") NIL NIL "QUOTED-PRINTABLE" 120 4 NIL NIL NIL)'
+    b'("TEXT" "HTML" ("CHARSET" "UTF-8") NIL NIL "QUOTED-PRINTABLE" 480 10 NIL NIL NIL)'
+    b' "ALTERNATIVE" ("BOUNDARY" "000000000000a1b2c3") NIL NIL'
+)
+WITH_PDF = (
+    b'((' + ALTERNATIVE.replace(b'000000000000a1b2c3', b'inner') + b')'
+    b'("APPLICATION" "PDF" ("NAME" "invoice.pdf") "<f_lx1>" NIL "BASE64" 88000 NIL'
+    b' ("ATTACHMENT" ("FILENAME" "invoice.pdf")) NIL) "MIXED" ("BOUNDARY" "outer") NIL NIL)'
+)
+HEADER_RESPONSE = [
+    (b'1 (UID 101 RFC822.SIZE 2345 BODYSTRUCTURE (' + ALTERNATIVE + b') BODY[HEADER] {38}',
+     b'Subject: Hello\r\nFrom: a@example.com\r\n\r\n'),
+    b')',
+    (b'2 (UID 102 RFC822.SIZE 90210 BODYSTRUCTURE ' + WITH_PDF + b' BODY[HEADER] {15}',
+     b'Subject: Bill\r\n\r\n'),
+    b')'
+]
+
+def parsed_structure(structure):
+    response = parse_fetch_response([b'1 (UID 1 BODYSTRUCTURE ' + structure + b')'])
+    return parse_bodystructure(response[1]['BODYSTRUCTURE'])
+
+def test_uid_set_compresses_runs():
+    assert uid_set([5, 1, 2, 3, 7, 8, 10]) == '1:3,5,7:8,10'
+
+def test_uid_set_single_and_duplicates():
+    assert uid_set([4, 4]) == '4'
+    assert uid_set([]) == ''
+
+def test_parse_fetch_response_reads_literals_and_atoms():
+    messages = parse_fetch_response(HEADER_RESPONSE)
+    assert sorted(messages) == [101, 102]
+    assert messages[101]['RFC822.SIZE'] == b'2345'
+    assert messages[101]['BODY[HEADER]'] == b'Subject: Hello\r\nFrom: a@example.com\r\n\r\n'
+    assert messages[102]['BODY[HEADER]'] == b'Subject: Bill\r\n\r\n'
+
+def test_parse_fetch_response_flags_and_nil():
+    messages = parse_fetch_response([
+        b'3 (UID 7 FLAGS (\\Seen \\Flagged) MODSEQ (12345))',
+        b'4 (FLAGS () UID 8 X-GM-LABELS NIL)'
+    ])
+    assert messages[7]['FLAGS'] == [b'\\Seen', b'\\Flagged']
+    assert messages[8]['FLAGS'] == []
+    assert messages[8]['X-GM-LABELS'] is None
+
+def test_parse_fetch_response_unescapes_quoted_strings():
+    messages = parse_fetch_response([b'1 (UID 9 X-TEST "say \\"hi\\" \\\\ bye")'])
+    assert messages[9]['X-TEST'] == b'say "hi" \\ bye'
+
+def test_parse_fetch_response_ignores_entries_without_uid():
+    assert parse_fetch_response([b'1 (FLAGS (\\Seen))', None]) == {}
+
+def test_parse_bodystructure_alternative():
+    parts = parsed_structure(b'(' + ALTERNATIVE + b')')
+    assert [(part["section"], part["content_type"]) for part in parts] == [('1', 'text/plain'), ('2', 'text/html')]
+    assert parts[0]["charset"] == 'UTF-8'
+    assert parts[0]["encoding"] == 'quoted-printable'
+    assert parts[1]["size"] == 480
+
+def test_parse_bodystructure_nested_with_pdf():
+    parts = parse_bodystructure(parse_fetch_response(HEADER_RESPONSE)[102]['BODYSTRUCTURE'])
+    assert [part["section"] for part in parts] == ['1.1', '1.2', '2']
+    assert parts[2] == {
+        "section": '2',
+        "content_type": 'application/pdf',
+        "charset": None,
+        "encoding": 'base64',
+        "size": 88000,
+        "filename": 'invoice.pdf'
+    }
+
+def test_parse_bodystructure_single_part():
+    parts = parsed_structure(b'("TEXT" "PLAIN" ("CHARSET" "ISO-8859-1") NIL NIL "7BIT" 42 2 NIL NIL NIL)')
+    assert parts == [{
+        "section": '1', "content_type": 'text/plain', "charset": 'ISO-8859-1',
+        "encoding": '7bit', "size": 42, "filename": None
+    }]
+
+def test_parse_bodystructure_encoded_filenames():
+    rfc2047 = parsed_structure(
+        b'("APPLICATION" "PDF" ("NAME" "=?UTF-8?B?ZmFjdHVyZS3DqXTDqS5wZGY=?=") NIL NIL "BASE64" 10 NIL'
+        b' ("ATTACHMENT" ("FILENAME" "=?UTF-8?B?ZmFjdHVyZS3DqXTDqS5wZGY=?=")) NIL)'
+    )
+    assert rfc2047[0]["filename"] == 'facture-été.pdf'
+    rfc2231 = parsed_structure(
+        b'("APPLICATION" "PDF" NIL NIL NIL "BASE64" 10 NIL'
+        b' ("ATTACHMENT" ("FILENAME*" "utf-8\'\'r%C3%A9sum%C3%A9.pdf")) NIL)'
+    )
+    assert rfc2231[0]["filename"] == 'résumé.pdf'
+
+def test_parse_bodystructure_skips_forwarded_message_fields():
+    # message/rfc822 carries an envelope, body and line count before its disposition
+    parts = parsed_structure(
+        b'(("TEXT" "PLAIN" ("CHARSET" "UTF-8") NIL NIL "7BIT" 10 1 NIL NIL NIL)'
+        b'("MESSAGE" "RFC822" NIL NIL NIL "7BIT" 300 (NIL "Fwd" NIL NIL NIL NIL NIL NIL NIL NIL)'
+        b' ("TEXT" "PLAIN" ("CHARSET" "UTF-8") NIL NIL "7BIT" 20 1 NIL NIL NIL) 12 NIL'
+        b' ("ATTACHMENT" ("FILENAME" "fwd.eml")) NIL) "MIXED" ("BOUNDARY" "x") NIL NIL)'
+    )
+    assert parts[1]["content_type"] == 'message/rfc822'
+    assert parts[1]["filename"] == 'fwd.eml'
+
+def test_wanted_parts_prefers_plain_text_and_pdfs():
+    parts = parse_bodystructure(parse_fetch_response(HEADER_RESPONSE)[102]['BODYSTRUCTURE'])
+    assert [part["section"] for part in wanted_parts(parts)] == ['1.1', '2']
+    assert [part["section"] for part in wanted_parts(parts, want_pdfs=False)] == ['1.1']
+    html_only = [part for part in parts if part["content_type"] != 'text/plain']
+    assert [part["section"] for part in wanted_parts(html_only)] == ['1.2', '2']
+
+def test_raw_fetch_decodes_later():
+    part = {"section": '1', "content_type": 'text/html', "charset": 'iso-8859-1',
+            "encoding": 'base64', "size": 30, "filename": None}
+    message = {
+        "uid": 5,
+        "raw_headers": b'Subject: =?utf-8?q?caf=C3=A9?=\r\n\r\n',
+        "pdfs": [],
+        "wanted": [part]
+    }
+    _fill_message(message, {'BODY[1]': base64.b64encode('<p>déjà vu</p>'.encode('latin-1'))}, raw=True)
+    assert "body_type" not in message
+
+    assert decode_fetched(message) == []
+    assert str(message["headers"]["subject"]) == 'café'
+    assert message["body"] == 'déjà vu'
+    assert message["body_type"] == 'text/html'
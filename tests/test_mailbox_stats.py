@@ -0,0 +1,72 @@
+from datetime import datetime, timedelta
+import pytest
+from bson import ObjectId
+import mailbox_stats
+from mailbox_stats import (
+    category_key, category_name, category_distribution, reconcile, record_inserted, record_recategorized
+)
+
+START = datetime(2026, 1, 1)
+
+@pytest.fixture
+def mailbox():
+    emails, stats = mailbox_stats.emails_collection, mailbox_stats.mailbox_stats_collection
+    emails.delete_many({})
+    stats.delete_many({})
+    # mongomock ignores partialFilterExpression, so the unique UID index
+    # would reject these emails without UIDs
+    emails.drop_indexes()
+    yield emails
+    emails.delete_many({})
+    stats.delete_many({})
+
+def new_email(i, category, folder="inbox"):
+    return {
+        "_id": ObjectId(), "subject": f"Email {i}", "sender": "someone@example.com",
+        "date": START + timedelta(hours=i), "category": category, "folder": folder
+    }
+
+def insert(emails, documents):
+    emails.insert_many(documents)
+    record_inserted(documents)
+
+def recategorize(emails, email, category):
+    emails.update_one({"_id": email["_id"]}, {"$set": {"category": category}})
+    record_recategorized([(email["_id"], email["category"], category)])
+    email["category"] = category
+
+@pytest.mark.parametrize("category", ["work", "a.b", "$x", "50%", "%2E", "$.%"])
+def test_category_key_round_trip(category):
+    key = category_key(category)
+    assert '.' not in key and not key.startswith('$')
+    assert category_name(key) == category
+
+def test_hooks_agree_with_reconcile(mailbox):
+    documents = [new_email(i, category) for i, category in enumerate(["work", "work", "promo.tions", "$odd", "spam"])]
+    insert(mailbox, documents[:2])
+    before = reconcile()["version"]
+
+    insert(mailbox, documents[2:] + [new_email(10, "work", folder="sent")])
+    recategorize(mailbox, documents[0], "spam")
+    # Out of spam, back into the recent list
+    recategorize(mailbox, documents[4], "personal")
+    recategorize(mailbox, documents[2], "$odd")
+    insert(mailbox, [new_email(20 + i, "news") for i in range(4)])
+    # The newest email leaves the recent list
+    recategorize(mailbox, mailbox.find_one({"subject": "Email 23"}), "spam")
+
+    stats = mailbox_stats.get_stats()
+    assert stats["version"] > before
+    assert category_distribution(stats) == {"work": 1, "$odd": 2, "personal": 1, "news": 3}
+    assert stats["total_emails"] == 7
+    assert [email["subject"] for email in stats["recent_emails"]] == ["Email 22", "Email 21", "Email 20", "Email 4", "Email 3"]
+    assert reconcile()["version"] == stats["version"]
+
+def test_reconcile_fixes_drift(mailbox):
+    insert(mailbox, [new_email(0, "work")])
+    version = reconcile()["version"]
+    # A write that bypasses the hooks
+    mailbox.insert_one(new_email(1, "a.b"))
+    stats = reconcile()
+    assert stats["version"] == version + 1
+    assert category_distribution(stats) == {"work": 1, "a.b": 1}
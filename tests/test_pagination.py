@@ -0,0 +1,78 @@
+import json
+from datetime import datetime, timedelta
+import pytest
+from bson import ObjectId
+import app as dashboard
+from app import encode_cursor, parse_cursor, keyset_filter
+
+ORDER = [('processed_at', -1), ('_id', -1)]
+
+@pytest.fixture
+def emails():
+    collection = dashboard.db.emails
+    collection.delete_many({})
+    # mongomock ignores partialFilterExpression, so the unique UID index
+    # would reject these emails without UIDs
+    collection.drop_indexes()
+    start = datetime(2026, 1, 1)
+    documents = []
+    for i in range(40):
+        document = {"_id": ObjectId(), "subject": f"Email {i}"}
+        # Ties on processed_at and documents without one at all
+        if i % 7 == 0:
+            pass
+        elif i % 5 == 0:
+            document["processed_at"] = None
+        else:
+            document["processed_at"] = start + timedelta(hours=i // 3)
+        documents.append(document)
+    collection.insert_many(documents)
+    yield collection
+    collection.delete_many({})
+
+def test_cursor_round_trip():
+    object_id = ObjectId()
+    processed_at = datetime(2026, 3, 4, 5, 6, 7, 890000)
+    assert parse_cursor(encode_cursor({"_id": object_id, "processed_at": processed_at})) == (processed_at, object_id)
+    assert parse_cursor(encode_cursor({"_id": object_id})) == (None, object_id)
+
+@pytest.mark.parametrize("page_size", [1, 3, 7, 40])
+def test_keyset_pages_cover_everything_once(emails, page_size):
+    expected = [doc["_id"] for doc in emails.find({}, {"_id": 1}).sort(ORDER)]
+    seen, query = [], {}
+    while True:
+        page = list(emails.find(query).sort(ORDER).limit(page_size))
+        seen.extend(doc["_id"] for doc in page)
+        if len(page) < page_size:
+            break
+        query = keyset_filter(parse_cursor(encode_cursor(page[-1])))
+    assert seen == expected
+
+def test_stored_emails_endpoint_pages(emails):
+    client = dashboard.app.test_client()
+    seen, url = [], '/api/stored-emails?limit=6&fields=subject'
+    while url:
+        data = client.get(url).get_json()
+        assert data["total"] == 40
+        assert data["count"] == len(data["emails"]) <= 6
+        seen.extend(email["subject"] for email in data["emails"])
+        url = f"/api/stored-emails?limit=6&fields=subject&after={data['next_cursor']}" if data["has_more"] else None
+    assert sorted(seen) == sorted(f"Email {i}" for i in range(40))
+    assert len(seen) == len(set(seen))
+
+def test_stored_emails_rejects_bad_cursor(emails):
+    response = dashboard.app.test_client().get('/api/stored-emails?after=not-a-cursor')
+    assert response.status_code == 400
+
+def test_categorized_stream_error_keeps_valid_json(emails, monkeypatch):
+    iter_categorized_emails = dashboard.iter_categorized_emails
+
+    def failing(query):
+        # The cursor dies after the first chunk has been sent
+        items = iter_categorized_emails(query)
+        yield next(items)
+        raise RuntimeError("cursor killed")
+    monkeypatch.setattr(dashboard, "iter_categorized_emails", failing)
+    data = json.loads(dashboard.app.test_client().get('/api/categorized-emails').get_data(as_text=True))
+    assert len(data["emails"]) == 1
+    assert data["error"] == "cursor killed"
@@ -0,0 +1,123 @@
+import math
+from datetime import datetime
+import pytest
+import search_index
+from search_index import (
+    tokenize, document_terms, query_terms, index_emails, index_pending, remove_emails, search, K1, B
+)
+
+EMAILS = [
+    {"subject": "Flight booking confirmed", "sender": "airline", "body": "Your flight to Goa departs at 6am. Ticket attached."},
+    {"subject": "Weekly newsletter", "sender": "news", "body": "Flight deals, hotel deals and more deals this week."},
+    {"subject": "Team meeting", "sender": "boss", "body": "Zoom call tomorrow to discuss the flight budget."},
+    {"subject": "Invoice", "sender": "billing", "summary": "Invoice for March", "body": "Amount due: 500. Pay by Friday."},
+    {"subject": "Exam schedule", "sender": "university", "body": "The examination schedule for the semester is out."}
+]
+
+@pytest.fixture
+def mailbox():
+    collections = [
+        search_index.emails_collection, search_index.postings_collection,
+        search_index.search_docs_collection, search_index.search_stats_collection
+    ]
+    for collection in collections:
+        collection.delete_many({})
+    # mongomock ignores partialFilterExpression, so the unique UID index
+    # would reject these emails without UIDs
+    search_index.emails_collection.drop_indexes()
+    result = search_index.emails_collection.insert_many([dict(email) for email in EMAILS])
+    yield result.inserted_ids
+    for collection in collections:
+        collection.delete_many({})
+
+def brute_force_bm25(query, emails):
+    """BM25 over the emails as stored, computed directly from document_terms()"""
+    documents = {email["_id"]: document_terms(email) for email in emails}
+    average_length = sum(length for _, length in documents.values()) / len(documents)
+    scores = {}
+    for term, weight in query_terms(query).items():
+        matching = [email_id for email_id, (frequencies, _) in documents.items() if term in frequencies]
+        idf = math.log(1 + (len(documents) - len(matching) + 0.5) / (len(matching) + 0.5))
+        for email_id in matching:
+            frequencies, length = documents[email_id]
+            tf = frequencies[term]
+            norm = K1 * (1 - B + B * length / average_length)
+            scores[email_id] = scores.get(email_id, 0) + weight * idf * tf * (K1 + 1) / (tf + norm)
+    return scores
+
+def test_tokenize_drops_stopwords_and_short_words():
+    assert tokenize("The flight to Goa, a 2-day trip!") == ["flight", "goa", "day", "trip"]
+    assert tokenize(None) == []
+
+def test_document_terms_weights_fields():
+    frequencies, length = document_terms({"subject": "flight", "summary": "flight", "sender": "", "body": "flight deals"})
+    assert frequencies["flight"] == 3 + 2 + 1
+    assert frequencies["deals"] == 1
+    assert length == 7
+
+def test_query_terms_expands_topics():
+    terms = query_terms("travel plans")
+    assert terms["travel"] == 1.0 and terms["plans"] == 1.0
+    assert terms["flight"] == search_index.EXPANSION_WEIGHT
+
+@pytest.mark.parametrize("query", ["flight", "flight deals", "invoice march", "exam", "travel"])
+def test_search_matches_brute_force_bm25(mailbox, query):
+    assert index_pending() == len(EMAILS)
+    expected = brute_force_bm25(query, search_index.emails_collection.find())
+    results = search(query, k=len(EMAILS))
+    assert {email_id for email_id, _ in results} == set(expected)
+    for email_id, score in results:
+        assert score == pytest.approx(expected[email_id])
+    assert [score for _, score in results] == sorted((score for _, score in results), reverse=True)
+
+def test_subject_match_outranks_body_match(mailbox):
+    index_pending()
+    best, _ = search("flight", k=1)[0]
+    assert best == mailbox[0]
+
+def test_reindex_and_remove_keep_stats_consistent(mailbox):
+    index_pending()
+    search_index.emails_collection.update_one(
+        {"_id": mailbox[1]}, {"$set": {"body": "Nothing to see"}, "$unset": {"search_indexed": ""}}
+    )
+    assert index_pending() == 1
+    assert mailbox[1] not in {email_id for email_id, _ in search("deals")}
+
+    assert remove_emails([mailbox[0], mailbox[0]]) == 1
+    stats = search_index.search_stats_collection.find_one({"_id": search_index.STATS_ID})
+    remaining = list(search_index.emails_collection.find({"_id": {"$ne": mailbox[0]}}))
+    assert stats["documents"] == len(remaining)
+    assert stats["total_length"] == sum(document_terms(email)[1] for email in remaining)
+
+def test_claimed_emails_are_skipped(mailbox):
+    search_index.emails_collection.update_one(
+        {"_id": mailbox[0]}, {"$set": {"search_claim": "other-writer", "search_claimed_at": datetime.now()}}
+    )
+    assert index_emails([{"_id": email_id} for email_id in mailbox]) == len(EMAILS) - 1
+    assert mailbox[0] not in {email_id for email_id, _ in search("flight")}
+
+def test_reindex_updates_only_recorded_blocks(mailbox, monkeypatch):
+    monkeypatch.setattr(search_index, "BLOCK_SIZE", 2)
+    for email_id in mailbox:
+        index_emails([{"_id": email_id}])
+    # "flight" is in three emails, so with two postings per block it spans two blocks
+    blocks = list(search_index.postings_collection.find({"term": "flight"}))
+    assert sorted(block["n"] for block in blocks) == [1, 2]
+
+    doc = search_index.search_docs_collection.find_one({"_id": mailbox[2]})
+    block_id = dict(doc["blocks"])["flight"]
+    search_index.emails_collection.update_one({"_id": mailbox[2]}, {"$set": {"body": "Zoom call tomorrow"}})
+    index_emails([{"_id": mailbox[2]}])
+    block = search_index.postings_collection.find_one({"_id": block_id})
+    assert mailbox[2] not in [posting["e"] for posting in block["p"]]
+    assert block["n"] == len(block["p"])
+    assert mailbox[2] not in {email_id for email_id, _ in search("flight")}
+
+def test_remove_legacy_entries_without_blocks(mailbox):
+    index_pending()
+    doc = search_index.search_docs_collection.find_one({"_id": mailbox[0]})
+    search_index.search_docs_collection.replace_one(
+        {"_id": mailbox[0]}, {"terms": [term for term, _ in doc["blocks"]], "length": doc["length"]}
+    )
+    assert remove_emails([mailbox[0]]) == 1
+    assert not search_index.postings_collection.find_one({"p.e": mailbox[0]})